@@ -0,0 +1,54 @@
+"""
+Gunicorn settings for production (Procfile and render.yaml).
+
+Every value can be overridden from the environment; WEB_CONCURRENCY is the
+variable Render and most PaaS use for the worker count. Requests spend most
+of their time waiting on the database, so each worker runs a few threads
+(gthread) instead of adding processes, which keeps memory per instance flat.
+"""
+import os
+
+
+def _cpu_count():
+    # Respect the CPUs this container may actually use, not the host total.
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# One process per CPU (plus one to cover a worker being recycled) runs Python
+# on every core; threads absorb the time each request waits on I/O.
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_CONCURRENCY', _cpu_count() + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+# Import Django, the URLconf and the views once in the master, then fork.
+preload_app = True
+
+# Keep idle connections from the platform's proxy open between requests
+# instead of a new TCP (and TLS) handshake per request.
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 65))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+
+# Recycle workers to bound slow memory growth; the jitter stops all workers
+# from restarting at the same moment.
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# Heartbeat files on tmpfs, so a slow container disk cannot stall workers.
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    # Nothing should connect while the app is preloaded, but a connection
+    # inherited from the master must never be shared between workers.
+    from django.db import connections
+    connections.close_all()
@@ -0,0 +1,187 @@
+"""
+Per-user account summaries.
+
+``UserAccountSummary`` holds what a member's page needs: open loans with their
+due dates, the fines assessed on returned loans, and the ids of pending
+reservations and borrow requests. It is updated on every circulation event --
+by signals for single-row saves and deletes, and explicitly by the set-based
+paths that skip signals (bulk approval, bulk cancellation, expiry) -- so
+reading it is one primary-key lookup however long the user's history is.
+Overdue counts and accruing fines depend on the clock and are derived from the
+stored due dates when the summary is read.
+
+Updates record the current state of a row (a loan is open or not, a
+reservation is pending or not), so applying an event twice changes nothing.
+The fine total is the one running sum; a loan's fine is added when it leaves
+the open set. A summary that does not exist yet is built from the tables
+instead, and the event that triggered it is already part of that build.
+"""
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum
+from django.utils.timezone import is_naive, make_aware, now
+
+from .models import BorrowedBook, BorrowedBookArchive, BorrowRequest, Reservation, UserAccountSummary
+
+FINE_PER_DAY = 5
+SUMMARY_FIELDS = ['open_loans', 'fines_assessed', 'pending_reservations', 'pending_requests', 'updated_at']
+
+
+def _decimal(value):
+    return Decimal(str(value or 0))
+
+
+def _aware(value):
+    # Due dates parsed from a bare YYYY-MM-DD are naive; stored and compared values must not be.
+    return make_aware(value) if is_naive(value) else value
+
+
+def rebuild_summaries(user_ids):
+    """Recompute the summaries of ``user_ids`` from the loan, reservation and request tables."""
+    user_ids = list(user_ids)
+    summaries = {
+        user_id: UserAccountSummary(user_id=user_id, open_loans={}, fines_assessed=Decimal(0),
+                                    pending_reservations=[], pending_requests=[], updated_at=now())
+        for user_id in user_ids
+    }
+    if not summaries:
+        return 0
+
+    for user_id, loan_id, due_date in BorrowedBook.objects.filter(
+        user_id__in=user_ids, returned_at__isnull=True
+    ).values_list('user_id', 'id', 'due_date'):
+        summaries[user_id].open_loans[str(loan_id)] = due_date.isoformat()
+    # Archived loans were returned, so their fines count as well.
+    for queryset in (
+        BorrowedBook.objects.filter(user_id__in=user_ids, returned_at__isnull=False),
+        BorrowedBookArchive.objects.filter(user_id__in=user_ids),
+    ):
+        for row in queryset.values('user_id').annotate(total=Sum('fine_amount')):
+            summaries[row['user_id']].fines_assessed += _decimal(row['total'])
+    for user_id, reservation_id in Reservation.objects.filter(
+        user_id__in=user_ids, status='pending'
+    ).order_by('id').values_list('user_id', 'id'):
+        summaries[user_id].pending_reservations.append(reservation_id)
+    for user_id, request_id in BorrowRequest.objects.filter(
+        user_id__in=user_ids, status='pending'
+    ).order_by('id').values_list('user_id', 'id'):
+        summaries[user_id].pending_requests.append(request_id)
+
+    UserAccountSummary.objects.bulk_create(
+        summaries.values(),
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=SUMMARY_FIELDS,
+    )
+    return len(summaries)
+
+
+def _update(user_ids, apply, rebuild=(), create=True):
+    """
+    Lock the summaries of ``user_ids`` and call ``apply(summary)`` on each.
+    Missing summaries, and those of ``rebuild``, are built from the tables
+    instead (unless ``create`` is false, when they are left alone).
+    """
+    user_ids = set(user_ids)
+    with transaction.atomic(savepoint=False):
+        summaries = list(
+            UserAccountSummary.objects.select_for_update().filter(user_id__in=user_ids - set(rebuild))
+        )
+        if create:
+            rebuild_summaries(user_ids - {summary.user_id for summary in summaries})
+        for summary in summaries:
+            apply(summary)
+            summary.updated_at = now()
+        if summaries:
+            UserAccountSummary.objects.bulk_update(summaries, SUMMARY_FIELDS)
+
+
+def record_loans(loans, created=False):
+    """Apply the current state of ``loans`` (saved BorrowedBook instances)."""
+    by_user = defaultdict(list)
+    for loan in loans:
+        by_user[loan.user_id].append(loan)
+
+    def apply(summary):
+        for loan in by_user[summary.user_id]:
+            key = str(loan.pk)
+            if loan.returned_at is None:
+                summary.open_loans[key] = _aware(loan.due_date).isoformat()
+            elif summary.open_loans.pop(key, None) is not None or created:
+                summary.fines_assessed += _decimal(loan.fine_amount)
+
+    # Without primary keys (bulk_create on backends that cannot return them) rebuild instead.
+    _update(by_user, apply, rebuild={loan.user_id for loan in loans if loan.pk is None})
+
+
+def record_loan_deletions(loans):
+    """Drop deleted ``loans`` from their users' summaries."""
+    by_user = defaultdict(list)
+    for loan in loans:
+        by_user[loan.user_id].append(loan)
+
+    def apply(summary):
+        for loan in by_user[summary.user_id]:
+            if summary.open_loans.pop(str(loan.pk), None) is None and loan.returned_at is not None:
+                summary.fines_assessed -= _decimal(loan.fine_amount)
+
+    # A missing summary is built on first read; creating one here could race a user deletion.
+    _update(by_user, apply, create=False)
+
+
+def _record_pending(field, rows, create=True):
+    by_user = defaultdict(dict)
+    for row_id, user_id, row_status in rows:
+        by_user[user_id][row_id] = row_status == 'pending'
+
+    def apply(summary):
+        pending = getattr(summary, field)
+        for row_id, is_pending in by_user[summary.user_id].items():
+            if is_pending and row_id not in pending:
+                pending.append(row_id)
+            elif not is_pending and row_id in pending:
+                pending.remove(row_id)
+
+    _update(by_user, apply, rebuild={user_id for user_id, ids in by_user.items() if None in ids},
+            create=create)
+
+
+def record_reservations(rows, create=True):
+    """Apply (reservation_id, user_id, status) rows; a status of None means deleted."""
+    _record_pending('pending_reservations', rows, create)
+
+
+def record_requests(rows, create=True):
+    """Apply (borrow_request_id, user_id, status) rows; a status of None means deleted."""
+    _record_pending('pending_requests', rows, create)
+
+
+def get_summary(user_id, at=None):
+    """Return the account summary of a user as a dict, from a single keyed read."""
+    summary = UserAccountSummary.objects.filter(user_id=user_id).first()
+    if summary is None:
+        rebuild_summaries([user_id])
+        summary = UserAccountSummary.objects.get(user_id=user_id)
+
+    at = at or now()
+    due_dates = sorted(_aware(datetime.fromisoformat(value)) for value in summary.open_loans.values())
+    overdue = [due_date for due_date in due_dates if due_date < at]
+    # Same rate as BorrowedBook.return_book and the serializers' current_fine.
+    accruing = sum(max(0, (at - due_date).days) * FINE_PER_DAY for due_date in overdue)
+    return {
+        'user_id': summary.user_id,
+        'open_loans': len(due_dates),
+        'overdue_loans': len(overdue),
+        'next_due_date': due_dates[0] if due_dates else None,
+        'fines': {
+            'assessed': float(summary.fines_assessed),
+            'accruing': accruing,
+            'total': float(summary.fines_assessed) + accruing,
+        },
+        'pending_reservations': len(summary.pending_reservations),
+        'pending_borrow_requests': len(summary.pending_requests),
+        'updated_at': summary.updated_at,
+    }
@@ -1,37 +1,96 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Book, BorrowedBook, Reservation
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from .fast_serializers import annotate_availability
+from .models import User, Book, Branch, Copy, BorrowedBook, Reservation
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that trusts PostgreSQL's planner estimate for unfiltered
+    changelists on large tables instead of running COUNT(*) over every row.
+    """
+    estimate_threshold = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= self.estimate_threshold:
+                return row[0]
+        return super().count
 
 class CustomUserAdmin(UserAdmin):
     model = User
-    list_display = ['username', 'email', 'role', 'is_staff']
-    fieldsets = UserAdmin.fieldsets + ((None, {'fields': ('role',)}),)
-    add_fieldsets = UserAdmin.add_fieldsets + ((None, {'fields': ('role',)}),)
+    list_display = ['username', 'email', 'role', 'branch', 'is_staff']
+    fieldsets = UserAdmin.fieldsets + ((None, {'fields': ('role', 'branch')}),)
+    add_fieldsets = UserAdmin.add_fieldsets + ((None, {'fields': ('role', 'branch')}),)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 admin.site.register(User, CustomUserAdmin)
 
+@admin.register(Branch)
+class BranchAdmin(admin.ModelAdmin):
+    list_display = ['name', 'code']
+    search_fields = ['name', '=code']
+
 @admin.register(Book)
 class BookAdmin(admin.ModelAdmin):
     list_display = ("title", "author", "isbn", "total_copies", "available_copies")
-    search_fields = ("title", "author", "isbn")
-    list_filter = ("is_borrowed", "author")
+    search_fields = ("title", "author", "=isbn")
+    list_filter = ("is_borrowed", "category")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # One aggregate query for the page instead of a COUNT per row.
+        return annotate_availability(super().get_queryset(request))
 
     def total_copies(self, obj):
         return obj.quantity
     total_copies.short_description = 'Total Copies'
+    total_copies.admin_order_field = 'quantity'
 
     def available_copies(self, obj):
-        return obj.available_copies
+        return obj.annotated_available_copies
     available_copies.short_description = 'Available Copies'
+    available_copies.admin_order_field = 'annotated_available_copies'
+
+@admin.register(Copy)
+class CopyAdmin(admin.ModelAdmin):
+    list_display = ['barcode', 'book', 'branch', 'status', 'location']
+    list_filter = ['branch', 'status']
+    list_select_related = ['book', 'branch']
+    search_fields = ['=barcode', 'book__title']
+    autocomplete_fields = ['book']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 @admin.register(BorrowedBook)
 class BorrowedBookAdmin(admin.ModelAdmin):
-    list_display = ['user', 'book', 'borrowed_at', 'due_date', 'returned_at', 'fine_amount']
-    list_filter = ['returned_at']
-    search_fields = ['user__username', 'book__title']
+    list_display = ['user', 'book', 'copy', 'branch', 'borrowed_at', 'due_date', 'returned_at', 'fine_amount']
+    list_filter = ['branch', 'returned_at']
+    list_select_related = ['user', 'book', 'copy', 'branch']
+    search_fields = ['=user__username', 'book__title', '=copy__barcode']
+    autocomplete_fields = ['user', 'book', 'copy']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 @admin.register(Reservation)
 class ReservationAdmin(admin.ModelAdmin):
-    list_display = ['user', 'book', 'reserved_at', 'status']
-    search_fields = ['user__username', 'book__title']
-    list_filter = ['status']
\ No newline at end of file
+    list_display = ['user', 'book', 'branch', 'reserved_at', 'status']
+    list_select_related = ['user', 'book', 'branch']
+    search_fields = ['=user__username', 'book__title']
+    autocomplete_fields = ['user', 'book']
+    list_filter = ['branch', 'status']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
@@ -0,0 +1,104 @@
+"""
+Archival of closed circulation records.
+
+Returned loans, and reservations and borrow requests that are no longer open,
+are moved out of the live tables once they are older than
+``ARCHIVE_AFTER_DAYS``, so the queries over open loans and pending queues only
+scan current rows. Each batch is copied with one ``INSERT ... SELECT`` and
+removed with one ``DELETE`` in its own short transaction. The archive tables
+keep the original ids and columns: history views read live and archived rows
+together with ``union``, and the account summaries and recommendations count
+both. The raw ``DELETE`` deliberately skips the post_delete signals -- an
+archived loan's fine stays on the patron's account summary.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.timezone import now
+
+from .fast_serializers import borrowed_book_rows, reservation_rows
+from .models import (
+    BorrowedBook, BorrowedBookArchive, BorrowRequest, BorrowRequestArchive,
+    Reservation, ReservationArchive,
+)
+
+DEFAULT_AFTER_DAYS = 365
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_MAX_BATCHES = 50
+
+# (live model, archive model, closed-and-older-than-cutoff condition)
+ARCHIVES = [
+    (BorrowedBook, BorrowedBookArchive,
+     lambda cutoff: Q(returned_at__lt=cutoff)),
+    (Reservation, ReservationArchive,
+     lambda cutoff: Q(status__in=['cancelled', 'fulfilled'], reserved_at__lt=cutoff)),
+    (BorrowRequest, BorrowRequestArchive,
+     lambda cutoff: Q(status__in=['approved', 'rejected', 'queued'], requested_at__lt=cutoff)),
+]
+
+
+def archive_batch(model, archive_model, condition, batch_size):
+    """Move up to ``batch_size`` rows of ``model`` matching ``condition``; returns the number moved."""
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(field.column) for field in model._meta.concrete_fields)
+    live_table = quote(model._meta.db_table)
+    archive_table = quote(archive_model._meta.db_table)
+
+    with transaction.atomic():
+        ids = list(
+            model.objects.select_for_update().filter(condition)
+            .order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return 0
+        placeholders = ', '.join(['%s'] * len(ids))
+        archived_at = connection.ops.adapt_datetimefield_value(now())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {archive_table} ({columns}, {quote('archived_at')}) "
+                f"SELECT {columns}, %s FROM {live_table} WHERE id IN ({placeholders})",
+                [archived_at, *ids],
+            )
+            cursor.execute(f"DELETE FROM {live_table} WHERE id IN ({placeholders})", ids)
+    return len(ids)
+
+
+def archive_closed_records(after_days=None, batch_size=None, max_batches=None):
+    """
+    Archive closed records older than ``after_days``, at most ``max_batches``
+    batches per model. Returns ({model label: rows moved}, more_remaining).
+    """
+    if after_days is None:
+        after_days = getattr(settings, 'ARCHIVE_AFTER_DAYS', DEFAULT_AFTER_DAYS)
+    batch_size = batch_size or getattr(settings, 'ARCHIVE_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    max_batches = max_batches or getattr(settings, 'ARCHIVE_MAX_BATCHES', DEFAULT_MAX_BATCHES)
+    cutoff = now() - timedelta(days=after_days)
+
+    moved, remaining = {}, False
+    for model, archive_model, closed in ARCHIVES:
+        total = 0
+        for _ in range(max_batches):
+            count = archive_batch(model, archive_model, closed(cutoff), batch_size)
+            total += count
+            if count < batch_size:
+                break
+        else:
+            remaining = True
+        moved[model._meta.label] = total
+    return moved, remaining
+
+
+def loan_history_rows(**filters):
+    """``borrowed_book_rows`` over live and archived loans matching ``filters``, newest first."""
+    return borrowed_book_rows(BorrowedBook.objects.filter(**filters)).union(
+        borrowed_book_rows(BorrowedBookArchive.objects.filter(**filters)), all=True
+    ).order_by('-borrowed_at', '-id')
+
+
+def reservation_history_rows(**filters):
+    """``reservation_rows`` over live and archived reservations matching ``filters``, oldest first."""
+    return reservation_rows(Reservation.objects.filter(**filters)).union(
+        reservation_rows(ReservationArchive.objects.filter(**filters)), all=True
+    ).order_by('reserved_at', 'id')
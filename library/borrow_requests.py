@@ -0,0 +1,126 @@
+"""
+Set-based approval of borrow requests.
+
+``approve_requests`` handles any number of pending requests in one
+transaction: the requests and the free copies of their books are locked,
+copies at each request's branch are handed out first-come first-served by
+``requested_at``, and every request that cannot get a copy there is queued as
+a pending ``Reservation`` at that branch so the normal queue promotion picks
+it up when a copy comes back. The work is a
+fixed number of queries however many requests are approved.
+"""
+from collections import Counter, defaultdict, deque
+
+from django.db import transaction
+from django.utils.timezone import now, timedelta
+
+from . import account_summary, events, outbox
+from .catalog_cache import bump_catalog_version
+from .models import BorrowedBook, BorrowRequest, BranchAvailability, Copy, Reservation
+
+LOAN_DAYS = 14
+
+
+class AllocationConflict(Exception):
+    """A copy picked for a request was claimed concurrently; nothing was changed."""
+
+
+def approve_requests(request_ids):
+    """
+    Approve the pending requests among ``request_ids``.
+    Returns {'approved': [...], 'queued': [...], 'skipped': [...]} of request ids,
+    where skipped ids were not pending (or do not exist).
+    """
+    with transaction.atomic():
+        pending = list(
+            BorrowRequest.objects.select_for_update(of=('self',))
+            .filter(id__in=request_ids, status='pending')
+            .select_related('user', 'book')
+            .order_by('requested_at', 'id')
+        )
+        book_ids = {borrow_request.book_id for borrow_request in pending}
+        branch_ids = {borrow_request.branch_id for borrow_request in pending}
+        free_copies = defaultdict(deque)  # (branch_id, book_id) -> copy ids
+        for copy_id, branch_id, book_id in (
+            Copy.objects.select_for_update()
+            .filter(branch_id__in=branch_ids, book_id__in=book_ids, status='available')
+            .order_by('branch_id', 'book_id', 'id')
+            .values_list('id', 'branch_id', 'book_id')
+        ):
+            free_copies[(branch_id, book_id)].append(copy_id)
+
+        approved, queued = [], []
+        for borrow_request in pending:
+            copies = free_copies[(borrow_request.branch_id, borrow_request.book_id)]
+            if copies:
+                approved.append((borrow_request, copies.popleft()))
+            else:
+                queued.append(borrow_request)
+
+        if approved:
+            claimed = Copy.objects.filter(
+                id__in=[copy_id for _, copy_id in approved], status='available'
+            ).update(status='borrowed')
+            if claimed != len(approved):
+                # Only possible where SELECT ... FOR UPDATE is a no-op (SQLite).
+                raise AllocationConflict()
+            borrowed_at = now()
+            # bulk_create skips BorrowedBook.save(); the copies are claimed above.
+            loans = BorrowedBook.objects.bulk_create([
+                BorrowedBook(
+                    user=borrow_request.user, book=borrow_request.book, copy_id=copy_id,
+                    branch_id=borrow_request.branch_id,
+                    due_date=borrowed_at + timedelta(days=LOAN_DAYS),
+                )
+                for borrow_request, copy_id in approved
+            ])
+            claimed_by_branch = Counter(
+                (borrow_request.branch_id, borrow_request.book_id) for borrow_request, _ in approved
+            )
+            BranchAvailability.adjust({key: (-count, 0) for key, count in claimed_by_branch.items()})
+            BorrowRequest.objects.filter(
+                id__in=[borrow_request.id for borrow_request, _ in approved]
+            ).update(status='approved')
+            account_summary.record_loans(loans, created=True)
+            events.publish_loans(loans)
+            account_summary.record_requests([
+                (borrow_request.id, borrow_request.user_id, 'approved') for borrow_request, _ in approved
+            ])
+            outbox.enqueue_many('library_system.tasks.send_borrow_email', [
+                [loan.user.email, loan.book.title, loan.due_date.strftime("%Y-%m-%d")]
+                for loan in loans
+            ])
+            bump_catalog_version()
+
+        if queued:
+            already_waiting = set(
+                Reservation.objects.filter(
+                    book_id__in={borrow_request.book_id for borrow_request in queued},
+                    user_id__in={borrow_request.user_id for borrow_request in queued},
+                    status='pending',
+                ).values_list('user_id', 'book_id', 'branch_id')
+            )
+            reservations = {}
+            for borrow_request in queued:
+                key = (borrow_request.user_id, borrow_request.book_id, borrow_request.branch_id)
+                if key not in already_waiting:
+                    reservations[key] = Reservation(
+                        user_id=key[0], book_id=key[1], branch_id=key[2], status='pending'
+                    )
+            created = Reservation.objects.bulk_create(reservations.values())
+            BorrowRequest.objects.filter(
+                id__in=[borrow_request.id for borrow_request in queued]
+            ).update(status='queued')
+            account_summary.record_reservations([
+                (reservation.pk, reservation.user_id, 'pending') for reservation in created
+            ])
+            account_summary.record_requests([
+                (borrow_request.id, borrow_request.user_id, 'queued') for borrow_request in queued
+            ])
+
+    pending_ids = {borrow_request.id for borrow_request in pending}
+    return {
+        'approved': [borrow_request.id for borrow_request, _ in approved],
+        'queued': [borrow_request.id for borrow_request in queued],
+        'skipped': [request_id for request_id in request_ids if request_id not in pending_ids],
+    }
@@ -0,0 +1,70 @@
+"""
+Branch scoping for the API.
+
+Copies, loans, reservations and borrow requests each belong to a branch, and
+the indexes over them lead with the branch, so a branch's lists and counts
+read only its own slice of the tables. Staff views are scoped to the branch
+named by ``?branch=<code>`` (``all`` for every branch), or to the librarian's
+home branch. Availability at a branch, and across branches, is read from the
+``BranchAvailability`` counters rather than by counting copies.
+"""
+from django.db.models import Sum
+from django.shortcuts import get_object_or_404
+
+from .models import Branch, BranchAvailability
+
+ALL_BRANCHES = 'all'
+
+
+def requested_branch_id(request):
+    """
+    Id of the branch named by ``?branch=`` or a ``branch`` field in the body,
+    None for ``all`` or when none is named. An unknown code is a 404.
+    """
+    code = request.query_params.get('branch') or request.data.get('branch')
+    if not code or code == ALL_BRANCHES:
+        return None
+    return get_object_or_404(Branch.objects.values_list('id', flat=True), code=code)
+
+
+def scope_branch_id(request):
+    """
+    Branch that staff lists and counts are scoped to: the one requested, else
+    the librarian's home branch. None means every branch.
+    """
+    if 'branch' in request.query_params or 'branch' in request.data:
+        return requested_branch_id(request)
+    if request.user.is_authenticated and request.user.role.lower() in ["librarian", "admin"]:
+        return request.user.branch_id
+    return None
+
+
+def available_copies(book_id, branch_id=None):
+    """Free copies of a book at ``branch_id``, or at every branch when it is None."""
+    counters = BranchAvailability.objects.filter(book_id=book_id).for_branch(branch_id)
+    return counters.aggregate(available=Sum('available'))['available'] or 0
+
+
+def branch_with_copy(book_id, preferred_branch_id=None):
+    """
+    A branch with a free copy of the book, ``preferred_branch_id`` if it has
+    one, else the branch with the most; None when no branch has a copy.
+    """
+    counters = BranchAvailability.objects.filter(book_id=book_id, available__gt=0)
+    branch_ids = list(counters.order_by('-available', 'branch_id').values_list('branch_id', flat=True))
+    if preferred_branch_id in branch_ids:
+        return preferred_branch_id
+    return branch_ids[0] if branch_ids else None
+
+
+def branch_availability(book_id):
+    """Per-branch availability of a book: every branch holding copies of it."""
+    rows = (
+        BranchAvailability.objects.filter(book_id=book_id, total__gt=0)
+        .order_by('branch__name', 'branch_id')
+        .values_list('branch_id', 'branch__code', 'branch__name', 'available', 'total')
+    )
+    return [
+        {'branch': branch_id, 'code': code, 'name': name, 'available_copies': available, 'total_copies': total}
+        for branch_id, code, name, available, total in rows
+    ]
@@ -0,0 +1,74 @@
+"""
+Versioned snapshots of public catalog responses.
+
+Anonymous catalog responses are identical for every visitor, so they are
+cached as rendered JSON bytes under a key that embeds the current catalog
+version. Any change to a book or its availability replaces the version (after
+the transaction commits), which orphans every old snapshot at once. Only one
+process rebuilds a missing snapshot; concurrent requests serve the previous
+snapshot meanwhile, or wait briefly when there is none.
+
+Versions and snapshots must live in a shared cache (Redis) for the
+invalidation to reach every worker; with the local-memory fallback each
+process only sees its own bumps and relies on CATALOG_CACHE_TTL instead.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = 'catalog:version'
+LOCK_TIMEOUT = 30
+WAIT_SECONDS = 2.0
+POLL_INTERVAL = 0.05
+
+
+def catalog_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Versions are timestamps rather than counters, so an evicted version
+        # key can never resurrect snapshots from before it was lost.
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    """Invalidate every catalog snapshot once the current transaction commits."""
+    transaction.on_commit(lambda: cache.set(VERSION_KEY, time.time_ns(), None))
+
+
+def get_snapshot(name, build):
+    """
+    Return the cached bytes for snapshot ``name`` at the current catalog
+    version, calling ``build()`` to produce them in at most one process.
+    """
+    ttl = getattr(settings, 'CATALOG_CACHE_TTL', 300)
+    key = f'catalog:{catalog_version()}:{name}'
+    stale_key = f'catalog:stale:{name}'
+
+    data = cache.get(key)
+    if data is not None:
+        return data
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, LOCK_TIMEOUT):
+        try:
+            data = build()
+            cache.set_many({key: data, stale_key: data}, ttl)
+        finally:
+            cache.delete(lock_key)
+        return data
+
+    # Another process is rebuilding this snapshot.
+    stale = cache.get(stale_key)
+    if stale is not None:
+        return stale
+    deadline = time.monotonic() + WAIT_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        data = cache.get(key)
+        if data is not None:
+            return data
+    return build()
@@ -0,0 +1,207 @@
+"""
+Availability change events for the Server-Sent Events stream.
+
+Loans and copy status changes publish events once their transaction commits:
+``availability`` (a book's current number of available copies) on the
+channel ``book:<id>``, and ``loan`` (borrowed or returned) on the borrower's
+``user:<id>`` channel, which book subscribers never see. ``availability_events``
+in the views relays the channels a client asked for over one long-lived
+connection, so clients no longer poll the book endpoints.
+
+With REDIS_URL set, events go through Redis pub/sub and reach streams served
+by any process. Otherwise an in-process broker delivers them to streams of the
+same process only. That is enough when one ASGI process serves both the API
+and the streams (EVENTS_SINGLE_PROCESS) and for tests; in any other setup the
+streams would never see the web workers' events, so they are refused.
+"""
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import Book
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'events:'
+# Frames a slow in-process subscriber may fall behind before new ones are dropped.
+QUEUE_SIZE = 100
+
+
+def book_channel(book_id):
+    return f'book:{book_id}'
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+def format_event(event, data):
+    """One SSE frame."""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class InProcessBroker:
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)  # channel -> {(loop, queue)}
+        self._lock = threading.Lock()
+
+    def has_subscribers(self, channels):
+        with self._lock:
+            return any(self._subscribers.get(channel) for channel in channels)
+
+    def publish(self, channel, frame):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        # Publishers run in request threads; queues belong to the streams' event loops.
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._offer, queue, frame)
+
+    @staticmethod
+    def _offer(queue, frame):
+        if not queue.full():
+            queue.put_nowait(frame)
+
+    @asynccontextmanager
+    async def subscribe(self, channels):
+        entry = (asyncio.get_running_loop(), asyncio.Queue(QUEUE_SIZE))
+        with self._lock:
+            for channel in channels:
+                self._subscribers[channel].add(entry)
+        try:
+            yield _QueueSubscription(entry[1])
+        finally:
+            with self._lock:
+                for channel in channels:
+                    self._subscribers[channel].discard(entry)
+                    if not self._subscribers[channel]:
+                        del self._subscribers[channel]
+
+
+class _QueueSubscription:
+
+    def __init__(self, queue):
+        self._queue = queue
+
+    async def get(self, timeout):
+        """Next frame, or None after ``timeout`` seconds without one."""
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class RedisBroker:
+
+    def __init__(self, url):
+        import redis
+        self._url = url
+        self._client = redis.Redis.from_url(url)
+
+    def has_subscribers(self, channels):
+        # Unknown without another round trip; publishing to nobody is cheap.
+        return True
+
+    def publish(self, channel, frame):
+        self._client.publish(CHANNEL_PREFIX + channel, frame)
+
+    @asynccontextmanager
+    async def subscribe(self, channels):
+        import redis.asyncio
+        client = redis.asyncio.Redis.from_url(self._url)
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(*(CHANNEL_PREFIX + channel for channel in channels))
+        try:
+            yield _PubSubSubscription(pubsub)
+        finally:
+            await pubsub.aclose()
+            await client.aclose()
+
+
+class _PubSubSubscription:
+
+    def __init__(self, pubsub):
+        self._pubsub = pubsub
+
+    async def get(self, timeout):
+        message = await self._pubsub.get_message(timeout=timeout)
+        return message['data'].decode() if message else None
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            url = getattr(settings, 'REDIS_URL', None)
+            _broker = RedisBroker(url) if url else InProcessBroker()
+        return _broker
+
+
+def streams_supported():
+    """Whether events published by the API can reach this process's streams."""
+    return bool(getattr(settings, 'REDIS_URL', None)) or getattr(settings, 'EVENTS_SINGLE_PROCESS', False)
+
+
+def subscribe(channels):
+    """``async with subscribe(channels) as subscription: await subscription.get(timeout)``"""
+    return get_broker().subscribe(channels)
+
+
+def current_availability(book_ids):
+    """{book_id: available copies} for the existing books among ``book_ids``."""
+    return dict(
+        Book.objects.filter(id__in=book_ids)
+        .annotate(available=Count('copies', filter=Q(copies__status='available')))
+        .values_list('id', 'available')
+    )
+
+
+def _publish(book_ids, loan_events):
+    broker = get_broker()
+    book_ids = [book_id for book_id in book_ids if broker.has_subscribers([book_channel(book_id)])]
+    try:
+        for book_id, available in current_availability(book_ids).items() if book_ids else ():
+            broker.publish(book_channel(book_id), format_event('availability', {
+                'book': book_id, 'available_copies': available,
+            }))
+        for user_id, data in loan_events:
+            broker.publish(user_channel(user_id), format_event('loan', data))
+    except Exception:
+        # The change is committed; a lost event only delays clients until they reconnect.
+        logger.exception("Could not publish availability events for books %s", book_ids)
+
+
+def publish_loans(loans):
+    """
+    After the current transaction commits, publish the availability of the
+    loans' books and a ``loan`` event to each borrower.
+    """
+    loan_events = [
+        (loan.user_id, {
+            'action': 'returned' if loan.returned_at else 'borrowed',
+            'loan': loan.pk,
+            'book': loan.book_id,
+            'due_date': loan.due_date.isoformat(),
+            'returned_at': loan.returned_at.isoformat() if loan.returned_at else None,
+        })
+        for loan in loans
+    ]
+    book_ids = sorted({loan.book_id for loan in loans})
+    transaction.on_commit(lambda: _publish(book_ids, loan_events))
+
+
+def publish_availability(book_ids):
+    """After the current transaction commits, publish the availability of ``book_ids``."""
+    book_ids = sorted(set(book_ids))
+    transaction.on_commit(lambda: _publish(book_ids, []))
@@ -0,0 +1,121 @@
+"""
+Faceted catalog browsing by category, author and availability, where
+availability is at one branch (``?branch=<code>``) or at any branch.
+
+Facet counts are disjunctive: each dimension is counted with the *other*
+active filters applied, so a sidebar can show how many books every option
+would return. Counts and result pages are cached per catalog version (see
+``catalog_cache``), so the GROUP BY queries run once per catalog change and
+filter combination rather than on every request. Only combinations of values
+the sidebar offers are cached (every category and branch, the most common
+authors); anything else a client sends is computed uncached, so arbitrary
+query strings cannot grow the cache or evict the real snapshots.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from .catalog_cache import get_snapshot
+from .fast_serializers import annotate_availability
+from .models import Book, Branch
+
+AUTHOR_FACET_LIMIT = 50
+DIMENSIONS = ('category', 'author', 'available', 'branch')
+
+
+def parse_filters(params):
+    """Normalise query parameters into {'category', 'author', 'available', 'branch'}."""
+    available = params.get('available', '').lower()
+    return {
+        'category': params.get('category') or None,
+        'author': params.get('author') or None,
+        'available': {'true': True, '1': True, 'false': False, '0': False}.get(available),
+        'branch': params.get('branch') or None,
+    }
+
+
+def filters_key(filters):
+    raw = '|'.join(f'{name}={filters[name]!r}' for name in DIMENSIONS)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _known_values():
+    return {
+        'category': set(Book.objects.values_list('category', flat=True).distinct()),
+        'author': set(
+            Book.objects.values_list('author', flat=True)
+            .annotate(count=Count('id')).order_by('-count', 'author')[:AUTHOR_FACET_LIMIT]
+        ),
+        'branch': set(Branch.objects.values_list('code', flat=True)),
+    }
+
+
+def is_cacheable(filters):
+    """Whether ``filters`` only use values the facets offer, so their results may be snapshotted."""
+    # Not versioned: a value added since is only served uncached until the TTL.
+    known = cache.get_or_set('catalog:facet-values', _known_values, getattr(settings, 'CATALOG_CACHE_TTL', 300))
+    return all(filters[name] is None or filters[name] in known[name] for name in ('category', 'author', 'branch'))
+
+
+def availability_branch(filters):
+    """
+    Branch that availability is counted at, as a subquery so the code costs no
+    extra round trip (an unknown code matches nothing); None for any branch.
+    """
+    if filters['branch'] is None:
+        return None
+    return Branch.objects.filter(code=filters['branch']).values('id')[:1]
+
+
+def filter_books(filters, skip=None):
+    """Books matching ``filters``, ignoring the ``skip`` dimension."""
+    books = Book.objects.all()
+    if filters['category'] is not None and skip != 'category':
+        books = books.filter(category=filters['category'])
+    if filters['author'] is not None and skip != 'author':
+        books = books.filter(author=filters['author'])
+    if filters['available'] is not None and skip != 'available':
+        books = annotate_availability(books, availability_branch(filters))
+        if filters['available']:
+            books = books.filter(annotated_available_copies__gt=0)
+        else:
+            books = books.filter(annotated_available_copies__lte=0)
+        # Re-select by id so callers can group without the availability GROUP BY.
+        books = Book.objects.filter(id__in=books.values('id'))
+    return books
+
+
+def _compute_facets(filters):
+    categories = (
+        filter_books(filters, skip='category')
+        .values('category').annotate(count=Count('id'))
+        .order_by('-count', 'category')
+    )
+    authors = (
+        filter_books(filters, skip='author')
+        .values('author').annotate(count=Count('id'))
+        .order_by('-count', 'author')[:AUTHOR_FACET_LIMIT]
+    )
+    candidates = filter_books(filters, skip='available')
+    total = candidates.count()
+    available = (
+        annotate_availability(candidates, availability_branch(filters))
+        .filter(annotated_available_copies__gt=0)
+        .values('id').count()
+    )
+    return {
+        'category': [{'value': row['category'], 'count': row['count']} for row in categories],
+        'author': [{'value': row['author'], 'count': row['count']} for row in authors],
+        'available': [
+            {'value': True, 'count': available},
+            {'value': False, 'count': total - available},
+        ],
+    }
+
+
+def facet_counts(filters):
+    if not is_cacheable(filters):
+        return _compute_facets(filters)
+    return get_snapshot(f'facets:{filters_key(filters)}', lambda: _compute_facets(filters))
@@ -0,0 +1,150 @@
+"""
+Read-only serialization straight from ``.values()`` rows.
+
+These functions return exactly what ``BookSerializer``, ``BorrowedBookSerializer``
+and ``ReservationSerializer`` produce for ``many=True`` without a request in
+the serializer context, but skip model instantiation and DRF's per-field
+machinery. Availability is annotated in the same query instead of one COUNT
+per book. Use the ModelSerializers for writes and validation.
+"""
+from decimal import Decimal
+
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.timezone import get_current_timezone, now
+
+from .models import Book, BranchAvailability
+
+_TWO_PLACES = Decimal('0.01')
+
+
+def _datetime(value):
+    # Mirrors rest_framework.fields.DateTimeField.to_representation (ISO 8601).
+    if not value:
+        return None
+    value = value.astimezone(get_current_timezone()).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def _date(value):
+    return value.isoformat() if value else None
+
+
+def _decimal(value):
+    # Mirrors DecimalField(max_digits=6, decimal_places=2) with string coercion.
+    if value is None:
+        return ''
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value).strip())
+    return '{:f}'.format(value.quantize(_TWO_PLACES))
+
+
+def annotate_availability(queryset, branch=None):
+    """
+    Annotate ``annotated_available_copies`` as BookSerializer expects it, the
+    copies free at ``branch`` (a Branch, its id or a subquery) when one is given.
+    """
+    if branch is not None:
+        # One row per (branch, book) in the availability counters.
+        available = BranchAvailability.objects.filter(book=OuterRef('pk'), branch=branch).values('available')
+        return queryset.annotate(annotated_available_copies=Coalesce(Subquery(available[:1]), 0))
+    # Served from the (book, status) index on Copy.
+    return queryset.annotate(
+        annotated_available_copies=Count('copies', filter=Q(copies__status='available'))
+    )
+
+
+def serialize_books(queryset):
+    if 'annotated_available_copies' not in queryset.query.annotations:
+        queryset = annotate_availability(queryset)
+    cover_storage = Book._meta.get_field('cover_image').storage
+    rows = queryset.values_list(
+        'id', 'title', 'author', 'isbn', 'cover_image', 'description', 'category',
+        'is_borrowed', 'borrowed_by', 'due_date', 'quantity', 'annotated_available_copies',
+    )
+    return [
+        {
+            'id': book_id,
+            'title': title,
+            'author': author,
+            'isbn': isbn,
+            'cover_image': cover_storage.url(cover_image) if cover_image else None,
+            'description': description,
+            'category': category,
+            'is_borrowed': is_borrowed,
+            'borrowed_by': borrowed_by,
+            'due_date': _date(due_date),
+            'quantity': quantity,
+            'available_copies': available_copies,
+        }
+        for (book_id, title, author, isbn, cover_image, description, category,
+             is_borrowed, borrowed_by, due_date, quantity, available_copies) in rows
+    ]
+
+
+BORROWED_BOOK_FIELDS = (
+    'id', 'user', 'user__username', 'book', 'book__title',
+    'borrowed_at', 'due_date', 'returned_at', 'fine_amount',
+)
+
+
+def borrowed_book_rows(queryset):
+    """Row queryset for ``serialize_borrowed_book_rows``; slice or paginate it freely."""
+    return queryset.values_list(*BORROWED_BOOK_FIELDS)
+
+
+def serialize_borrowed_book_rows(rows):
+    current = now()
+    data = []
+    for (loan_id, user_id, username, book_id, book_title,
+         borrowed_at, due_date, returned_at, fine_amount) in rows:
+        if not returned_at:
+            current_fine = max(0, (current - due_date).days) * 5
+        else:
+            current_fine = float(fine_amount)
+        data.append({
+            'id': loan_id,
+            'user': user_id,
+            'user_name': username,
+            'book': book_id,
+            'book_title': book_title,
+            'borrowed_at': _datetime(borrowed_at),
+            'due_date': _datetime(due_date),
+            'returned_at': _datetime(returned_at),
+            'fine_amount': _decimal(fine_amount),
+            'current_fine': current_fine,
+        })
+    return data
+
+
+def serialize_borrowed_books(queryset):
+    return serialize_borrowed_book_rows(borrowed_book_rows(queryset))
+
+
+RESERVATION_FIELDS = ('id', 'user', 'user__username', 'book', 'book__title', 'reserved_at', 'status')
+
+
+def reservation_rows(queryset):
+    """Row queryset for ``serialize_reservation_rows``; slice or paginate it freely."""
+    return queryset.values_list(*RESERVATION_FIELDS)
+
+
+def serialize_reservation_rows(rows):
+    return [
+        {
+            'id': reservation_id,
+            'user': user_id,
+            'user_name': username,
+            'book': book_id,
+            'book_title': book_title,
+            'reserved_at': _datetime(reserved_at),
+            'status': reservation_status,
+        }
+        for reservation_id, user_id, username, book_id, book_title, reserved_at, reservation_status in rows
+    ]
+
+
+def serialize_reservations(queryset):
+    return serialize_reservation_rows(reservation_rows(queryset))
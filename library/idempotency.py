@@ -0,0 +1,90 @@
+"""
+Idempotency keys for the circulation POST endpoints.
+
+Desk clients on flaky connections retry requests whose response they never
+saw. With an ``Idempotency-Key`` header, the first request with a key runs
+normally and its response is stored in the cache for
+``IDEMPOTENCY_KEY_TTL`` seconds; a retry with the same key (from the same
+user, to the same endpoint) gets the stored response back, marked with
+``Idempotent-Replayed: true``, without running the view again -- so no second
+loan, reservation or confirmation email. A retry that arrives while the first
+request is still running gets 409, and reusing a key for a different request
+body gets 422. Server errors are not stored, so those can be retried.
+
+Keys live in the shared cache (Redis when REDIS_URL is set). With the
+local-memory fallback a retry is only recognised by the process that served
+the first request.
+"""
+import functools
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+DEFAULT_TTL = 24 * 60 * 60
+# Longest a first request may run before a retry is allowed to start over.
+LOCK_TIMEOUT = 60
+
+
+def _cache_key(request, key):
+    scope = f'{request.user.pk}:{request.method}:{request.path}:{key}'
+    return 'idempotency:' + hashlib.sha256(scope.encode()).hexdigest()
+
+
+def _fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(f'{request.META.get("QUERY_STRING", "")}\n{body}'.encode()).hexdigest()
+
+
+def _replay(stored, fingerprint):
+    if stored['fingerprint'] != fingerprint:
+        return Response({"error": f"{HEADER} was already used for a different request."},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    response = Response(stored['data'], status=stored['status'])
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def idempotent(view_method):
+    """Honour the Idempotency-Key header on an APIView handler method."""
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return view_method(self, request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response({"error": f"{HEADER} must be 1 to {MAX_KEY_LENGTH} characters."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        cache_key = _cache_key(request, key)
+        fingerprint = _fingerprint(request)
+        stored = cache.get(cache_key)
+        if stored is not None:
+            return _replay(stored, fingerprint)
+
+        lock_key = f'{cache_key}:lock'
+        if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+            return Response({"error": f"A request with this {HEADER} is still being processed."},
+                            status=status.HTTP_409_CONFLICT)
+        try:
+            # The first request may have finished between the read and the lock.
+            stored = cache.get(cache_key)
+            if stored is not None:
+                return _replay(stored, fingerprint)
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code < 500:
+                cache.set(cache_key, {
+                    'fingerprint': fingerprint,
+                    'status': response.status_code,
+                    'data': response.data,
+                }, getattr(settings, 'IDEMPOTENCY_KEY_TTL', DEFAULT_TTL))
+            return response
+        finally:
+            cache.delete(lock_key)
+    return wrapper
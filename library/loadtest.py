@@ -0,0 +1,259 @@
+"""
+Scenario-driven load generation and latency reporting for the API.
+
+Used by the ``seed_library`` and ``loadtest`` management commands. Requests go
+through Django's test client in-process (so per-request query counts can be
+captured) or over HTTP to a running server with ``base_url``. Scenarios are
+weighted; their ids are drawn with the same popularity skew the seeder uses.
+"""
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+
+from django.db import connection
+from django.test import Client
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import Book, BorrowedBook, User
+
+SEED_PREFIX = 'seed-'
+
+# (name, weight, method, role) -- role is None for anonymous requests.
+SCENARIOS = [
+    ('book_list', 20, 'GET', None),
+    ('catalog', 15, 'GET', None),
+    ('book_detail', 15, 'GET', None),
+    ('recommendations', 10, 'GET', None),
+    ('search', 15, 'GET', 'member'),
+    ('borrowed_books', 5, 'GET', 'member'),
+    ('borrow', 8, 'POST', 'member'),
+    ('return', 7, 'POST', 'librarian'),
+    ('dashboard', 5, 'GET', 'librarian'),
+]
+
+
+def zipf_weights(n, skew=1.1):
+    """Weights for ranks 1..n so that a few items receive most of the traffic."""
+    return [1.0 / (rank ** skew) for rank in range(1, n + 1)]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+class Workload:
+    """Ids and credentials the scenarios draw from, loaded from seeded data."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.lock = threading.Lock()
+        self.book_ids = list(
+            Book.objects.filter(isbn__startswith='SEED').order_by('id').values_list('id', flat=True)
+        )
+        self.book_weights = zipf_weights(len(self.book_ids))
+        self.categories = list(
+            Book.objects.filter(isbn__startswith='SEED').exclude(category=None)
+            .values_list('category', flat=True).distinct()
+        )
+        self.titles = list(
+            Book.objects.filter(id__in=self.book_ids[:200]).values_list('title', flat=True)
+        )
+        self.open_loans = list(
+            BorrowedBook.objects.filter(returned_at__isnull=True, user__username__startswith=SEED_PREFIX)
+            .values_list('id', flat=True)[:10000]
+        )
+        members = list(User.objects.filter(username__startswith=f'{SEED_PREFIX}member-')[:50])
+        librarians = list(User.objects.filter(username__startswith=f'{SEED_PREFIX}librarian-')[:5])
+        if not self.book_ids or not members or not librarians:
+            raise ValueError("No seeded data found; run 'manage.py seed_library' first.")
+        self.tokens = {
+            'member': [str(RefreshToken.for_user(user).access_token) for user in members],
+            'librarian': [str(RefreshToken.for_user(user).access_token) for user in librarians],
+        }
+
+    def book_id(self):
+        return self.rng.choices(self.book_ids, weights=self.book_weights)[0]
+
+    def token(self, role):
+        return self.rng.choice(self.tokens[role])
+
+    def take_open_loan(self):
+        with self.lock:
+            return self.open_loans.pop() if self.open_loans else None
+
+    def request_for(self, name):
+        """Return (path, data) for one request of scenario ``name``."""
+        if name == 'book_list':
+            return '/api/books/', None
+        if name == 'catalog':
+            category = self.rng.choice(self.categories) if self.categories else ''
+            return f'/api/catalog/?category={category}&available=true', None
+        if name == 'book_detail':
+            return f'/api/books/{self.book_id()}/', None
+        if name == 'recommendations':
+            return f'/api/books/{self.book_id()}/recommendations/', None
+        if name == 'search':
+            return f'/api/search/?title={self.rng.choice(self.titles)[:4]}', None
+        if name == 'borrowed_books':
+            return '/api/books/borrowed/', None
+        if name == 'borrow':
+            return f'/api/books/{self.book_id()}/borrow/', {}
+        if name == 'return':
+            loan_id = self.take_open_loan()
+            return (f'/api/books/{loan_id}/return/', {}) if loan_id else (None, None)
+        if name == 'dashboard':
+            return '/api/dashboard/', None
+        raise ValueError(name)
+
+
+class QueryCounter:
+    # Unlike CaptureQueriesContext this is not capped by connection.queries_log.
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class InProcessTransport:
+    captures_queries = True
+
+    def __init__(self):
+        self.client = Client()
+
+    def send(self, method, path, data, token):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if token else {}
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            if method == 'GET':
+                response = self.client.get(path, **headers)
+            else:
+                response = self.client.post(path, data=json.dumps(data or {}),
+                                            content_type='application/json', **headers)
+        return response.status_code, counter.count
+
+
+class HttpTransport:
+    captures_queries = False
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def send(self, method, path, data, token):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        response = self.session.request(method, self.base_url + path, json=data, headers=headers)
+        return response.status_code, None
+
+
+def run(requests_total, concurrency=1, base_url=None, seed=0):
+    """Issue ``requests_total`` weighted scenario requests and return a report dict."""
+    rng = random.Random(seed)
+    workload = Workload(rng)
+    names = [name for name, _, _, _ in SCENARIOS]
+    weights = [weight for _, weight, _, _ in SCENARIOS]
+    plan = rng.choices(names, weights=weights, k=requests_total)
+    spec = {name: (method, role) for name, _, method, role in SCENARIOS}
+
+    samples = defaultdict(list)
+    queries = defaultdict(list)
+    errors = defaultdict(int)
+    statuses = defaultdict(lambda: defaultdict(int))
+    plan_lock = threading.Lock()
+
+    def worker():
+        transport = HttpTransport(base_url) if base_url else InProcessTransport()
+        try:
+            _drain(transport)
+        finally:
+            connection.close()
+
+    def _drain(transport):
+        while True:
+            with plan_lock:
+                if not plan:
+                    return
+                name = plan.pop()
+            method, role = spec[name]
+            with plan_lock:
+                path, data = workload.request_for(name)
+                token = workload.token(role) if role else None
+            if path is None:
+                continue
+            start = time.perf_counter()
+            try:
+                status_code, query_count = transport.send(method, path, data, token)
+            except Exception:
+                status_code, query_count = 599, None
+            elapsed = time.perf_counter() - start
+            samples[name].append(elapsed)
+            statuses[name][status_code] += 1
+            if status_code >= 500:
+                errors[name] += 1
+            # Rejected requests exit early; count queries on the success path only
+            # so the average does not depend on how many borrows found a copy.
+            if query_count is not None and status_code < 400:
+                queries[name].append(query_count)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(max(1, concurrency))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    report = {
+        'config': {'requests': requests_total, 'concurrency': concurrency,
+                   'transport': 'http' if base_url else 'in-process', 'seed': seed},
+        'scenarios': {},
+    }
+    all_samples = []
+    for name in names:
+        latencies = samples.get(name, [])
+        if not latencies:
+            continue
+        all_samples.extend(latencies)
+        report['scenarios'][name] = _summary(latencies, wall, errors[name], queries.get(name))
+        report['scenarios'][name]['statuses'] = {str(code): n for code, n in sorted(statuses[name].items())}
+    report['total'] = _summary(all_samples, wall, sum(errors.values()),
+                               [q for values in queries.values() for q in values] or None)
+    return report
+
+
+def _summary(latencies, wall, error_count, query_counts):
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+    return {
+        'requests': len(latencies),
+        'errors': error_count,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'throughput_rps': round(len(latencies) / wall, 1) if wall else None,
+        'avg_queries': round(sum(query_counts) / len(query_counts), 2) if query_counts else None,
+    }
+
+
+def compare(report, baseline, latency_tolerance=0.3, query_tolerance=0.5):
+    """Return a list of human-readable regressions of ``report`` against ``baseline``."""
+    regressions = []
+    for name, base in baseline.get('scenarios', {}).items():
+        current = report['scenarios'].get(name)
+        if current is None:
+            continue
+        if base.get('p95_ms') and current['p95_ms'] > base['p95_ms'] * (1 + latency_tolerance):
+            regressions.append(f"{name}: p95 {current['p95_ms']}ms vs baseline {base['p95_ms']}ms")
+        if (base.get('avg_queries') is not None and current['avg_queries'] is not None
+                and current['avg_queries'] > base['avg_queries'] + query_tolerance):
+            regressions.append(f"{name}: {current['avg_queries']} queries/request vs baseline {base['avg_queries']}")
+        if current['errors'] > base.get('errors', 0):
+            regressions.append(f"{name}: {current['errors']} server errors vs baseline {base.get('errors', 0)}")
+    return regressions
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from library.archive import archive_closed_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Move returned loans and closed reservations and borrow requests older than "
+        "ARCHIVE_AFTER_DAYS to the archive tables now, instead of waiting for the "
+        "nightly archive_closed_records task. Runs until nothing is left to archive."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Archive records closed more than this many days ago.")
+        parser.add_argument('--batch-size', type=int)
+
+    def handle(self, *args, days, batch_size, **options):
+        totals, remaining = {}, True
+        while remaining:
+            moved, remaining = archive_closed_records(after_days=days, batch_size=batch_size)
+            for label, count in moved.items():
+                totals[label] = totals.get(label, 0) + count
+        for label, count in totals.items():
+            self.stdout.write(f"{label}: {count} archived")
+        self.stdout.write(self.style.SUCCESS(f"Archived {sum(totals.values())} records."))
@@ -0,0 +1,48 @@
+import time
+
+from django.core.mail import EmailMultiAlternatives
+from django.template.loader import render_to_string
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from library import notifications
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark notification rendering in messages per second: per-message "
+        "render_to_string (the previous approach) against batched rendering "
+        "with precompiled templates."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10000, help="Messages to render.")
+        parser.add_argument('--kind', default='borrow_confirmation', choices=sorted(notifications.NOTIFICATIONS))
+
+    def handle(self, *args, count, kind, **options):
+        items = [
+            (f'patron{i}@example.com', {
+                'username': f'Patron{i}',
+                'book_title': f'Book <{i}> & Sons',
+                'due_date': '2025-01-31',
+            })
+            for i in range(count)
+        ]
+
+        start = time.perf_counter()
+        for recipient, context in items:
+            html = render_to_string(f'emails/{kind}.html', context)
+            text = render_to_string(f'emails/{kind}.txt', context).strip()
+            message = EmailMultiAlternatives(notifications.NOTIFICATIONS[kind], text,
+                                             settings.DEFAULT_FROM_EMAIL, [recipient])
+            message.attach_alternative(html, "text/html")
+        per_message = time.perf_counter() - start
+
+        notifications.warm_up()
+        start = time.perf_counter()
+        notifications.render_batch(kind, items)
+        batched = time.perf_counter() - start
+
+        self.stdout.write(f"render_to_string per message: {count / per_message:,.0f} messages/s")
+        self.stdout.write(f"batched, precompiled:         {count / batched:,.0f} messages/s "
+                          f"({per_message / batched:.2f}x)")
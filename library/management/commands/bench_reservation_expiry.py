@@ -0,0 +1,73 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.timezone import now
+
+from library.models import Book, Reservation, User
+from library.reservations import expire_reservations
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the set-based reservation expiry pass against the previous "
+        "count() + update() implementation. All data is created inside a "
+        "transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100000, help="Pending reservations to expire.")
+        parser.add_argument('--books', type=int, default=1000, help="Books the reservations are spread over.")
+
+    def handle(self, *args, count, books, **options):
+        try:
+            with transaction.atomic():
+                self._run(count, books)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def _run(self, count, books):
+        self.stdout.write(f"Seeding {count} pending reservations over {books} books...")
+        user = User.objects.create(username='bench-reservation-expiry', email='bench@example.com')
+        categories = ['Fiction', 'Reference', 'Science', None]
+        book_objs = Book.objects.bulk_create(
+            [
+                Book(title=f'Bench {i}', author='Bench', isbn=f'B{i:012d}',
+                     category=categories[i % len(categories)], quantity=0)
+                for i in range(books)
+            ],
+            batch_size=1000,
+        )
+        Reservation.objects.bulk_create(
+            (Reservation(book=book_objs[i % books], user=user) for i in range(count)),
+            batch_size=5000,
+        )
+        pending = Reservation.objects.filter(user=user)
+        # reserved_at is auto_now_add, so age the rows after inserting them.
+        pending.update(reserved_at=now() - timedelta(days=30))
+
+        start = time.perf_counter()
+        expired = expire_reservations()
+        set_based = time.perf_counter() - start
+
+        pending.update(status='pending')
+        start = time.perf_counter()
+        legacy = Reservation.objects.filter(status='pending', reserved_at__lt=now() - timedelta(days=3))
+        legacy_count = legacy.count()
+        legacy.update(status='cancelled')
+        legacy_elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            f"set-based UPDATE ... RETURNING: {len(expired)} rows in {set_based * 1000:.1f} ms "
+            f"({len(expired) / set_based:,.0f} rows/s, affected rows returned)"
+        )
+        self.stdout.write(
+            f"legacy count() + update():      {legacy_count} rows in {legacy_elapsed * 1000:.1f} ms "
+            f"({legacy_count / legacy_elapsed:,.0f} rows/s, no affected rows)"
+        )
@@ -0,0 +1,74 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.timezone import now
+from rest_framework.renderers import JSONRenderer
+
+from library.fast_serializers import serialize_books, serialize_borrowed_books, serialize_reservations
+from library.models import Book, BorrowedBook, Reservation, User
+from library.renderers import FastJSONRenderer
+from library.serializers import BookSerializer, BorrowedBookSerializer, ReservationSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark ModelSerializer + JSONRenderer against the .values() fast path "
+        "+ FastJSONRenderer for books, loans and reservations, and check that "
+        "both produce identical bytes. Data is created in a rolled-back transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help="Rows per model.")
+
+    def handle(self, *args, rows, **options):
+        try:
+            with transaction.atomic():
+                self._run(rows)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def _time(self, fn):
+        start = time.perf_counter()
+        result = fn()
+        return result, time.perf_counter() - start
+
+    def _run(self, rows):
+        self.stdout.write(f"Seeding {rows} books, loans and reservations...")
+        user = User.objects.create(username='bench-serializers')
+        books = Book.objects.bulk_create(
+            [Book(title=f'Bench “{i}”', author='Bench', isbn=f'S{i:012d}', quantity=3,
+                  category='Fiction', description='x' * 200) for i in range(rows)],
+            batch_size=1000,
+        )
+        # bulk_create skips BorrowedBook.save(), which would claim a copy (the bench books have none).
+        BorrowedBook.objects.bulk_create(
+            [BorrowedBook(user=user, book=book, due_date=now() - timedelta(days=i % 20)) for i, book in enumerate(books)],
+            batch_size=1000,
+        )
+        Reservation.objects.bulk_create([Reservation(user=user, book=book) for book in books], batch_size=1000)
+
+        cases = [
+            ('books', Book.objects.filter(isbn__startswith='S').order_by('id'),
+             BookSerializer, serialize_books),
+            ('loans', BorrowedBook.objects.filter(user=user).select_related('user', 'book').order_by('id'),
+             BorrowedBookSerializer, serialize_borrowed_books),
+            ('reservations', Reservation.objects.filter(user=user).select_related('user', 'book').order_by('id'),
+             ReservationSerializer, serialize_reservations),
+        ]
+        for name, queryset, serializer_class, fast in cases:
+            slow_bytes, slow = self._time(
+                lambda: JSONRenderer().render(serializer_class(queryset.all(), many=True).data)
+            )
+            fast_bytes, quick = self._time(lambda: FastJSONRenderer().render(fast(queryset.all())))
+            self.stdout.write(
+                f"{name:<13} ModelSerializer: {rows / slow:>9,.0f} rows/s   "
+                f"fast path: {rows / quick:>9,.0f} rows/s   "
+                f"({slow / quick:.1f}x, identical bytes: {slow_bytes == fast_bytes})"
+            )
@@ -0,0 +1,87 @@
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.handlers import StaticFilesHandler
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from wsgiref.util import setup_testing_defaults
+
+WHITENOISE = 'whitenoise.middleware.WhiteNoiseMiddleware'
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare static file serving before and after WhiteNoise: Django's "
+        "staticfiles serve view (what runserver uses; gunicorn alone serves nothing) "
+        "against WhiteNoise with hashed, pre-compressed files. Runs collectstatic "
+        "into a temporary directory and reports latency, bytes sent and cache headers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help="Requests per file and mode.")
+        parser.add_argument('--files', type=int, default=4, help="Largest CSS/JS files to fetch.")
+
+    def handle(self, *args, requests, files, **options):
+        with tempfile.TemporaryDirectory() as static_root, override_settings(STATIC_ROOT=static_root):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            manifest = staticfiles_storage.hashed_files
+            candidates = sorted(
+                (name for name in manifest if name.endswith(('.css', '.js'))),
+                key=lambda name: -(Path(static_root) / name).stat().st_size,
+            )[:files]
+
+            middleware = [name for name in settings.MIDDLEWARE if name != WHITENOISE]
+            with override_settings(MIDDLEWARE=middleware):
+                django_handler = StaticFilesHandler(WSGIHandler())
+            whitenoise_handler = WSGIHandler()
+
+            self.stdout.write(f"{'file':<44}{'mode':<12}{'us/req':>9}{'bytes':>10}  cache-control")
+            for name in candidates:
+                url = settings.STATIC_URL + name
+                hashed_url = settings.STATIC_URL + manifest[name]
+                for mode, handler, path in (
+                    ('django', django_handler, url),
+                    ('whitenoise', whitenoise_handler, hashed_url),
+                ):
+                    elapsed, size, headers = self._measure(handler, path, requests)
+                    encoding = headers.get('Content-Encoding')
+                    self.stdout.write(
+                        f"{name[-43:]:<44}{mode:<12}{elapsed * 1e6:>9.0f}{size:>10}  "
+                        f"{headers.get('Cache-Control', '-')}{f' ({encoding})' if encoding else ''}"
+                    )
+
+    def _request(self, handler, path):
+        environ = {
+            'PATH_INFO': path,
+            'REQUEST_METHOD': 'GET',
+            'HTTP_HOST': 'localhost',
+            'HTTP_ACCEPT_ENCODING': 'gzip, br',
+        }
+        setup_testing_defaults(environ)
+        captured = {}
+
+        def start_response(status, headers, exc_info=None):
+            captured['status'] = status
+            captured['headers'] = dict(headers)
+
+        response = handler(environ, start_response)
+        try:
+            body = b''.join(response)
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+        return captured, len(body)
+
+    def _measure(self, handler, path, requests):
+        captured, size = self._request(handler, path)
+        if not captured['status'].startswith('200'):
+            self.stderr.write(f"{path}: {captured['status']}")
+        start = time.perf_counter()
+        for _ in range(requests):
+            self._request(handler, path)
+        return (time.perf_counter() - start) / requests, size, captured['headers']
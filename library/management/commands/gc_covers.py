@@ -0,0 +1,61 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from library.models import Book
+from library.storage import NAME_PATTERN
+
+LEGACY_DIR = 'book_covers'
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete cover image files no book references any more (after book deletions "
+        "or cover replacements). Files newer than --min-age are kept so an upload "
+        "whose book has not been committed yet is never removed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=3600, help="Seconds; younger files are kept.")
+        parser.add_argument('--legacy', action='store_true',
+                            help=f"Also remove unreferenced pre-dedupe uploads in MEDIA_ROOT/{LEGACY_DIR}/.")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, min_age, legacy, dry_run, **options):
+        storage = Book._meta.get_field('cover_image').storage
+        referenced = set(
+            Book.objects.exclude(cover_image='').exclude(cover_image__isnull=True)
+            .values_list('cover_image', flat=True)
+        )
+        cutoff = time.time() - min_age
+
+        roots = [(storage.location, '')]
+        if legacy:
+            roots.append((os.path.join(settings.MEDIA_ROOT, LEGACY_DIR), f'{LEGACY_DIR}/'))
+
+        removed = freed = 0
+        for location, prefix in roots:
+            for directory, _dirs, files in os.walk(location, topdown=False):
+                for filename in files:
+                    path = os.path.join(directory, filename)
+                    name = prefix + os.path.relpath(path, location).replace(os.sep, '/')
+                    if name in referenced or os.path.getmtime(path) > cutoff:
+                        continue
+                    # Only content-addressed names, abandoned upload temp files,
+                    # or (with --legacy) old uploads are ever deleted.
+                    if not (prefix or NAME_PATTERN.match(name) or filename.startswith('.upload-')):
+                        continue
+                    size = os.path.getsize(path)
+                    self.stdout.write(f"{'Would remove' if dry_run else 'Removing'} {name} ({size} bytes)")
+                    if not dry_run:
+                        os.unlink(path)
+                    removed += 1
+                    freed += size
+                if not dry_run and directory != location and not os.listdir(directory):
+                    os.rmdir(directory)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Would remove' if dry_run else 'Removed'} {removed} file(s), {freed} bytes."
+        ))
@@ -0,0 +1,71 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from library import loadtest
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'benchmarks' / 'baseline.json'
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a weighted mix of list, catalog, search, borrow, return and dashboard "
+        "requests against data from 'seed_library' and report p50/p95/p99 latency, "
+        "throughput and queries per request. With --baseline, exits non-zero when a "
+        "scenario's p95 or query count regresses. Borrow and return requests write "
+        "to the database, so run it against a scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help="Worker threads. Keep 1 for in-process runs on SQLite.")
+        parser.add_argument('--base-url', help="Send requests over HTTP to a running server instead of in-process.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Write the JSON report to this file.")
+        parser.add_argument('--baseline', nargs='?', const=str(DEFAULT_BASELINE),
+                            help=f"Compare against a stored report (default {DEFAULT_BASELINE}).")
+        parser.add_argument('--update-baseline', action='store_true',
+                            help="Store this run as the new baseline.")
+        parser.add_argument('--tolerance', type=float, default=0.3,
+                            help="Allowed relative p95 increase before a scenario counts as regressed.")
+
+    def handle(self, *args, requests, concurrency, base_url, seed, output, baseline, update_baseline,
+               tolerance, **options):
+        try:
+            report = loadtest.run(requests, concurrency=concurrency, base_url=base_url, seed=seed)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        self._print(report)
+        if output:
+            Path(output).write_text(json.dumps(report, indent=2) + '\n')
+        if update_baseline:
+            path = Path(baseline or DEFAULT_BASELINE)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(report, indent=2) + '\n')
+            self.stdout.write(f"Baseline written to {path}")
+        elif baseline:
+            path = Path(baseline)
+            if not path.exists():
+                raise CommandError(f"No baseline at {path}; run with --update-baseline first.")
+            regressions = loadtest.compare(report, json.loads(path.read_text()), latency_tolerance=tolerance)
+            if regressions:
+                for regression in regressions:
+                    self.stderr.write(f"REGRESSION {regression}")
+                raise CommandError(f"{len(regressions)} regression(s) against {path}")
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {path}"))
+
+    def _print(self, report):
+        header = f"{'scenario':<16}{'reqs':>7}{'err':>5}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}{'queries':>9}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        rows = list(report['scenarios'].items()) + [('TOTAL', report['total'])]
+        for name, row in rows:
+            queries = row['avg_queries'] if row['avg_queries'] is not None else '-'
+            self.stdout.write(
+                f"{name:<16}{row['requests']:>7}{row['errors']:>5}{row['p50_ms']:>9}"
+                f"{row['p95_ms']:>9}{row['p99_ms']:>9}{row['throughput_rps']:>9}{queries:>9}"
+            )
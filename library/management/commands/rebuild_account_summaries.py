@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from library.account_summary import rebuild_summaries
+from library.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute user account summaries from the loan, reservation and borrow "
+        "request tables. Summaries are kept current incrementally and built on "
+        "first read; run this after importing data with bulk tools or raw SQL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids',
+                            help="Only this user id (repeatable).")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, user_ids, batch_size, **options):
+        users = User.objects.filter(id__in=user_ids) if user_ids else User.objects.all()
+        user_ids = list(users.order_by('id').values_list('id', flat=True))
+        rebuilt = 0
+        for start in range(0, len(user_ids), batch_size):
+            rebuilt += rebuild_summaries(user_ids[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} account summaries."))
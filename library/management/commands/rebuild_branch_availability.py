@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from library.models import BranchAvailability
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the per-branch availability counters from the copies. They are "
+        "kept current as copies change; run this after importing or moving copies "
+        "with bulk tools or raw SQL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, batch_size, **options):
+        rebuilt = BranchAvailability.rebuild(batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} branch availability rows."))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from library import outbox
+
+
+class Command(BaseCommand):
+    help = "Publish committed outbox messages to Celery, once or continuously."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep relaying until interrupted.")
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help="Seconds to sleep between passes when --loop is set.")
+
+    def handle(self, *args, loop, interval, **options):
+        while True:
+            published = outbox.relay()
+            if published:
+                self.stdout.write(f"Published {published} outbox message(s).")
+            if not loop:
+                return
+            time.sleep(interval)
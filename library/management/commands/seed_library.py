@@ -0,0 +1,195 @@
+import random
+from collections import Counter
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.timezone import now
+
+from library.account_summary import rebuild_summaries
+from library.catalog_cache import bump_catalog_version
+from library.catalog_changes import record_changes
+from library.loadtest import SEED_PREFIX, zipf_weights
+from library.models import (
+    Book, BorrowedBook, BorrowRequest, Branch, BranchAvailability, Copy, Reservation, User,
+)
+
+CATEGORIES = [
+    'Fiction', 'Science', 'History', 'Biography', 'Children', 'Fantasy', 'Mystery',
+    'Romance', 'Technology', 'Philosophy', 'Poetry', 'Travel',
+]
+WORDS = [
+    'silent', 'river', 'garden', 'shadow', 'empire', 'winter', 'glass', 'stone', 'northern',
+    'light', 'hidden', 'city', 'ocean', 'letters', 'machine', 'forest', 'last', 'golden',
+    'broken', 'distant', 'house', 'mountain', 'secret', 'night', 'summer', 'iron', 'wild',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed the database with books, users, loans, reservations and borrow requests "
+        "for load testing. Popularity follows a Zipf distribution, so a few books and "
+        "patrons account for most of the activity. Copies are spread over --branches "
+        "branches. Seeded rows are prefixed so they can "
+        "be removed with --clear. Run it against a scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--loans', type=int, default=50000)
+        parser.add_argument('--reservations', type=int, default=5000)
+        parser.add_argument('--branches', type=int, default=3)
+        parser.add_argument('--skew', type=float, default=1.1, help="Zipf exponent for popularity.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, for reproducible data.")
+        parser.add_argument('--clear', action='store_true', help="Only delete previously seeded data.")
+
+    def handle(self, *args, books, users, loans, reservations, branches, skew, seed, clear, **options):
+        with transaction.atomic():
+            self._clear()
+            if clear:
+                return
+            if books < 1 or users < 1 or branches < 1:
+                raise CommandError("--books, --users and --branches must be positive.")
+            self._seed(random.Random(seed), books, users, loans, reservations, branches, skew)
+            # bulk_create skips the post_save signals that invalidate catalog snapshots.
+            bump_catalog_version()
+
+    def _clear(self):
+        # Users first: loans deleted along with their user skip the account summary updates.
+        deleted_users, _ = User.objects.filter(username__startswith=SEED_PREFIX).delete()
+        deleted, _ = Book.objects.filter(isbn__startswith='SEED').delete()
+        deleted_branches, _ = Branch.objects.filter(code__startswith=SEED_PREFIX).delete()
+        if deleted or deleted_users or deleted_branches:
+            self.stdout.write(
+                f"Removed {deleted + deleted_users + deleted_branches} previously seeded rows."
+            )
+
+    def _seed(self, rng, book_count, user_count, loan_count, reservation_count, branch_count, skew):
+        current = now()
+        password = make_password(None)
+
+        branches = Branch.objects.bulk_create(
+            [Branch(name=f'Seed branch {i}', code=f'{SEED_PREFIX}branch-{i}') for i in range(branch_count)]
+        )
+        members = User.objects.bulk_create(
+            [User(username=f'{SEED_PREFIX}member-{i}', email=f'member-{i}@seed.invalid',
+                  role='member', password=password, branch=rng.choice(branches))
+             for i in range(user_count)],
+            batch_size=1000,
+        )
+        User.objects.bulk_create(
+            [User(username=f'{SEED_PREFIX}librarian-{i}', email=f'librarian-{i}@seed.invalid',
+                  role='librarian', password=password, branch=branches[i % branch_count])
+             for i in range(5)],
+        )
+
+        authors = [f'{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}son'
+                   for _ in range(max(1, book_count // 20))]
+        author_weights = zipf_weights(len(authors), skew)
+        category_weights = zipf_weights(len(CATEGORIES), 0.8)
+        catalog = [
+            Book(
+                title=' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))).capitalize() + f' {i}',
+                author=rng.choices(authors, weights=author_weights)[0],
+                isbn=f'SEED{i:09d}',
+                category=rng.choices(CATEGORIES, weights=category_weights)[0],
+                description=' '.join(rng.choice(WORDS) for _ in range(40)),
+                quantity=1,
+            )
+            for i in range(book_count)
+        ]
+        # Rank 1 (the first book) is the most popular.
+        book_weights = zipf_weights(book_count, skew)
+        member_weights = zipf_weights(user_count, skew)
+
+        # Pick loans first so every book has enough copies for its open loans.
+        loan_plan = []
+        open_per_book = Counter()
+        for book_index, user_index in zip(
+            rng.choices(range(book_count), weights=book_weights, k=loan_count),
+            rng.choices(range(user_count), weights=member_weights, k=loan_count),
+        ):
+            borrowed_at = current - timedelta(days=rng.uniform(0, 365))
+            # Roughly 10% of loans are still open, some of them overdue.
+            returned = borrowed_at < current - timedelta(days=30) or rng.random() < 0.9
+            loan_plan.append((book_index, user_index, borrowed_at, returned))
+            if not returned:
+                open_per_book[book_index] += 1
+        for index, book in enumerate(catalog):
+            book.quantity = open_per_book[index] + rng.randint(0 if open_per_book[index] else 1, 3)
+        catalog = Book.objects.bulk_create(catalog, batch_size=1000)
+
+        # bulk_create skips Book.save(), which would create the copies.
+        # A book's copies are dealt round-robin over the branches.
+        copies = []
+        for index, book in enumerate(catalog):
+            for n in range(book.quantity):
+                status = 'borrowed' if n < open_per_book[index] else 'available'
+                copies.append(Copy(book=book, barcode=f'SEED-{index:07d}-{n:03d}', status=status,
+                                   branch=branches[(index + n) % branch_count]))
+        copies = Copy.objects.bulk_create(copies, batch_size=1000)
+        borrowed_copies = {}
+        for copy in copies:
+            if copy.status == 'borrowed':
+                borrowed_copies.setdefault(copy.book_id, []).append(copy)
+
+        # bulk_create skips BorrowedBook.save(), which would claim copies.
+        # auto_now_add overwrites borrowed_at on insert, so it is restored afterwards.
+        loan_objects = []
+        for book_index, user_index, borrowed_at, returned in loan_plan:
+            due_date = borrowed_at + timedelta(days=14)
+            returned_at = borrowed_at + timedelta(days=rng.uniform(1, 21)) if returned else None
+            if returned_at and returned_at > current:
+                returned_at = current
+            fine = max(0, (returned_at - due_date).days) * 5 if returned_at else 0
+            book = catalog[book_index]
+            copy = None if returned_at else borrowed_copies[book.pk].pop()
+            loan_objects.append(BorrowedBook(
+                user=members[user_index], book=book, due_date=due_date, copy=copy,
+                branch=copy.branch if copy else rng.choice(branches),
+                returned_at=returned_at, fine_amount=fine, borrowed_at=borrowed_at,
+            ))
+        borrowed_at_values = [loan.borrowed_at for loan in loan_objects]
+        loan_objects = BorrowedBook.objects.bulk_create(loan_objects, batch_size=1000)
+        for loan, borrowed_at in zip(loan_objects, borrowed_at_values):
+            loan.borrowed_at = borrowed_at
+        BorrowedBook.objects.bulk_update(loan_objects, ['borrowed_at'], batch_size=500)
+
+        reservation_objects = []
+        reserved_at_values = []
+        for book_index, user_index in zip(
+            rng.choices(range(book_count), weights=book_weights, k=reservation_count),
+            rng.choices(range(user_count), weights=member_weights, k=reservation_count),
+        ):
+            reservation_objects.append(Reservation(
+                book=catalog[book_index], user=members[user_index], branch=members[user_index].branch,
+                status=rng.choices(['pending', 'confirmed', 'cancelled'], weights=[6, 2, 2])[0],
+            ))
+            reserved_at_values.append(current - timedelta(days=rng.uniform(0, 10)))
+        reservation_objects = Reservation.objects.bulk_create(reservation_objects, batch_size=1000)
+        for reservation, reserved_at in zip(reservation_objects, reserved_at_values):
+            reservation.reserved_at = reserved_at
+        Reservation.objects.bulk_update(reservation_objects, ['reserved_at'], batch_size=500)
+
+        BorrowRequest.objects.bulk_create([
+            BorrowRequest(book=catalog[book_index], user=members[user_index],
+                          branch=members[user_index].branch)
+            for book_index, user_index in zip(
+                rng.choices(range(book_count), weights=book_weights, k=min(50, book_count)),
+                rng.choices(range(user_count), weights=member_weights, k=min(50, book_count)),
+            )
+        ])
+
+        # Built once from the tables; bulk_create skipped the incremental updates.
+        record_changes([book.pk for book in catalog])
+        BranchAvailability.rebuild()
+        member_ids = [member.pk for member in members]
+        for start in range(0, len(member_ids), 1000):
+            rebuild_summaries(member_ids[start:start + 1000])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {branch_count} branches, {book_count} books, {user_count} members, 5 librarians, {loan_count} loans "
+            f"({sum(open_per_book.values())} open) and {reservation_count} reservations."
+        ))
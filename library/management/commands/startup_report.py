@@ -0,0 +1,92 @@
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter: import the WSGI module like gunicorn does, then
+# serve one request through it. Timings are printed as JSON on the last stdout line.
+PROBE = r'''
+import json, os, sys, time
+started = time.perf_counter()
+from library_system.wsgi import application
+booted = time.perf_counter()
+from wsgiref.util import setup_testing_defaults
+environ = {'PATH_INFO': %(path)r, 'REQUEST_METHOD': 'GET', 'HTTP_HOST': 'localhost'}
+setup_testing_defaults(environ)
+status = []
+body = b''.join(application(environ, lambda s, h, exc_info=None: status.append(s)))
+served = time.perf_counter()
+print(json.dumps({
+    'boot_ms': (booted - started) * 1000,
+    'first_request_ms': (served - booted) * 1000,
+    'status': status[0] if status else None,
+    'modules': len(sys.modules),
+    'celery_loaded': 'celery' in sys.modules,
+    'kombu_loaded': 'kombu' in sys.modules,
+}))
+'''
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+class Command(BaseCommand):
+    help = (
+        "Profile web process cold start with 'python -X importtime': boot the WSGI "
+        "application in a fresh interpreter, serve one request, and report boot and "
+        "first-request latency, whether Celery was imported, and the most expensive "
+        "imports by package and by top-level module."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/books/', help="Path of the first request.")
+        parser.add_argument('--runs', type=int, default=3, help="Fresh interpreters to take the median over.")
+        parser.add_argument('--top', type=int, default=15)
+
+    def handle(self, *args, path, runs, top, **options):
+        env = dict(os.environ)
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'library_system.settings')
+        results = []
+        imports = None
+        for _ in range(max(1, runs)):
+            proc = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', PROBE % {'path': path}],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                raise CommandError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'probe failed')
+            results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+            if imports is None:
+                imports = self._parse(proc.stderr)
+
+        boot = sorted(r['boot_ms'] for r in results)[len(results) // 2]
+        first = sorted(r['first_request_ms'] for r in results)[len(results) // 2]
+        last = results[-1]
+        self.stdout.write(f"Boot (import library_system.wsgi), median of {len(results)}: {boot:.0f} ms")
+        self.stdout.write(f"First request GET {path} ({last['status']}): {first:.0f} ms")
+        self.stdout.write(f"Modules loaded: {last['modules']}; celery: {last['celery_loaded']}; kombu: {last['kombu_loaded']}")
+
+        by_package = defaultdict(int)
+        for name, self_us, _cumulative, _depth in imports:
+            by_package[name.split('.')[0]] += self_us
+        self.stdout.write("\nImport time by package (self, first run):")
+        for package, micros in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+            self.stdout.write(f"  {micros / 1000:8.1f} ms  {package}")
+
+        self.stdout.write("\nSlowest top-level imports (cumulative):")
+        roots = [(name, cumulative) for name, _self, cumulative, depth in imports if depth == 0]
+        for name, micros in sorted(roots, key=lambda item: -item[1])[:top]:
+            self.stdout.write(f"  {micros / 1000:8.1f} ms  {name}")
+
+    def _parse(self, stderr):
+        rows = []
+        for line in stderr.splitlines():
+            match = IMPORT_LINE.match(line)
+            if match:
+                self_us, cumulative, indent, name = match.groups()
+                rows.append((name, int(self_us), int(cumulative), (len(indent) - 1) // 2))
+        return rows
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from library_system.task_metrics import summarize
+
+
+def _seconds(value):
+    return '-' if value is None else f'{value:.3f}s'
+
+
+class Command(BaseCommand):
+    help = "Print per-task Celery run statistics (duration, queue wait, retries, throughput)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help="Size of the window to report on.")
+
+    def handle(self, *args, hours, **options):
+        rows = summarize(hours)
+        if not rows:
+            self.stdout.write(f"No task runs recorded in the last {hours}h.")
+            return
+
+        header = (
+            f"{'task':<50} {'runs':>6} {'fail':>5} {'retry':>5} {'p50':>9} {'p95':>9} "
+            f"{'wait p95':>9} {'items':>8} {'items/s':>9} {'workers':>8}"
+        )
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for row in rows:
+            self.stdout.write(
+                f"{row['task']:<50} {row['runs']:>6} {row['failures']:>5} {row['retries']:>5} "
+                f"{_seconds(row['duration_p50']):>9} {_seconds(row['duration_p95']):>9} "
+                f"{_seconds(row['queue_wait_p95']):>9} {row['processed']:>8} "
+                f"{row['processed_per_second'] if row['processed_per_second'] is not None else '-':>9} "
+                f"{row['busy_workers']:>8}"
+            )
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.19 on 2026-10-19 07:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0005_bookrecommendation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_name', models.CharField(max_length=255)),
+                ('task_id', models.CharField(max_length=255)),
+                ('state', models.CharField(max_length=20)),
+                ('started_at', models.DateTimeField()),
+                ('duration', models.FloatField()),
+                ('queue_wait', models.FloatField(blank=True, null=True)),
+                ('retries', models.PositiveIntegerField(default=0)),
+                ('processed', models.PositiveIntegerField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['started_at', 'task_name'], name='library_tas_started_037844_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.19 on 2026-10-19 08:21
+
+from django.core.files.storage import FileSystemStorage
+from django.db import migrations, models
+import library.storage
+
+
+def move_covers_to_store(apps, schema_editor):
+    # Re-save existing uploads (book_covers/...) under their content hash.
+    # The old files stay on disk; `manage.py gc_covers --legacy` removes them.
+    Book = apps.get_model('library', 'Book')
+    legacy = FileSystemStorage()
+    store = library.storage.cover_storage()
+    for book in Book.objects.exclude(cover_image='').exclude(cover_image__isnull=True).iterator():
+        name = book.cover_image.name
+        if library.storage.NAME_PATTERN.match(name) or not legacy.exists(name):
+            continue
+        with legacy.open(name) as content:
+            new_name = store.save(name, content)
+        Book.objects.filter(pk=book.pk).update(cover_image=new_name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0008_book_facet_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='cover_image',
+            field=models.ImageField(blank=True, null=True, storage=library.storage.cover_storage, upload_to=''),
+        ),
+        migrations.RunPython(move_covers_to_store, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 4.2.19 on 2026-10-19 08:23
+
+from collections import defaultdict
+import uuid
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_copies(apps, schema_editor):
+    # Until now borrowing decremented Book.quantity and returning incremented
+    # it, so quantity counted copies on the shelf. Each book gets that many
+    # available copies plus one borrowed copy per open loan, and quantity
+    # becomes the total number of copies.
+    Book = apps.get_model('library', 'Book')
+    BorrowedBook = apps.get_model('library', 'BorrowedBook')
+    Copy = apps.get_model('library', 'Copy')
+
+    open_loans = defaultdict(list)
+    for loan_id, book_id in BorrowedBook.objects.filter(returned_at__isnull=True).values_list('id', 'book_id'):
+        open_loans[book_id].append(loan_id)
+
+    def barcode():
+        return f'AUTO-{uuid.uuid4().hex[:12].upper()}'
+
+    for book in Book.objects.only('id', 'quantity').iterator():
+        loans = open_loans.get(book.id, [])
+        Copy.objects.bulk_create(
+            [Copy(book_id=book.id, barcode=barcode()) for _ in range(book.quantity)]
+        )
+        borrowed = Copy.objects.bulk_create(
+            [Copy(book_id=book.id, barcode=barcode(), status='borrowed') for _ in loans]
+        )
+        for loan_id, copy in zip(loans, borrowed):
+            BorrowedBook.objects.filter(pk=loan_id).update(copy_id=copy.pk)
+        if loans:
+            Book.objects.filter(pk=book.id).update(quantity=book.quantity + len(loans))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0009_content_addressed_covers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Copy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('barcode', models.CharField(max_length=32, unique=True)),
+                ('status', models.CharField(choices=[('available', 'Available'), ('borrowed', 'Borrowed'), ('repair', 'In Repair'), ('lost', 'Lost'), ('withdrawn', 'Withdrawn')], default='available', max_length=10)),
+                ('location', models.CharField(blank=True, max_length=100)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='copies', to='library.book')),
+            ],
+            options={
+                'verbose_name_plural': 'copies',
+            },
+        ),
+        migrations.AddField(
+            model_name='borrowedbook',
+            name='copy',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='loans', to='library.copy'),
+        ),
+        migrations.AddIndex(
+            model_name='copy',
+            index=models.Index(fields=['book', 'status'], name='library_cop_book_id_26652e_idx'),
+        ),
+        migrations.RunPython(create_copies, migrations.RunPython.noop),
+    ]
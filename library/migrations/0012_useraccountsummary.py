@@ -0,0 +1,26 @@
+# Generated by Django 4.2.19 on 2026-10-19 08:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0011_borrowrequest_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAccountSummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='account_summary', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('open_loans', models.JSONField(default=dict)),
+                ('fines_assessed', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('pending_reservations', models.JSONField(default=list)),
+                ('pending_requests', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
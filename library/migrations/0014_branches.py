@@ -0,0 +1,226 @@
+# Generated by Django 4.2.19 on 2026-10-19 08:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+import library.models
+
+BRANCH_MODELS = (
+    'borrowedbook', 'borrowedbookarchive', 'borrowrequest', 'borrowrequestarchive',
+    'copy', 'reservation', 'reservationarchive',
+)
+
+
+def assign_main_branch(apps, schema_editor):
+    # Existing copies, loans, reservations and requests all belong to the main branch.
+    if schema_editor.connection.vendor == 'postgresql':
+        # Check the foreign keys as rows are updated; pending deferred checks
+        # would block the ALTER TABLEs that follow in this transaction.
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    Branch = apps.get_model('library', 'Branch')
+    main_id = Branch.objects.get_or_create(code='main', defaults={'name': 'Main'})[0].pk
+    for model_name in BRANCH_MODELS:
+        apps.get_model('library', model_name).objects.filter(branch__isnull=True).update(branch=main_id)
+
+
+def count_branch_availability(apps, schema_editor):
+    # Every existing copy is now at the main branch.
+    Copy = apps.get_model('library', 'Copy')
+    BranchAvailability = apps.get_model('library', 'BranchAvailability')
+    rows = (
+        Copy.objects.values('branch_id', 'book_id')
+        .annotate(
+            available=models.Count('id', filter=models.Q(status='available')),
+            total=models.Count('id', filter=~models.Q(status='withdrawn')),
+        )
+        .order_by()
+    )
+    BranchAvailability.objects.bulk_create(
+        [BranchAvailability(**row) for row in rows.iterator()], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0013_archive_tables'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Branch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('code', models.SlugField(max_length=20, unique=True)),
+            ],
+            options={
+                'verbose_name_plural': 'branches',
+            },
+        ),
+        migrations.CreateModel(
+            name='BranchAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('available', models.IntegerField(default=0)),
+                ('total', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'branch availability',
+            },
+        ),
+        migrations.AddField(
+            model_name='branchavailability',
+            name='book',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='branch_availability', to='library.book'),
+        ),
+        migrations.AddField(
+            model_name='branchavailability',
+            name='branch',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability', to='library.branch'),
+        ),
+        migrations.AddField(
+            model_name='borrowedbook',
+            name='branch',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='loans', to='library.branch'),
+        ),
+        migrations.AddField(
+            model_name='borrowedbookarchive',
+            name='branch',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='library.branch'),
+        ),
+        migrations.AddField(
+            model_name='borrowrequest',
+            name='branch',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='borrow_requests', to='library.branch'),
+        ),
+        migrations.AddField(
+            model_name='borrowrequestarchive',
+            name='branch',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='library.branch'),
+        ),
+        migrations.AddField(
+            model_name='copy',
+            name='branch',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='copies', to='library.branch'),
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='branch',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='reservations', to='library.branch'),
+        ),
+        migrations.AddField(
+            model_name='reservationarchive',
+            name='branch',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='library.branch'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='branch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='library.branch'),
+        ),
+        migrations.RunPython(assign_main_branch, migrations.RunPython.noop),
+        # Every row has a branch now. The models' default (the main branch, for
+        # rows created without one) is applied by Django, never by the table, so
+        # it is recorded in the state only.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.AlterField(
+                    model_name='borrowedbook',
+                    name='branch',
+                    field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='loans', to='library.branch'),
+                ),
+                migrations.AlterField(
+                    model_name='borrowrequest',
+                    name='branch',
+                    field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='borrow_requests', to='library.branch'),
+                ),
+                migrations.AlterField(
+                    model_name='copy',
+                    name='branch',
+                    field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='copies', to='library.branch'),
+                ),
+                migrations.AlterField(
+                    model_name='reservation',
+                    name='branch',
+                    field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='reservations', to='library.branch'),
+                ),
+                migrations.AlterField(
+                    model_name='borrowedbookarchive',
+                    name='branch',
+                    field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='library.branch'),
+                ),
+                migrations.AlterField(
+                    model_name='borrowrequestarchive',
+                    name='branch',
+                    field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='library.branch'),
+                ),
+                migrations.AlterField(
+                    model_name='reservationarchive',
+                    name='branch',
+                    field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='library.branch'),
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='borrowedbook',
+                    name='branch',
+                    field=models.ForeignKey(default=library.models.default_branch, on_delete=django.db.models.deletion.PROTECT, related_name='loans', to='library.branch'),
+                ),
+                migrations.AlterField(
+                    model_name='borrowrequest',
+                    name='branch',
+                    field=models.ForeignKey(default=library.models.default_branch, on_delete=django.db.models.deletion.PROTECT, related_name='borrow_requests', to='library.branch'),
+                ),
+                migrations.AlterField(
+                    model_name='copy',
+                    name='branch',
+                    field=models.ForeignKey(default=library.models.default_branch, on_delete=django.db.models.deletion.PROTECT, related_name='copies', to='library.branch'),
+                ),
+                migrations.AlterField(
+                    model_name='reservation',
+                    name='branch',
+                    field=models.ForeignKey(default=library.models.default_branch, on_delete=django.db.models.deletion.PROTECT, related_name='reservations', to='library.branch'),
+                ),
+                migrations.AlterField(
+                    model_name='borrowedbookarchive',
+                    name='branch',
+                    field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='library.branch'),
+                ),
+                migrations.AlterField(
+                    model_name='borrowrequestarchive',
+                    name='branch',
+                    field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='library.branch'),
+                ),
+                migrations.AlterField(
+                    model_name='reservationarchive',
+                    name='branch',
+                    field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='library.branch'),
+                ),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='borrowrequest',
+            name='library_bor_status_7dfea6_idx',
+        ),
+        migrations.AddIndex(
+            model_name='borrowedbook',
+            index=models.Index(fields=['branch', 'returned_at', 'due_date'], name='library_bor_branch__701084_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowrequest',
+            index=models.Index(fields=['branch', 'status', 'requested_at'], name='library_bor_branch__b04358_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='copy',
+            index=models.Index(fields=['branch', 'book', 'status'], name='library_cop_branch__431043_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['branch', 'status', 'reserved_at'], name='library_res_branch__d4d4ac_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='branchavailability',
+            constraint=models.UniqueConstraint(fields=('branch', 'book'), name='unique_branch_book_availability'),
+        ),
+        migrations.RunPython(count_branch_availability, migrations.RunPython.noop),
+    ]
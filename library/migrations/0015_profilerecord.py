@@ -0,0 +1,30 @@
+# Generated by Django 4.2.19 on 2026-10-19 09:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0014_branches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('request', 'Request'), ('task', 'Task')], max_length=10)),
+                ('name', models.CharField(max_length=255)),
+                ('trigger', models.CharField(max_length=10)),
+                ('started_at', models.DateTimeField()),
+                ('duration', models.FloatField()),
+                ('status_code', models.PositiveIntegerField(blank=True, null=True)),
+                ('query_count', models.PositiveIntegerField(default=0)),
+                ('query_time', models.FloatField(default=0)),
+                ('queries', models.JSONField(default=list)),
+                ('stats', models.TextField(blank=True)),
+                ('raw_stats', models.BinaryField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.19 on 2026-10-19 09:10
+
+from django.db import migrations, models
+
+
+def log_existing_books(apps, schema_editor):
+    # Clients syncing from zero get every book that exists now.
+    Book = apps.get_model('library', 'Book')
+    CatalogChange = apps.get_model('library', 'CatalogChange')
+    CatalogChange.objects.bulk_create(
+        (CatalogChange(book_id=book_id) for book_id in Book.objects.order_by('id').values_list('id', flat=True)),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0015_profilerecord'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogChange',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('book_id', models.BigIntegerField(db_index=True)),
+                ('deleted', models.BooleanField(default=False)),
+                ('changed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(log_existing_books, migrations.RunPython.noop),
+    ]
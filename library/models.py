@@ -1,6 +1,10 @@
-from django.db import models
+import uuid
+
+from django.db import connections, models, router, transaction
+from django.db.models import Count, F, Q
 from django.utils.timezone import now, timedelta
 from django.contrib.auth.models import AbstractUser
+from .storage import cover_storage
 
 def now_plus_14_days():
     return now() + timedelta(days=14)
@@ -8,6 +12,45 @@ def now_plus_14_days():
 # Expose default_due_date so migrations can reference it.
 default_due_date = now_plus_14_days
 
+DEFAULT_BRANCH_CODE = 'main'
+# Main branch id per database, cached only once the row is known to be
+# committed. signals.py forgets it when branches change or tables are flushed.
+_default_branch_ids = {}
+
+def default_branch():
+    # Rows created without a branch (single-branch setups, older clients) belong to the main branch.
+    alias = router.db_for_write(Branch)
+    branch_id = _default_branch_ids.get(alias)
+    if branch_id is None:
+        branch, created = Branch.objects.using(alias).get_or_create(
+            code=DEFAULT_BRANCH_CODE, defaults={'name': 'Main'}
+        )
+        branch_id = branch.pk
+        if created or connections[alias].in_atomic_block:
+            # A rollback would leave a cached id pointing at no row.
+            transaction.on_commit(lambda: _default_branch_ids.setdefault(alias, branch_id), using=alias)
+        else:
+            _default_branch_ids[alias] = branch_id
+    return branch_id
+
+def forget_default_branch():
+    _default_branch_ids.clear()
+
+class Branch(models.Model):
+    name = models.CharField(max_length=100)
+    code = models.SlugField(max_length=20, unique=True)
+
+    class Meta:
+        verbose_name_plural = 'branches'
+
+    def __str__(self):
+        return self.name
+
+class BranchQuerySet(models.QuerySet):
+    def for_branch(self, branch):
+        """Rows of ``branch`` (a Branch or its id); every branch when it is None."""
+        return self if branch is None else self.filter(branch=branch)
+
 class User(AbstractUser):
     ROLE_CHOICES = (
         ('admin', 'Admin'),
@@ -15,6 +58,8 @@ class User(AbstractUser):
         ('member', 'Member'),
     )
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='member')
+    # Librarians work at (and members usually borrow from) their home branch.
+    branch = models.ForeignKey(Branch, on_delete=models.SET_NULL, null=True, blank=True)
 
     def __str__(self):
         return f"{self.username} ({self.role})"
@@ -24,7 +69,8 @@ class Book(models.Model):
     author = models.CharField(max_length=255)
     isbn = models.CharField(max_length=13, unique=True)
     # New fields for enhanced book details:
-    cover_image = models.ImageField(upload_to="book_covers/", null=True, blank=True)
+    # Stored once per distinct image; see library.storage.
+    cover_image = models.ImageField(storage=cover_storage, null=True, blank=True)
     description = models.TextField(null=True, blank=True)
     category = models.CharField(max_length=100, null=True, blank=True)
     
@@ -33,41 +79,137 @@ class Book(models.Model):
     due_date = models.DateField(null=True, blank=True)
     quantity = models.PositiveIntegerField(default=1)
 
+    class Meta:
+        # Facet filters and counts (library.facets) group and filter on these.
+        indexes = [
+            models.Index(fields=['category', 'title']),
+            models.Index(fields=['author', 'title']),
+        ]
+
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.sync_copies()
+
+    def sync_copies(self):
+        """Add or withdraw copies so that ``quantity`` copies are in circulation."""
+        in_circulation = self.copies.exclude(status='withdrawn')
+        missing = self.quantity - in_circulation.count()
+        if missing > 0:
+            # New copies go to the main branch until they are moved.
+            branch_id = default_branch()
+            Copy.objects.bulk_create(
+                [Copy(book=self, branch_id=branch_id, barcode=Copy.generate_barcode()) for _ in range(missing)]
+            )
+            BranchAvailability.adjust({(branch_id, self.pk): (missing, missing)})
+        elif missing < 0:
+            # Only copies on the shelf can be withdrawn; borrowed ones stay.
+            surplus = list(
+                in_circulation.filter(status='available').order_by('-id').values_list('id', 'branch_id')[:-missing]
+            )
+            Copy.objects.filter(id__in=[copy_id for copy_id, _ in surplus]).update(status='withdrawn')
+            changes = {}
+            for _, branch_id in surplus:
+                available, total = changes.get((branch_id, self.pk), (0, 0))
+                changes[(branch_id, self.pk)] = (available - 1, total - 1)
+            BranchAvailability.adjust(changes)
+
     @property
     def available_copies(self):
-        from .models import BorrowedBook  # local import to avoid circular import issues
-        return self.quantity - BorrowedBook.objects.filter(book=self, returned_at__isnull=True).count()
+        return self.copies.filter(status='available').count()
 
     @property
     def total_copies(self):
         return self.quantity
 
+# One physical item of a book, identified by the barcode on its label.
+class Copy(models.Model):
+    STATUS_CHOICES = [
+        ('available', 'Available'),
+        ('borrowed', 'Borrowed'),
+        ('repair', 'In Repair'),
+        ('lost', 'Lost'),
+        ('withdrawn', 'Withdrawn'),
+    ]
+    book = models.ForeignKey(Book, related_name="copies", on_delete=models.CASCADE)
+    branch = models.ForeignKey(Branch, related_name="copies", on_delete=models.PROTECT, default=default_branch)
+    barcode = models.CharField(max_length=32, unique=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='available')
+    location = models.CharField(max_length=100, blank=True)  # shelf within the branch
+
+    objects = BranchQuerySet.as_manager()
+
+    class Meta:
+        verbose_name_plural = 'copies'
+        # Availability is COUNT(*) over (book, status='available') from this index;
+        # a branch's copies of a book come from the branch-led one.
+        indexes = [
+            models.Index(fields=['book', 'status']),
+            models.Index(fields=['branch', 'book', 'status']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        copy = super().from_db(db, field_names, values)
+        # Remembered so moving a copy recounts the branch it left as well.
+        copy._loaded_branch_id = copy.__dict__.get('branch_id')
+        return copy
+
+    @staticmethod
+    def generate_barcode():
+        # Placeholder for copies created from Book.quantity until they are labelled.
+        return f'AUTO-{uuid.uuid4().hex[:12].upper()}'
+
+    def __str__(self):
+        return self.barcode
+
 class BorrowedBook(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    # Set to the claimed copy's branch.
+    branch = models.ForeignKey(Branch, related_name="loans", on_delete=models.PROTECT, default=default_branch)
+    copy = models.ForeignKey(Copy, related_name="loans", on_delete=models.SET_NULL, null=True, blank=True)
     borrowed_at = models.DateTimeField(auto_now_add=True)
     due_date = models.DateTimeField(default=default_due_date)
     returned_at = models.DateTimeField(null=True, blank=True)
     fine_amount = models.DecimalField(max_digits=6, decimal_places=2, default=0.00)
 
+    objects = BranchQuerySet.as_manager()
+
+    class Meta:
+        # A branch's open and overdue loans.
+        indexes = [models.Index(fields=['branch', 'returned_at', 'due_date'])]
+
+    def claimable_copies(self):
+        copies = Copy.objects.filter(book_id=self.book_id, status='available')
+        return copies.filter(pk=self.copy_id) if self.copy_id else copies.for_branch(self.branch_id)
+
     def can_borrow(self):
-        if not self.pk and self.book.available_copies > 0:
-            self.book.quantity -= 1
-            self.book.save()
-        elif not self.pk:
+        if not self.pk and not self.claimable_copies().exists():
             raise ValueError("No copies available for borrowing.")
 
+    def claim_copy(self):
+        # The conditional UPDATE succeeds for exactly one borrower per copy,
+        # so concurrent loans can never be given the same item.
+        for copy_id, branch_id in self.claimable_copies().order_by('id').values_list('id', 'branch_id')[:10]:
+            if Copy.objects.filter(pk=copy_id, status='available').update(status='borrowed'):
+                self.copy_id = copy_id
+                self.branch_id = branch_id
+                BranchAvailability.adjust({(branch_id, self.book_id): (-1, 0)})
+                return
+        raise ValueError("No copies available for borrowing.")
+
     def return_book(self):
         if not self.returned_at:  # Ensure book is not already returned
             self.returned_at = now()
             overdue_days = max(0, (self.returned_at - self.due_date).days)
             self.fine_amount = overdue_days * 5
-            self.book.quantity += 1
-            self.book.save()
-            super().save(update_fields=['returned_at', 'fine_amount'])
+            with transaction.atomic(savepoint=False):
+                if self.copy_id and Copy.objects.filter(pk=self.copy_id, status='borrowed').update(status='available'):
+                    BranchAvailability.adjust({(self.branch_id, self.book_id): (1, 0)})
+                super().save(update_fields=['returned_at', 'fine_amount'])
 
     def clean(self):
         if not self.returned_at:
@@ -75,8 +217,11 @@ class BorrowedBook(models.Model):
         super().clean()
 
     def save(self, *args, **kwargs):
-        self.clean()
-        super().save(*args, **kwargs)
+        # No savepoint: a failed claim aborts the caller's transaction anyway.
+        with transaction.atomic(savepoint=False):
+            if not self.pk and not self.returned_at:
+                self.claim_copy()
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.user} borrowed {self.book} (Due: {self.due_date}, Returned: {self.returned_at or 'Not Returned'})"
@@ -89,9 +234,17 @@ class Reservation(models.Model):
     ]
     book = models.ForeignKey(Book, related_name="reservations", on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    branch = models.ForeignKey(Branch, related_name="reservations", on_delete=models.PROTECT,
+                               default=default_branch)  # pickup branch
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
     reserved_at = models.DateTimeField(auto_now_add=True)
 
+    objects = BranchQuerySet.as_manager()
+
+    class Meta:
+        # A branch's reservation queues.
+        indexes = [models.Index(fields=['branch', 'status', 'reserved_at'])]
+
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
 
@@ -104,11 +257,223 @@ class BorrowRequest(models.Model):
         ('pending', 'Pending'),
         ('approved', 'Approved'),
         ('rejected', 'Rejected'),
+        ('queued', 'Queued'),  # no copy was free on approval; a reservation was created
     ]
     book = models.ForeignKey(Book, related_name="borrow_requests", on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    branch = models.ForeignKey(Branch, related_name="borrow_requests", on_delete=models.PROTECT,
+                               default=default_branch)  # where the copy is collected
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
     requested_at = models.DateTimeField(auto_now_add=True)
 
+    objects = BranchQuerySet.as_manager()
+
+    class Meta:
+        # Each branch reads and approves its pending requests oldest first.
+        indexes = [models.Index(fields=['branch', 'status', 'requested_at'])]
+
     def __str__(self):
         return f"Borrow Request for {self.book.title} by {self.user.username} ({self.status})"
+
+# Precomputed "patrons who borrowed this also borrowed" neighbours, rebuilt by a periodic task.
+class BookRecommendation(models.Model):
+    book = models.OneToOneField(Book, primary_key=True, related_name="recommendation", on_delete=models.CASCADE)
+    # [[book_id, score], ...] ordered best first
+    neighbors = models.JSONField(default=list)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Recommendations for {self.book.title}"
+
+# Copies of a book at a branch, by status: the rollup behind per-branch and
+# cross-branch availability. Circulation adjusts it by delta as copies change
+# status; other copy edits recount the affected rows (see library.signals).
+class BranchAvailability(models.Model):
+    branch = models.ForeignKey(Branch, related_name="availability", on_delete=models.CASCADE)
+    book = models.ForeignKey(Book, related_name="branch_availability", on_delete=models.CASCADE)
+    available = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)  # copies in circulation (not withdrawn)
+
+    objects = BranchQuerySet.as_manager()
+
+    class Meta:
+        verbose_name_plural = 'branch availability'
+        constraints = [models.UniqueConstraint(fields=['branch', 'book'], name='unique_branch_book_availability')]
+
+    def __str__(self):
+        return f"{self.book_id} at {self.branch_id}: {self.available}/{self.total}"
+
+    @classmethod
+    def adjust(cls, changes):
+        """
+        Apply {(branch_id, book_id): (available delta, total delta)} after the
+        copies changed. Missing rows are recounted from the copies instead.
+        """
+        missing = []
+        for (branch_id, book_id), (available, total) in changes.items():
+            if not cls.objects.filter(branch_id=branch_id, book_id=book_id).update(
+                available=F('available') + available, total=F('total') + total,
+            ):
+                missing.append((branch_id, book_id))
+        if missing:
+            cls.recount(missing)
+
+    @classmethod
+    def recount(cls, pairs):
+        """Recompute the rows of the given (branch_id, book_id) pairs from the copies."""
+        pairs = set(pairs)
+        if not pairs:
+            return
+        counts = {
+            (row['branch_id'], row['book_id']): row
+            for row in Copy.objects.filter(
+                branch_id__in={branch_id for branch_id, _ in pairs},
+                book_id__in={book_id for _, book_id in pairs},
+            ).values('branch_id', 'book_id').annotate(
+                available_count=Count('id', filter=Q(status='available')),
+                total_count=Count('id', filter=~Q(status='withdrawn')),
+            )
+        }
+        cls.objects.bulk_create(
+            [
+                cls(branch_id=branch_id, book_id=book_id,
+                    available=counts.get((branch_id, book_id), {}).get('available_count', 0),
+                    total=counts.get((branch_id, book_id), {}).get('total_count', 0))
+                for branch_id, book_id in pairs
+            ],
+            update_conflicts=True,
+            unique_fields=['branch', 'book'],
+            update_fields=['available', 'total'],
+        )
+
+    @classmethod
+    def rebuild(cls, batch_size=1000):
+        """Replace every row with counts from the copies; returns the number of rows."""
+        rows = (
+            Copy.objects.values('branch_id', 'book_id')
+            .annotate(available=Count('id', filter=Q(status='available')),
+                      total=Count('id', filter=~Q(status='withdrawn')))
+            .order_by()
+        )
+        with transaction.atomic():
+            cls.objects.all().delete()
+            return len(cls.objects.bulk_create([cls(**row) for row in rows.iterator()], batch_size=batch_size))
+
+# Closed circulation records moved out of the live tables by library.archive.
+# Same columns and ids as the live models, plus when the row was archived.
+class BorrowedBookArchive(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, related_name="+", on_delete=models.CASCADE)
+    book = models.ForeignKey(Book, related_name="+", on_delete=models.CASCADE)
+    branch = models.ForeignKey(Branch, related_name="+", on_delete=models.PROTECT)
+    copy = models.ForeignKey(Copy, related_name="+", on_delete=models.SET_NULL, null=True, blank=True)
+    borrowed_at = models.DateTimeField()
+    due_date = models.DateTimeField()
+    returned_at = models.DateTimeField(null=True, blank=True)
+    fine_amount = models.DecimalField(max_digits=6, decimal_places=2, default=0.00)
+    archived_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Archived loan {self.id}"
+
+class ReservationArchive(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    book = models.ForeignKey(Book, related_name="+", on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name="+", on_delete=models.CASCADE)
+    branch = models.ForeignKey(Branch, related_name="+", on_delete=models.PROTECT)
+    status = models.CharField(max_length=10, choices=Reservation.STATUS_CHOICES)
+    reserved_at = models.DateTimeField()
+    archived_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Archived reservation {self.id}"
+
+class BorrowRequestArchive(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    book = models.ForeignKey(Book, related_name="+", on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name="+", on_delete=models.CASCADE)
+    branch = models.ForeignKey(Branch, related_name="+", on_delete=models.PROTECT)
+    status = models.CharField(max_length=10, choices=BorrowRequest.STATUS_CHOICES)
+    requested_at = models.DateTimeField()
+    archived_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Archived borrow request {self.id}"
+
+# What a member's account page shows, kept current by library.account_summary.
+class UserAccountSummary(models.Model):
+    user = models.OneToOneField(User, primary_key=True, related_name="account_summary", on_delete=models.CASCADE)
+    # {loan_id: due_date ISO string} for loans not yet returned
+    open_loans = models.JSONField(default=dict)
+    # Sum of fine_amount over returned loans
+    fines_assessed = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    pending_reservations = models.JSONField(default=list)  # reservation ids
+    pending_requests = models.JSONField(default=list)  # borrow request ids
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Account summary for user {self.user_id}"
+
+# One row per Celery task execution, recorded by library_system.task_metrics.
+class TaskRun(models.Model):
+    task_name = models.CharField(max_length=255)
+    task_id = models.CharField(max_length=255)
+    state = models.CharField(max_length=20)
+    started_at = models.DateTimeField()
+    duration = models.FloatField()  # seconds spent executing
+    queue_wait = models.FloatField(null=True, blank=True)  # seconds between publish and start
+    retries = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['started_at', 'task_name'])]
+
+    def __str__(self):
+        return f"{self.task_name} {self.state} in {self.duration:.3f}s"
+
+# A profiled request or Celery task (see library_system.profiling). Only the
+# newest PROFILING_BUFFER_SIZE are kept.
+class ProfileRecord(models.Model):
+    KIND_CHOICES = [
+        ('request', 'Request'),
+        ('task', 'Task'),
+    ]
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    name = models.CharField(max_length=255)  # "GET dashboard" or the task name
+    trigger = models.CharField(max_length=10)  # 'header' or 'sample'
+    started_at = models.DateTimeField()
+    duration = models.FloatField()  # seconds
+    status_code = models.PositiveIntegerField(null=True, blank=True)
+    query_count = models.PositiveIntegerField(default=0)
+    query_time = models.FloatField(default=0)  # seconds
+    queries = models.JSONField(default=list)  # [{"sql", "time", "stack"}]
+    stats = models.TextField(blank=True)  # pstats report, by cumulative time
+    raw_stats = models.BinaryField(null=True, blank=True)  # marshalled pstats, for download
+
+    def __str__(self):
+        return f"{self.name} in {self.duration:.3f}s"
+
+# Celery tasks to publish once the transaction that wrote them commits (see library.outbox).
+class OutboxMessage(models.Model):
+    task_name = models.CharField(max_length=255)
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=now, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.task_name} (attempts: {self.attempts})"
+
+# One row per book that changed, at the sequence number of its latest change
+# (see library.catalog_changes). Deleted books keep a tombstone row.
+class CatalogChange(models.Model):
+    seq = models.BigAutoField(primary_key=True)
+    book_id = models.BigIntegerField(db_index=True)  # not a foreign key: tombstones outlive their book
+    deleted = models.BooleanField(default=False)
+    changed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"#{self.seq} book {self.book_id}{' deleted' if self.deleted else ''}"
@@ -0,0 +1,136 @@
+"""
+Notification rendering and batched delivery.
+
+Every notification type has an HTML and a plain-text template under
+``templates/emails/``. Compiled templates are kept per process (Celery workers
+warm them at start-up). Templates made only of text and plain ``{{ name }}``
+variables are further reduced to a list of static strings and slots, which a
+batch fills by string joining; anything else renders through one shared
+``Context``. ``send_batch`` delivers a batch over a single connection.
+"""
+import logging
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template import Context, engines
+from django.template.base import TextNode, Variable, VariableNode
+from django.template.defaulttags import AutoEscapeControlNode
+from django.utils.html import conditional_escape
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATIONS = {
+    'borrow_confirmation': '📚 Book Borrowed Confirmation',
+    'overdue_reminder': 'Overdue Book Reminder',
+    'due_date_reminder': 'Upcoming Due Date Reminder',
+    'overdue_digest': 'Overdue Books Reminder',
+    'due_date_digest': 'Books Due Today',
+    'reservation_expired': 'Reservation Expired',
+    'reservation_available': 'Reserved Book Available',
+}
+
+_compiled = {}
+
+
+def _flatten(nodelist, autoescape):
+    """
+    Reduce a node list to static strings and (name, autoescape) slots, or
+    return None if it uses anything beyond plain variables.
+    """
+    parts = []
+    for node in nodelist:
+        if isinstance(node, TextNode):
+            parts.append(node.s)
+        elif isinstance(node, AutoEscapeControlNode):
+            inner = _flatten(node.nodelist, node.setting)
+            if inner is None:
+                return None
+            parts.extend(inner)
+        elif (
+            isinstance(node, VariableNode)
+            and not node.filter_expression.filters
+            and isinstance(node.filter_expression.var, Variable)
+            and len(node.filter_expression.var.lookups or ()) == 1
+        ):
+            parts.append((node.filter_expression.var.lookups[0], autoescape))
+        else:
+            return None
+    return parts
+
+
+def _compile(engine, name, autoescape):
+    template = engine.get_template(name)
+    return template, _flatten(template.nodelist, autoescape)
+
+
+def _templates(kind):
+    templates = _compiled.get(kind)
+    if templates is None:
+        engine = engines['django'].engine
+        templates = _compiled[kind] = (
+            _compile(engine, f'emails/{kind}.txt', autoescape=False),
+            _compile(engine, f'emails/{kind}.html', autoescape=True),
+        )
+    return templates
+
+
+def warm_up():
+    """Compile every notification template in this process."""
+    for kind in NOTIFICATIONS:
+        _templates(kind)
+
+
+def _render(compiled, context, values):
+    template, parts = compiled
+    # The flat path matches Django's output for string values; others need
+    # localization, so they go through the template engine.
+    if parts is not None and all(type(value) is str for value in values.values()):
+        out = []
+        for part in parts:
+            if type(part) is str:
+                out.append(part)
+            else:
+                name, autoescape = part
+                value = values.get(name, '')
+                out.append(conditional_escape(value) if autoescape else value)
+        return ''.join(out)
+    with context.push(values):
+        return template.render(context)
+
+
+def render_batch(kind, items):
+    """
+    Render ``items`` -- an iterable of (recipient, context dict) -- into
+    EmailMultiAlternatives messages carrying plain-text and HTML bodies.
+    """
+    subject = NOTIFICATIONS[kind]
+    text_template, html_template = _templates(kind)
+    text_context, html_context = Context(autoescape=False), Context()
+    messages = []
+    for recipient, values in items:
+        text = _render(text_template, text_context, values).strip()
+        html = _render(html_template, html_context, values)
+        message = EmailMultiAlternatives(subject, text, settings.DEFAULT_FROM_EMAIL, [recipient])
+        message.attach_alternative(html, "text/html")
+        messages.append(message)
+    return messages
+
+
+def send_batch(kind, items):
+    """
+    Render and send a batch over one mail connection.
+    Returns (sent, failed); failing to connect at all raises so callers can retry.
+    """
+    messages = render_batch(kind, items)
+    if not messages:
+        return 0, 0
+
+    sent = failed = 0
+    with get_connection() as connection:
+        for message in messages:
+            try:
+                sent += connection.send_messages([message]) or 0
+            except Exception as e:
+                logger.error("Error sending %s email to %s: %s", kind, message.to[0], str(e))
+                failed += 1
+    return sent, failed
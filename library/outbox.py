@@ -0,0 +1,82 @@
+"""
+Transactional outbox for Celery tasks.
+
+Request handlers call ``enqueue`` inside the same transaction as the rows the
+task is about, so a task is recorded if and only if that transaction commits
+and the request itself never talks to the broker. ``relay`` runs in a worker
+(or the ``relay_outbox`` command), publishes committed messages in batches and
+deletes them once the broker has accepted them. Delivery is at-least-once: a
+crash between publishing and committing the delete re-publishes the batch.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import now
+
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+MAX_BACKOFF_SECONDS = 300
+
+
+def enqueue(task_name, *args, **kwargs):
+    """Record ``task_name(*args, **kwargs)`` for publishing after commit."""
+    return OutboxMessage.objects.create(task_name=task_name, args=list(args), kwargs=kwargs)
+
+
+def enqueue_many(task_name, args_list):
+    """Record one ``task_name(*args)`` call per entry of ``args_list`` in a single INSERT."""
+    return OutboxMessage.objects.bulk_create(
+        [OutboxMessage(task_name=task_name, args=list(args), kwargs={}) for args in args_list]
+    )
+
+
+def _publish(message):
+    from library_system.celery import app
+    app.send_task(message.task_name, args=message.args, kwargs=message.kwargs)
+
+
+def relay(batch_size=None):
+    """
+    Publish due outbox messages, one locked batch per transaction, until none
+    are left. Failed publishes are retried with exponential backoff.
+    Returns the number of messages published.
+    """
+    batch_size = batch_size or getattr(settings, 'OUTBOX_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    published = 0
+    while True:
+        with transaction.atomic():
+            # SKIP LOCKED lets several relays drain the table concurrently.
+            batch = list(
+                OutboxMessage.objects.select_for_update(skip_locked=True)
+                .filter(available_at__lte=now())
+                .order_by('id')[:batch_size]
+            )
+            if not batch:
+                return published
+
+            sent = []
+            for message in batch:
+                try:
+                    _publish(message)
+                except Exception as e:
+                    message.attempts += 1
+                    message.available_at = now() + timedelta(
+                        seconds=min(2 ** message.attempts, MAX_BACKOFF_SECONDS)
+                    )
+                    message.last_error = str(e)
+                    message.save(update_fields=['attempts', 'available_at', 'last_error'])
+                    logger.warning("Outbox publish of %s failed (attempt %d): %s",
+                                   message.task_name, message.attempts, str(e))
+                else:
+                    sent.append(message.id)
+            OutboxMessage.objects.filter(id__in=sent).delete()
+
+        published += len(sent)
+        if len(sent) < len(batch):
+            # The broker is failing; leave the rest for the next run.
+            return published
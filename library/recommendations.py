@@ -0,0 +1,142 @@
+"""
+"Patrons who borrowed this also borrowed" recommendations.
+
+The item-item co-occurrence matrix is built inside the database: a self-join of
+distinct (user, book) pairs grouped by book pair is the set-based equivalent of
+``X.T @ X`` over the sparse user x book loan matrix. The build walks the source
+books in fixed-size id ranges, so only one shard of the matrix is ever held in
+Python, and keeps the top-K neighbours of each book (cosine similarity) in
+``BookRecommendation`` for single-row reads.
+"""
+import heapq
+import math
+from itertools import groupby
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.utils.timezone import now
+
+from .models import Book, BorrowedBook, BorrowedBookArchive, BookRecommendation
+
+DEFAULT_TOP_K = 10
+DEFAULT_SHARD_SIZE = 5000
+FETCH_SIZE = 10000
+
+
+def _loan_pairs_sql():
+    """Distinct (user_id, book_id) pairs across the whole loan history, live and archived."""
+    # UNION (not UNION ALL) removes duplicate pairs, like DISTINCT.
+    return (
+        f"SELECT user_id, book_id FROM {BorrowedBook._meta.db_table} "
+        f"UNION SELECT user_id, book_id FROM {BorrowedBookArchive._meta.db_table}"
+    )
+
+
+def _borrower_counts():
+    """Number of distinct borrowers per book (the diagonal of the matrix)."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT p.book_id, COUNT(*) FROM ({_loan_pairs_sql()}) p GROUP BY p.book_id"
+        )
+        return dict(cursor.fetchall())
+
+
+def _iter_cooccurrences(low, high):
+    """
+    Yield (book_id, other_book_id, co_borrowers) for source books in [low, high),
+    ordered by source book so callers can group rows without buffering the shard.
+    """
+    pairs = _loan_pairs_sql()
+    sql = (
+        f"SELECT a.book_id, b.book_id, COUNT(*) "
+        f"FROM ({pairs}) a JOIN ({pairs}) b "
+        f"ON a.user_id = b.user_id AND a.book_id <> b.book_id "
+        f"WHERE a.book_id >= %s AND a.book_id < %s "
+        f"GROUP BY a.book_id, b.book_id "
+        f"ORDER BY a.book_id"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [low, high])
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            yield from rows
+
+
+def _top_neighbors(rows, borrowers, top_k):
+    """Score one source book's co-occurrence rows and keep the best ``top_k``."""
+    scored = []
+    for book_id, other_id, co_count in rows:
+        norm = math.sqrt(borrowers.get(book_id, 1) * borrowers.get(other_id, 1))
+        scored.append((co_count / norm if norm else 0.0, co_count, other_id))
+    best = heapq.nlargest(top_k, scored)
+    return [[other_id, round(score, 4)] for score, _, other_id in best]
+
+
+def rebuild_recommendations(top_k=None, shard_size=None):
+    """
+    Recompute the top-K co-borrow neighbours of every book.
+    Returns the number of books that received recommendations.
+    """
+    top_k = top_k or getattr(settings, 'RECOMMENDATION_TOP_K', DEFAULT_TOP_K)
+    shard_size = shard_size or getattr(settings, 'RECOMMENDATION_SHARD_SIZE', DEFAULT_SHARD_SIZE)
+
+    started_at = now()
+    bounds = Book.objects.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return 0
+
+    borrowers = _borrower_counts()
+    built = 0
+    for low in range(bounds['low'], bounds['high'] + 1, shard_size):
+        rows = _iter_cooccurrences(low, low + shard_size)
+        batch = [
+            BookRecommendation(book_id=book_id, neighbors=_top_neighbors(group, borrowers, top_k))
+            for book_id, group in groupby(rows, key=lambda row: row[0])
+        ]
+        if batch:
+            with transaction.atomic():
+                BookRecommendation.objects.bulk_create(
+                    batch,
+                    update_conflicts=True,
+                    unique_fields=['book'],
+                    update_fields=['neighbors', 'computed_at'],
+                )
+            built += len(batch)
+
+    # Books whose co-borrowers have all disappeared keep no stale neighbours.
+    BookRecommendation.objects.filter(computed_at__lt=started_at).delete()
+    return built
+
+
+def get_recommendations(book_id):
+    """
+    Return the stored neighbours of a book as a list of dicts, or None when
+    no recommendations have been computed for it.
+    """
+    neighbors = (
+        BookRecommendation.objects.filter(book_id=book_id)
+        .values_list('neighbors', flat=True)
+        .first()
+    )
+    if neighbors is None:
+        return None
+
+    books = Book.objects.only('id', 'title', 'author', 'cover_image').in_bulk(
+        [other_id for other_id, _ in neighbors]
+    )
+    results = []
+    for other_id, score in neighbors:
+        book = books.get(other_id)
+        if book is None:
+            continue
+        results.append({
+            "id": book.id,
+            "title": book.title,
+            "author": book.author,
+            "cover_image": book.cover_image.url if book.cover_image else None,
+            "score": score,
+        })
+    return results
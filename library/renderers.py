@@ -0,0 +1,47 @@
+"""
+JSON renderer backed by orjson when it is installed.
+
+For compact responses the output is DRF's ``JSONRenderer`` output except for
+floats: types orjson would format differently (datetimes, decimals, lazy
+strings, ...) are handed to DRF's encoder, and U+2028/U+2029 are escaped the
+same way, but floats are written in orjson's shortest form (``1e16`` rather
+than ``1e+16``), which parses to the same value. Data orjson cannot encode at
+all (integers beyond 64 bits) falls back to DRF's renderer, as do indented
+(browsable/``indent=``) responses.
+"""
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or data is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=(
+                    orjson.OPT_NON_STR_KEYS
+                    | orjson.OPT_PASSTHROUGH_DATETIME
+                    | orjson.OPT_PASSTHROUGH_DATACLASS
+                ),
+            )
+        except (orjson.JSONEncodeError, TypeError):
+            # e.g. "Integer exceeds 64-bit range"; DRF's encoder handles these.
+            return super().render(data, accepted_media_type, renderer_context)
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
@@ -0,0 +1,105 @@
+"""
+Set-based reservation expiry and cancellation.
+
+Pending reservations expire after a hold window that depends on the book's
+category (``RESERVATION_EXPIRY_DAYS``). Expiry and bulk cancellation run as a
+single ``UPDATE ... RETURNING`` statement where the backend supports it, so the
+affected rows come back in the same round-trip and can be handed to the
+notification and queue-promotion fan-out, and to the account summaries.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.utils.timezone import now
+
+from . import account_summary
+from .models import BranchAvailability, Reservation
+
+DEFAULT_EXPIRY_DAYS = 3
+
+
+def expiry_policy():
+    """Return ({category: days}, default_days) from settings."""
+    policy = dict(getattr(settings, 'RESERVATION_EXPIRY_DAYS', {}))
+    default_days = policy.pop('default', DEFAULT_EXPIRY_DAYS)
+    return policy, default_days
+
+
+def expired_reservations(at=None):
+    """Pending reservations whose category hold window has elapsed at ``at``."""
+    at = at or now()
+    policy, default_days = expiry_policy()
+
+    condition = Q(reserved_at__lt=at - timedelta(days=default_days))
+    if policy:
+        # Negating ``__in`` on a nullable column keeps uncategorised books.
+        condition &= ~Q(book__category__in=list(policy))
+        for category, days in policy.items():
+            condition |= Q(book__category=category, reserved_at__lt=at - timedelta(days=days))
+    return Reservation.objects.filter(condition, status='pending')
+
+
+def _supports_update_returning():
+    # SQLite gained RETURNING in 3.35, the same release that enables it for inserts.
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and connection.features.can_return_columns_from_insert
+
+
+def cancel_reservations(queryset, new_status='cancelled'):
+    """
+    Move every reservation in ``queryset`` to ``new_status`` in one statement.
+    Returns a list of (reservation_id, book_id, user_id) for the rows changed.
+    """
+    table = connection.ops.quote_name(Reservation._meta.db_table)
+    with transaction.atomic():
+        if _supports_update_returning():
+            subquery, params = queryset.values('id').query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {table} SET status = %s WHERE id IN ({subquery}) "
+                    f"RETURNING id, book_id, user_id",
+                    [new_status, *params],
+                )
+                rows = [tuple(row) for row in cursor.fetchall()]
+        else:
+            # Fallback: read the affected rows and update them in the same transaction.
+            rows = list(queryset.select_for_update().values_list('id', 'book_id', 'user_id'))
+            if rows:
+                queryset.update(status=new_status)
+        if rows:
+            # The UPDATE skips post_save, which keeps the summaries current elsewhere.
+            account_summary.record_reservations(
+                [(reservation_id, user_id, new_status) for reservation_id, _, user_id in rows]
+            )
+    return rows
+
+
+def expire_reservations(at=None):
+    """Cancel all reservations past their hold window; see ``cancel_reservations``."""
+    return cancel_reservations(expired_reservations(at))
+
+
+def books_ready_for_queue(book_ids):
+    """
+    For the given books, return {(book_id, branch_id): reservation} with the
+    oldest pending reservation for pickup at every branch that currently has a
+    free copy of the book.
+    """
+    oldest_pending = (
+        Reservation.objects.filter(
+            book_id=OuterRef('book_id'), branch_id=OuterRef('branch_id'), status='pending'
+        )
+        .order_by('reserved_at', 'id')
+        .values('id')[:1]
+    )
+    head_ids = (
+        BranchAvailability.objects.filter(book_id__in=book_ids, available__gt=0)
+        .annotate(head_id=Subquery(oldest_pending))
+        .exclude(head_id__isnull=True)
+        .values_list('head_id', flat=True)
+    )
+    heads = Reservation.objects.filter(id__in=list(head_ids)).select_related('book', 'user')
+    return {(reservation.book_id, reservation.branch_id): reservation for reservation in heads}
@@ -1,7 +1,7 @@
 from rest_framework import serializers
 from django.utils.timezone import now
 from django.contrib.auth import get_user_model
-from .models import Book, BorrowedBook, Reservation
+from .models import Book, BorrowedBook, Copy, Reservation
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
 User = get_user_model()
@@ -9,7 +9,7 @@ User = get_user_model()
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
-        fields = ['id', 'username', 'email', 'role']
+        fields = ['id', 'username', 'email', 'role', 'branch']
 
 class BookSerializer(serializers.ModelSerializer):
     available_copies = serializers.SerializerMethodField()
@@ -24,7 +24,17 @@ class BookSerializer(serializers.ModelSerializer):
 
     def get_available_copies(self, obj):
         # Return the annotated value if it exists, otherwise fall back to the model's property.
-        return getattr(obj, 'annotated_available_copies', obj.available_copies)
+        # (getattr's default would run the COUNT even when the annotation is there.)
+        if hasattr(obj, 'annotated_available_copies'):
+            return obj.annotated_available_copies
+        return obj.available_copies
+
+class CopySerializer(serializers.ModelSerializer):
+    book_title = serializers.ReadOnlyField(source="book.title")
+
+    class Meta:
+        model = Copy
+        fields = ['id', 'barcode', 'status', 'branch', 'location', 'book', 'book_title']
 
 class BorrowedBookSerializer(serializers.ModelSerializer):
     book_title = serializers.ReadOnlyField(source="book.title")
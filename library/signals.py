@@ -0,0 +1,116 @@
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from . import account_summary, catalog_changes, events
+from .catalog_cache import bump_catalog_version
+from .models import (
+    Book, BorrowedBook, BorrowRequest, Branch, BranchAvailability, Copy, Reservation, User, forget_default_branch,
+)
+
+
+@receiver([post_save, post_delete], sender=Book)
+@receiver([post_save, post_delete], sender=BorrowedBook)
+@receiver([post_save, post_delete], sender=Copy)
+def invalidate_catalog(sender, **kwargs):
+    # Book fields, loans and copy statuses all feed the public catalog's availability.
+    bump_catalog_version()
+
+
+# The cached main branch id (models.default_branch). flush, as used by
+# TransactionTestCase and data resets, sends post_migrate.
+
+@receiver([post_save, post_delete], sender=Branch)
+@receiver(post_migrate)
+def reset_default_branch(sender, **kwargs):
+    forget_default_branch()
+
+
+# Catalog change feed (library.catalog_changes); deletes leave a tombstone.
+
+@receiver(post_save, sender=Book)
+def log_book_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        catalog_changes.record_changes([instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def log_book_deletion(sender, instance, **kwargs):
+    catalog_changes.record_changes([instance.pk], deleted=True)
+
+
+# Per-branch availability (BranchAvailability). Circulation changes copy
+# statuses with update() and adjusts the counters itself; copies saved or
+# deleted one by one (admin, the copy endpoints) recount their branch, and the
+# branch they were moved from. Copies deleted with their book take the book's
+# counters with them.
+
+@receiver([post_save, post_delete], sender=Copy)
+def recount_branch_availability(sender, instance, raw=False, origin=None, **kwargs):
+    if raw or isinstance(origin, Book) or getattr(origin, 'model', None) is Book:
+        return
+    pairs = {(instance.branch_id, instance.book_id)}
+    loaded_branch_id = getattr(instance, '_loaded_branch_id', None)
+    if loaded_branch_id is not None:
+        pairs.add((loaded_branch_id, instance.book_id))
+    BranchAvailability.recount(pairs)
+    instance._loaded_branch_id = instance.branch_id
+
+
+# Account summaries (library.account_summary). Set-based paths that skip these
+# signals update the summaries themselves. Rows deleted along with their user
+# are skipped: the user's summary is deleted with them.
+
+def _deleted_with_user(origin):
+    # ``origin`` is the instance or queryset whose delete() cascaded here.
+    return isinstance(origin, User) or getattr(origin, 'model', None) is User
+
+
+@receiver(post_save, sender=BorrowedBook)
+def summarize_loan(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        account_summary.record_loans([instance], created=created)
+
+
+@receiver(post_delete, sender=BorrowedBook)
+def summarize_loan_deletion(sender, instance, origin=None, **kwargs):
+    if not _deleted_with_user(origin):
+        account_summary.record_loan_deletions([instance])
+
+
+@receiver(post_save, sender=Reservation)
+def summarize_reservation(sender, instance, raw=False, **kwargs):
+    if not raw:
+        account_summary.record_reservations([(instance.pk, instance.user_id, instance.status)])
+
+
+@receiver(post_save, sender=BorrowRequest)
+def summarize_borrow_request(sender, instance, raw=False, **kwargs):
+    if not raw:
+        account_summary.record_requests([(instance.pk, instance.user_id, instance.status)])
+
+
+@receiver(post_delete, sender=Reservation)
+@receiver(post_delete, sender=BorrowRequest)
+def summarize_pending_deletion(sender, instance, origin=None, **kwargs):
+    if _deleted_with_user(origin):
+        return
+    record = account_summary.record_reservations if sender is Reservation else account_summary.record_requests
+    record([(instance.pk, instance.user_id, None)], create=False)
+
+
+# Availability events for the SSE stream (library.events).
+
+@receiver(post_save, sender=BorrowedBook)
+def publish_loan(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    if raw:
+        return
+    if created or (update_fields and 'returned_at' in update_fields):
+        events.publish_loans([instance])
+    else:
+        events.publish_availability([instance.book_id])
+
+
+@receiver([post_save, post_delete], sender=Copy)
+def publish_copy_status(sender, instance, raw=False, **kwargs):
+    if not raw:
+        events.publish_availability([instance.book_id])
@@ -0,0 +1,67 @@
+"""
+Content-addressed storage for book cover images.
+
+Uploads are hashed (SHA-256) while they are streamed to a temporary file and
+then stored as ``<first two hex digits>/<digest>.<ext>``, so the same image
+uploaded for several books, or uploaded twice, is kept on disk once. A name
+never changes meaning, which is what lets ``serve_cover`` mark responses as
+immutable. Files are never deleted with their book because other books may
+share them; the ``gc_covers`` command removes unreferenced files instead.
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+COVERS_DIR = 'covers'
+# ``<2 hex>/<64 hex>.<ext>``; anything else is not a content-addressed name.
+NAME_PATTERN = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{64}\.[a-z0-9]{1,5}$')
+EXTENSION_ALIASES = {'jpg': 'jpeg'}
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is derived from the content in _save(); an existing
+        # file with that name is the same image, never a collision.
+        return name
+
+    def _save(self, name, content):
+        extension = os.path.splitext(name)[1].lstrip('.').lower()
+        extension = EXTENSION_ALIASES.get(extension, extension) or 'bin'
+        os.makedirs(self.location, exist_ok=True)
+
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        with tempfile.NamedTemporaryFile(dir=self.location, prefix='.upload-', delete=False) as tmp:
+            try:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    tmp.write(chunk)
+            except BaseException:
+                os.unlink(tmp.name)
+                raise
+
+        hexdigest = digest.hexdigest()
+        name = f'{hexdigest[:2]}/{hexdigest}.{extension}'
+        path = self.path(name)
+        if os.path.exists(path):
+            os.unlink(tmp.name)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp.name, self.file_permissions_mode)
+            # Atomic, so concurrent uploads of the same image cannot leave a partial file.
+            os.replace(tmp.name, path)
+        return name
+
+
+def cover_storage():
+    return ContentAddressedStorage(
+        location=os.path.join(settings.MEDIA_ROOT, COVERS_DIR),
+        base_url=f'{settings.MEDIA_URL}{COVERS_DIR}/',
+    )
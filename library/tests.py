@@ -1,3 +1,1096 @@
-from django.test import TestCase
+import contextvars
+import hashlib
+import json
+import marshal
+import math
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from celery.app.task import Context
+from django import template
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.test import TestCase, override_settings
+from django.utils.timezone import now, timedelta
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from library_system import metrics
+from library_system.profiling import Capture, ProfilingMiddleware
+from library_system.task_metrics import _queue_wait, summarize
+from library_system.tasks import promote_reservation_queues, send_due_date_reminders, send_overdue_notifications
+
+from . import catalog_changes, loadtest, models, notifications, outbox
+from .account_summary import get_summary
+from .archive import archive_closed_records, loan_history_rows, reservation_history_rows
+from .borrow_requests import approve_requests
+from .branches import available_copies, branch_with_copy
+from .catalog_cache import VERSION_KEY, catalog_version, get_snapshot
+from .facets import _compute_facets, facet_counts, filters_key, parse_filters
+from .models import (
+    Book, BookRecommendation, BorrowedBook, BorrowedBookArchive, BorrowRequest, Branch, BranchAvailability,
+    CatalogChange, Copy, DEFAULT_BRANCH_CODE, OutboxMessage, ProfileRecord, Reservation, ReservationArchive,
+    TaskRun, User, UserAccountSummary, default_branch, forget_default_branch,
+)
+from .recommendations import get_recommendations, rebuild_recommendations
+from .renderers import FastJSONRenderer
+from .reservations import books_ready_for_queue, expire_reservations, expired_reservations
+from .storage import ContentAddressedStorage
+from .views import CatalogView
+
+
+class CopyClaimTests(TestCase):
+    def setUp(self):
+        self.member = User.objects.create(username='member', email='member@example.com')
+        self.book = Book.objects.create(title='Dune', author='Herbert', isbn='dune', category='Fiction', quantity=1)
+        self.copy = self.book.copies.get()
+
+    def test_loan_claims_a_free_copy(self):
+        loan = BorrowedBook.objects.create(user=self.member, book=self.book)
+
+        self.copy.refresh_from_db()
+        self.assertEqual(loan.copy_id, self.copy.pk)
+        self.assertEqual(loan.branch_id, self.copy.branch_id)
+        self.assertEqual(self.copy.status, 'borrowed')
+        self.assertEqual(BranchAvailability.objects.get(book=self.book).available, 0)
+
+    def test_loan_without_a_free_copy_is_refused(self):
+        BorrowedBook.objects.create(user=self.member, book=self.book)
+
+        # A failed claim aborts the caller's transaction, as in the views.
+        with self.assertRaises(ValueError), transaction.atomic():
+            BorrowedBook.objects.create(user=self.member, book=self.book)
+        self.assertEqual(BorrowedBook.objects.count(), 1)
+
+    def test_copy_taken_after_the_check_is_not_claimed_twice(self):
+        loan = BorrowedBook(user=self.member, book=self.book)
+        loan.can_borrow()
+        # A concurrent borrower wins the copy between the check and the claim.
+        Copy.objects.filter(pk=self.copy.pk).update(status='borrowed')
+
+        with self.assertRaises(ValueError), transaction.atomic():
+            loan.save()
+        self.assertFalse(BorrowedBook.objects.exists())
+
+    def test_return_frees_the_copy(self):
+        loan = BorrowedBook.objects.create(user=self.member, book=self.book)
+        loan.return_book()
+
+        self.copy.refresh_from_db()
+        self.assertEqual(self.copy.status, 'available')
+        self.assertEqual(BranchAvailability.objects.get(book=self.book).available, 1)
+        BorrowedBook.objects.create(user=self.member, book=self.book)
+
+    def test_book_list_leaves_out_books_with_every_copy_on_loan(self):
+        on_shelf = Book.objects.create(title='Emma', author='Austen', isbn='emma', category='Fiction', quantity=1)
+        BorrowedBook.objects.create(user=self.member, book=self.book)
+        client = APIClient()
+        client.force_authenticate(self.member)
+
+        titles = [book['title'] for book in client.get('/api/books/').json()['available_books']]
+        self.assertEqual(titles, [on_shelf.title])
+
+    def test_fulfilling_a_reservation_when_the_copy_is_gone(self):
+        librarian = User.objects.create(username='librarian', role='librarian')
+        reservation = Reservation.objects.create(user=self.member, book=self.book)
+        Copy.objects.filter(pk=self.copy.pk).update(status='borrowed')
+        client = APIClient()
+        client.force_authenticate(librarian)
+
+        # The availability check passes; the copy is gone by the time it is claimed.
+        with mock.patch('library.views.available_copies', return_value=1):
+            response = client.post(f'/api/reservation/fulfill/{reservation.pk}/')
+        self.assertEqual(response.status_code, 400)
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.status, 'pending')
+        self.assertFalse(BorrowedBook.objects.exists())
+
+
+class ApproveRequestsTests(TestCase):
+    def setUp(self):
+        self.book = Book.objects.create(title='Dune', author='Herbert', isbn='dune', category='Fiction', quantity=2)
+        self.members = [User.objects.create(username=f'member{i}', email=f'm{i}@example.com') for i in range(4)]
+
+    def request(self, member, minutes_ago):
+        borrow_request = BorrowRequest.objects.create(user=member, book=self.book)
+        BorrowRequest.objects.filter(pk=borrow_request.pk).update(requested_at=now() - timedelta(minutes=minutes_ago))
+        return borrow_request.pk
+
+    def test_copies_go_to_the_earliest_requests_and_the_rest_are_queued(self):
+        # Requested newest first, to show the order comes from requested_at.
+        latest, middle, earliest = (self.request(member, minutes) for member, minutes in zip(self.members, (1, 2, 3)))
+
+        result = approve_requests([latest, middle, earliest, 999])
+
+        self.assertEqual(result, {'approved': [earliest, middle], 'queued': [latest], 'skipped': [999]})
+        self.assertEqual(set(BorrowedBook.objects.values_list('user', flat=True)),
+                         {self.members[1].pk, self.members[2].pk})
+        self.assertFalse(self.book.copies.filter(status='available').exists())
+        self.assertEqual(BranchAvailability.objects.get(book=self.book).available, 0)
+        self.assertEqual(BorrowRequest.objects.get(pk=latest).status, 'queued')
+        self.assertEqual(list(Reservation.objects.values_list('user', 'status')), [(self.members[0].pk, 'pending')])
+
+    def test_a_patron_already_waiting_is_not_reserved_twice(self):
+        Copy.objects.filter(book=self.book).update(status='borrowed')
+        Reservation.objects.create(user=self.members[0], book=self.book)
+        waiting, new = self.request(self.members[0], 2), self.request(self.members[1], 1)
+
+        result = approve_requests([waiting, new])
+
+        self.assertEqual(result['queued'], [waiting, new])
+        self.assertEqual(sorted(Reservation.objects.values_list('user', flat=True)),
+                         [self.members[0].pk, self.members[1].pk])
+        self.assertFalse(BorrowedBook.objects.exists())
+
+    def test_copies_are_allocated_per_branch(self):
+        other = Branch.objects.create(name='East', code='east')
+        Copy.objects.filter(pk=self.book.copies.first().pk).update(branch=other)
+        BranchAvailability.rebuild()
+        at_main = self.request(self.members[0], 2)
+        at_other = BorrowRequest.objects.create(user=self.members[1], book=self.book, branch=other).pk
+        also_at_other = BorrowRequest.objects.create(user=self.members[2], book=self.book, branch=other).pk
+
+        result = approve_requests([at_main, at_other, also_at_other])
+
+        self.assertEqual(result['approved'], [at_main, at_other])
+        self.assertEqual(result['queued'], [also_at_other])
+        self.assertEqual(Reservation.objects.get().branch, other)
+
+    def test_bulk_approve_rejects_booleans_as_ids(self):
+        librarian = User.objects.create(username='librarian', role='librarian')
+        client = APIClient()
+        client.force_authenticate(librarian)
+        self.request(self.members[0], 1)
+
+        response = client.post('/api/borrow-requests/approve/', {'request_ids': [True]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(BorrowedBook.objects.exists())
+
+
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.member = User.objects.create(username='member', email='member@example.com')
+        self.book = Book.objects.create(title='Dune', author='Herbert', isbn='dune', category='Fiction', quantity=2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.member)
+        self.url = f'/api/books/{self.book.pk}/borrow/'
+
+    def borrow(self, key, **data):
+        return self.client.post(self.url, data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_response(self):
+        first = self.borrow('key-1')
+        retry = self.borrow('key-1')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', first)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(BorrowedBook.objects.count(), 1)
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    def test_reusing_a_key_for_a_different_body_is_rejected(self):
+        self.borrow('key-1')
+        response = self.borrow('key-1', due_date='2030-01-01')
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(BorrowedBook.objects.count(), 1)
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    def test_keys_are_scoped_to_the_user(self):
+        self.borrow('key-1')
+        other = User.objects.create(username='other', email='other@example.com')
+        self.client.force_authenticate(other)
+
+        response = self.borrow('key-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(BorrowedBook.objects.count(), 2)
+
+    def test_requests_without_a_key_are_not_deduplicated(self):
+        self.client.post(self.url, format='json')
+        self.client.post(self.url, format='json')
+        self.assertEqual(BorrowedBook.objects.count(), 2)
+
+
+class CatalogChangesTests(TestCase):
+    def create_book(self, title):
+        return Book.objects.create(title=title, author='Author', isbn=f'isbn-{title}',
+                                   category='Fiction', quantity=1)
+
+    def test_pages_changes_in_sequence_order(self):
+        books = [self.create_book(title) for title in ('A', 'B', 'C')]
+
+        changes, next_since, has_more = catalog_changes.changes_since(0, limit=2)
+        self.assertEqual([change['id'] for change in changes], [books[0].pk, books[1].pk])
+        self.assertEqual(next_since, changes[-1]['seq'])
+        self.assertTrue(has_more)
+        self.assertEqual(changes[0]['book']['title'], 'A')
+
+        changes, last_since, has_more = catalog_changes.changes_since(next_since, limit=2)
+        self.assertEqual([change['id'] for change in changes], [books[2].pk])
+        self.assertFalse(has_more)
+
+        self.assertEqual(catalog_changes.changes_since(last_since), ([], last_since, False))
+
+    def test_update_moves_the_book_to_the_end(self):
+        book, other = self.create_book('A'), self.create_book('B')
+        _, since, _ = catalog_changes.changes_since(0)
+
+        book.title = 'A, revised'
+        book.save()
+
+        changes, _, _ = catalog_changes.changes_since(since)
+        self.assertEqual([(change['id'], change['book']['title']) for change in changes],
+                         [(book.pk, 'A, revised')])
+        self.assertEqual(CatalogChange.objects.filter(book_id=book.pk).count(), 1)
+        self.assertEqual(CatalogChange.objects.filter(book_id=other.pk).count(), 1)
+
+    def test_tombstone_replaces_earlier_entry(self):
+        book = self.create_book('A')
+        book_id = book.pk
+        _, since, _ = catalog_changes.changes_since(0)
+
+        book.delete()
+
+        entries = CatalogChange.objects.filter(book_id=book_id)
+        self.assertEqual(entries.count(), 1)
+        self.assertTrue(entries.get().deleted)
+        self.assertGreater(entries.get().seq, since)
+
+        changes, _, _ = catalog_changes.changes_since(0)
+        self.assertEqual(changes, [{'seq': entries.get().seq, 'id': book_id, 'deleted': True, 'book': None}])
+
+    def test_entries_roll_back_with_the_change(self):
+        book = self.create_book('A')
+        entry = CatalogChange.objects.get(book_id=book.pk)
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            book.title = 'A, revised'
+            book.save()
+            self.assertGreater(CatalogChange.objects.get(book_id=book.pk).seq, entry.seq)
+            raise RuntimeError
+        self.assertEqual(CatalogChange.objects.get(book_id=book.pk), entry)
+
+    def test_changes_view_validates_parameters(self):
+        self.create_book('A')
+        response = self.client.get('/api/books/changes/', {'since': 0, 'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['changes']), 1)
+
+        for params in ({'since': -1}, {'since': 'x'}, {'limit': 0}, {'limit': catalog_changes.MAX_LIMIT + 1}):
+            self.assertEqual(self.client.get('/api/books/changes/', params).status_code, 400)
+
+
+class MetricsTests(TestCase):
+    @override_settings(METRICS_TOKEN=None)
+    def test_without_a_token_only_staff_can_read(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.client.force_login(User.objects.create(username='staff', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_is_required_when_configured(self):
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    def test_query_counts_stay_with_their_request(self):
+        # Under ASGI, sync code of concurrent requests interleaves on one thread.
+        metrics.install_query_hook(None, connection)
+        first, second = metrics.QueryCounter(), metrics.QueryCounter()
+        first_request, second_request = contextvars.copy_context(), contextvars.copy_context()
+        first_request.run(metrics._current_queries.set, first)
+        second_request.run(metrics._current_queries.set, second)
+
+        first_request.run(User.objects.count)
+        second_request.run(User.objects.count)
+        first_request.run(User.objects.count)
+
+        self.assertEqual((first.count, second.count), (2, 1))
+
+
+class EventStreamTests(TestCase):
+    @override_settings(REDIS_URL=None, EVENTS_SINGLE_PROCESS=False)
+    async def test_streams_are_refused_without_a_shared_broker(self):
+        response = await self.async_client.get('/api/events/', {'book': 1})
+        self.assertEqual(response.status_code, 503)
+
+    def test_wsgi_workers_do_not_serve_streams(self):
+        self.assertEqual(self.client.get('/api/events/', {'book': 1}).status_code, 501)
+
+
+class AccountSummaryTests(TestCase):
+    def setUp(self):
+        self.member = User.objects.create(username='member', email='member@example.com')
+        self.book = Book.objects.create(title='Dune', author='Herbert', isbn='dune', category='Fiction', quantity=3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.member)
+
+    def test_summary_with_an_explicit_due_date(self):
+        self.client.post(f'/api/books/{self.book.pk}/borrow/', format='json')
+        self.client.post(f'/api/books/{self.book.pk}/borrow/', {'due_date': '2030-01-01'}, format='json')
+
+        response = self.client.get('/api/account/summary/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['open_loans'], 2)
+        self.assertEqual(response.json()['overdue_loans'], 0)
+
+    def test_naive_stored_due_dates_are_read_as_aware(self):
+        loan = BorrowedBook.objects.create(user=self.member, book=self.book)
+        summary = UserAccountSummary.objects.get(user=self.member)
+        summary.open_loans[str(loan.pk)] = '2000-01-01T00:00:00'
+        summary.save()
+
+        result = get_summary(self.member.pk)
+        self.assertEqual(result['overdue_loans'], 1)
+        self.assertGreater(result['fines']['accruing'], 0)
+
+    def test_summary_follows_loans_and_returns(self):
+        loan = BorrowedBook.objects.create(user=self.member, book=self.book,
+                                           due_date=now() - timedelta(days=3))
+        self.assertEqual(get_summary(self.member.pk)['overdue_loans'], 1)
+
+        loan.return_book()
+        result = get_summary(self.member.pk)
+        self.assertEqual(result['open_loans'], 0)
+        self.assertEqual(result['fines']['assessed'], 15.0)
+
+        # The maintained summary matches one rebuilt from the tables.
+        UserAccountSummary.objects.all().delete()
+        self.assertEqual(get_summary(self.member.pk)['fines']['assessed'], 15.0)
+
+    def test_summary_is_one_keyed_read(self):
+        BorrowedBook.objects.create(user=self.member, book=self.book)
+        with self.assertNumQueries(1):
+            get_summary(self.member.pk)
+
+
+class FastJSONRendererTests(TestCase):
+    def render_both(self, data):
+        return FastJSONRenderer().render(data), JSONRenderer().render(data)
+
+    def test_matches_drf_for_typical_payloads(self):
+        data = {'id': 1, 'title': 'Dune  ', 'fine': Decimal('2.50'), 'due': now(), 'tags': [None, True],
+                1: 'non-string key'}
+        fast, drf = self.render_both(data)
+        self.assertEqual(fast, drf)
+
+    def test_integers_beyond_64_bits_fall_back_to_drf(self):
+        fast, drf = self.render_both({'big': 2 ** 64, 'negative': -2 ** 70})
+        self.assertEqual(fast, drf)
+
+    def test_floats_parse_to_the_same_values(self):
+        data = {'values': [1e16, 1e-07, 0.1, 123.456, -0.0]}
+        fast, drf = self.render_both(data)
+        self.assertEqual(json.loads(fast), json.loads(drf))
+
+
+class DefaultBranchTests(TestCase):
+    def setUp(self):
+        forget_default_branch()
+        self.addCleanup(forget_default_branch)
+        self.member = User.objects.create(username='member')
+        self.book = Book.objects.create(title='Dune', author='Herbert', isbn='dune', category='Fiction', quantity=1)
+
+    def test_id_is_cached_once_committed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            branch_id = default_branch()
+
+        with self.assertNumQueries(0):
+            reservations = [Reservation(user=self.member, book=self.book) for _ in range(3)]
+        self.assertEqual({reservation.branch_id for reservation in reservations}, {branch_id})
+
+    def test_id_is_not_cached_before_commit(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            default_branch()
+        self.assertEqual(models._default_branch_ids, {})
+
+    def test_deleting_the_branch_forgets_the_id(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            old_id = default_branch()
+        Copy.objects.all().delete()
+        BranchAvailability.objects.all().delete()
+        Branch.objects.filter(pk=old_id).delete()
+
+        new_id = default_branch()
+        self.assertNotEqual(new_id, old_id)
+        self.assertTrue(Branch.objects.filter(pk=new_id, code=DEFAULT_BRANCH_CODE).exists())
+
+
+class CatalogSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for i in range(3):
+            Book.objects.create(title=f'Book {i}', author='Herbert', isbn=f'isbn-{i}', category='Fiction', quantity=1)
+
+    def snapshot_key(self, params, page=1):
+        filters = parse_filters(params)
+        return f'catalog:{catalog_version()}:catalog-page:{filters_key(filters)}:{page}'
+
+    def test_offered_filters_are_served_from_the_snapshot(self):
+        params = {'category': 'Fiction', 'author': 'Herbert'}
+        first = self.client.get('/api/catalog/', params)
+        self.assertIsNotNone(cache.get(self.snapshot_key(params)))
+
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/catalog/', params)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second.json()['count'], 3)
+
+    def test_unknown_values_and_deep_pages_are_not_cached(self):
+        for params in ({'category': 'no-such-category'}, {'author': 'x' * 40}, {'branch': 'nowhere'}):
+            self.assertEqual(self.client.get('/api/catalog/', params).status_code, 200)
+            self.assertIsNone(cache.get(self.snapshot_key(params)))
+            self.assertIsNone(cache.get(f'catalog:{catalog_version()}:facets:{filters_key(parse_filters(params))}'))
+
+        deep_page = CatalogView.snapshot_pages + 1
+        self.assertEqual(self.client.get('/api/catalog/', {'page': deep_page}).status_code, 200)
+        self.assertIsNone(cache.get(self.snapshot_key({}, deep_page)))
+
+    def test_uncached_results_are_still_correct(self):
+        response = self.client.get('/api/catalog/', {'category': 'Poetry'})
+        self.assertEqual(response.json()['count'], 0)
+        self.assertEqual(response.json()['facets']['category'], [{'value': 'Fiction', 'count': 3}])
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        self.books = {title: Book.objects.create(title=title, author='Author', isbn=f'isbn-{title}',
+                                                 category='Fiction', quantity=1)
+                      for title in 'ABCD'}
+        users = [User.objects.create(username=f'member{i}') for i in range(3)]
+        history = {users[0]: 'AB', users[1]: 'ABC', users[2]: 'AC'}
+        # bulk_create skips the copy claim; only (user, book) pairs matter here.
+        BorrowedBook.objects.bulk_create([
+            BorrowedBook(user=user, book=self.books[title], branch_id=default_branch())
+            for user, titles in history.items() for title in titles
+        ])
+
+    def neighbors(self, title):
+        return {other_id: score for other_id, score in
+                BookRecommendation.objects.get(book=self.books[title]).neighbors}
+
+    def test_cosine_neighbours(self):
+        self.assertEqual(rebuild_recommendations(), 3)
+
+        a, b, c = (self.books[title].pk for title in 'ABC')
+        # A has 3 borrowers, B and C 2 each; A and B share 2, B and C share 1.
+        self.assertEqual(self.neighbors('A'), {b: round(2 / math.sqrt(6), 4), c: round(2 / math.sqrt(6), 4)})
+        self.assertEqual(self.neighbors('B'), {a: round(2 / math.sqrt(6), 4), c: 0.5})
+        self.assertFalse(BookRecommendation.objects.filter(book=self.books['D']).exists())
+
+    def test_sharded_build_matches_a_single_pass(self):
+        rebuild_recommendations(shard_size=10000)
+        single_pass = {title: self.neighbors(title) for title in 'ABC'}
+
+        rebuild_recommendations(shard_size=1)
+        self.assertEqual({title: self.neighbors(title) for title in 'ABC'}, single_pass)
+
+    def test_top_k_and_stale_rows(self):
+        rebuild_recommendations(top_k=1)
+        self.assertEqual(len(self.neighbors('A')), 1)
+
+        BorrowedBook.objects.filter(book=self.books['C']).delete()
+        BorrowedBook.objects.filter(book=self.books['B']).delete()
+        self.assertEqual(rebuild_recommendations(), 0)
+        self.assertFalse(BookRecommendation.objects.exists())
+
+    def test_read_is_two_queries(self):
+        rebuild_recommendations()
+        with self.assertNumQueries(2):
+            results = get_recommendations(self.books['A'].pk)
+        self.assertEqual({result['title'] for result in results}, {'B', 'C'})
+        self.assertIsNone(get_recommendations(self.books['D'].pk))
+
+
+@override_settings(RESERVATION_EXPIRY_DAYS={'default': 3, 'Reference': 1})
+class ReservationExpiryTests(TestCase):
+    def setUp(self):
+        self.member = User.objects.create(username='member', email='member@example.com')
+        self.fiction = Book.objects.create(title='Dune', author='Herbert', isbn='dune', category='Fiction', quantity=1)
+        self.reference = Book.objects.create(title='Atlas', author='Various', isbn='atlas', category='Reference',
+                                             quantity=1)
+        self.uncategorised = Book.objects.create(title='Misc', author='Anon', isbn='misc', quantity=1)
+
+    def reserve(self, book, days_ago, user=None):
+        reservation = Reservation.objects.create(user=user or self.member, book=book)
+        Reservation.objects.filter(pk=reservation.pk).update(reserved_at=now() - timedelta(days=days_ago))
+        return reservation.pk
+
+    def test_hold_window_follows_the_category(self):
+        fiction = self.reserve(self.fiction, 2)
+        reference = self.reserve(self.reference, 2)
+        uncategorised = self.reserve(self.uncategorised, 4)
+        self.reserve(self.uncategorised, 2)
+
+        self.assertEqual(set(expired_reservations().values_list('id', flat=True)), {reference, uncategorised})
+        self.assertNotIn(fiction, expired_reservations().values_list('id', flat=True))
+
+    def test_expiry_cancels_in_one_pass_and_updates_summaries(self):
+        expired = self.reserve(self.reference, 2)
+        kept = self.reserve(self.fiction, 1)
+        self.assertEqual(get_summary(self.member.pk)['pending_reservations'], 2)
+
+        rows = expire_reservations()
+
+        self.assertEqual(rows, [(expired, self.reference.pk, self.member.pk)])
+        self.assertEqual(Reservation.objects.get(pk=expired).status, 'cancelled')
+        self.assertEqual(Reservation.objects.get(pk=kept).status, 'pending')
+        self.assertEqual(get_summary(self.member.pk)['pending_reservations'], 1)
+        self.assertEqual(expire_reservations(), [])
+
+    def test_queue_head_is_the_oldest_pending_reservation_at_a_branch_with_a_copy(self):
+        other = User.objects.create(username='other', email='other@example.com')
+        older = self.reserve(self.fiction, 2, user=other)
+        self.reserve(self.fiction, 1)
+        self.reserve(self.reference, 2)
+        Copy.objects.filter(book=self.reference).update(status='borrowed')
+        BranchAvailability.rebuild()
+
+        heads = books_ready_for_queue([self.fiction.pk, self.reference.pk])
+        self.assertEqual({key: reservation.pk for key, reservation in heads.items()},
+                         {(self.fiction.pk, default_branch()): older})
+
+        result = promote_reservation_queues([self.fiction.pk, self.reference.pk])
+        self.assertEqual(result['sent'], 1)
+        self.assertEqual(mail.outbox[0].to, ['other@example.com'])
+
+    def test_bulk_cancel_only_touches_the_members_own_reservations(self):
+        other = User.objects.create(username='other')
+        own = self.reserve(self.fiction, 0)
+        not_own = self.reserve(self.fiction, 0, user=other)
+        client = APIClient()
+        client.force_authenticate(self.member)
+
+        response = client.post('/api/reservations/cancel/', {'reservation_ids': [own, not_own]}, format='json')
+
+        self.assertEqual(response.json()['cancelled_ids'], [own])
+        self.assertEqual(Reservation.objects.get(pk=not_own).status, 'pending')
+        self.assertEqual(list(OutboxMessage.objects.values_list('task_name', 'args')),
+                         [('library_system.tasks.promote_reservation_queues', [[self.fiction.pk]])])
+
+
+class TaskMetricsTests(TestCase):
+    def test_runs_are_recorded_with_their_processed_count(self):
+        member = User.objects.create(username='member', email='member@example.com')
+        book = Book.objects.create(title='Dune', author='Herbert', isbn='dune', category='Fiction', quantity=1)
+        BorrowedBook.objects.create(user=member, book=book, due_date=now())
+
+        send_due_date_reminders.apply()
+
+        run = TaskRun.objects.get()
+        self.assertEqual((run.task_name, run.state, run.processed), (send_due_date_reminders.name, 'SUCCESS', 1))
+        self.assertGreater(run.duration, 0)
+
+    def test_queue_wait_starts_at_the_eta(self):
+        started = time.time()
+        self.assertAlmostEqual(_queue_wait(Context(enqueued_at=started - 5), started), 5)
+        eta = datetime.fromtimestamp(started - 2, tz=dt_timezone.utc).isoformat()
+        self.assertAlmostEqual(_queue_wait(Context(enqueued_at=started - 60, eta=eta), started), 2, places=3)
+        self.assertIsNone(_queue_wait(Context(), started))
+
+    def test_summary(self):
+        runs = [('SUCCESS', 1.0, 10), ('SUCCESS', 3.0, 30), ('FAILURE', 0.5, None)]
+        TaskRun.objects.bulk_create([
+            TaskRun(task_name='digest', task_id=str(i), state=state, started_at=now(), duration=duration,
+                    queue_wait=0.1, processed=processed)
+            for i, (state, duration, processed) in enumerate(runs)
+        ])
+        TaskRun.objects.create(task_name='digest', task_id='old', state='SUCCESS', duration=100,
+                               started_at=now() - timedelta(hours=30))
+
+        [row] = summarize(hours=24)
+        self.assertEqual((row['task'], row['runs'], row['failures'], row['processed']), ('digest', 3, 1, 40))
+        self.assertEqual(row['duration_max'], 3.0)
+        self.assertEqual(row['processed_per_second'], round(40 / 4.5, 2))
+
+    def test_stats_endpoint_is_for_staff(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username='member'))
+        self.assertEqual(client.get('/api/tasks/stats/').status_code, 403)
+        client.force_authenticate(User.objects.create(username='librarian', role='librarian'))
+        self.assertEqual(client.get('/api/tasks/stats/').json(), {'hours': 24, 'tasks': []})
+
+
+class OutboxTests(TestCase):
+    def test_enqueue_many_is_one_insert(self):
+        with self.assertNumQueries(1):
+            outbox.enqueue_many('library_system.tasks.send_borrow_email', [[1], [2], [3]])
+        self.assertEqual(sorted(OutboxMessage.objects.values_list('args', flat=True)), [[1], [2], [3]])
+
+    def test_enqueue_rolls_back_with_the_transaction(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            outbox.enqueue('library_system.tasks.send_borrow_email', 1)
+            raise RuntimeError
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    @override_settings(OUTBOX_BATCH_SIZE=2)
+    def test_relay_publishes_in_batches_and_deletes(self):
+        outbox.enqueue_many('library_system.tasks.send_borrow_email', [[1], [2], [3]])
+        later = outbox.enqueue('library_system.tasks.send_borrow_email', 4)
+        OutboxMessage.objects.filter(pk=later.pk).update(available_at=now() + timedelta(minutes=5))
+
+        with mock.patch.object(outbox, '_publish') as publish:
+            self.assertEqual(outbox.relay(), 3)
+
+        self.assertEqual([call.args[0].args for call in publish.call_args_list], [[1], [2], [3]])
+        self.assertEqual(list(OutboxMessage.objects.values_list('pk', flat=True)), [later.pk])
+
+    def test_failed_publish_is_retried_with_backoff(self):
+        first, second = outbox.enqueue_many('library_system.tasks.send_borrow_email', [[1], [2]])
+
+        with mock.patch.object(outbox, '_publish', side_effect=[None, ConnectionError('broker down')]):
+            self.assertEqual(outbox.relay(), 1)
+
+        failed = OutboxMessage.objects.get()
+        self.assertEqual((failed.pk, failed.attempts, failed.last_error), (second.pk, 1, 'broker down'))
+        self.assertGreater(failed.available_at, now() + timedelta(seconds=1))
+
+        with mock.patch.object(outbox, '_publish') as publish:
+            self.assertEqual(outbox.relay(), 0)
+        publish.assert_not_called()
+
+
+class NotificationTests(TestCase):
+    values = {'username': 'Ada & Co', 'book_title': '<Dune>', 'due_date': '2026-01-02'}
+
+    def test_flat_templates_render_like_django(self):
+        (text, text_parts), (html, html_parts) = notifications._templates('borrow_confirmation')
+        self.assertIsNotNone(text_parts)
+        self.assertIsNotNone(html_parts)
+
+        [message] = notifications.render_batch('borrow_confirmation', [('ada@example.com', self.values)])
+
+        self.assertEqual(message.body, text.render(template.Context(self.values, autoescape=False)).strip())
+        self.assertEqual(message.alternatives, [(html.render(template.Context(self.values)), 'text/html')])
+        self.assertIn('&lt;Dune&gt;', message.alternatives[0][0])
+        self.assertIn('"<Dune>"', message.body)
+
+    def test_non_string_values_go_through_the_engine(self):
+        values = dict(self.values, due_date=now().date())
+        [message] = notifications.render_batch('borrow_confirmation', [('ada@example.com', values)])
+        (text, _), _ = notifications._templates('borrow_confirmation')
+        self.assertEqual(message.body, text.render(template.Context(values, autoescape=False)).strip())
+
+    def test_loops_are_not_flattened(self):
+        (_, text_parts), _ = notifications._templates('overdue_digest')
+        self.assertIsNone(text_parts)
+
+    def test_send_batch_uses_one_connection(self):
+        items = [(f'member{i}@example.com', self.values) for i in range(3)]
+        with mock.patch.object(notifications, 'get_connection', wraps=notifications.get_connection) as get_connection:
+            self.assertEqual(notifications.send_batch('borrow_confirmation', items), (3, 0))
+        get_connection.assert_called_once_with()
+        self.assertEqual([message.to for message in mail.outbox], [[email] for email, _ in items])
+        self.assertEqual(notifications.send_batch('borrow_confirmation', []), (0, 0))
+
+
+class LoanDigestTests(TestCase):
+    def setUp(self):
+        self.ada = User.objects.create(username='ada', email='ada@example.com')
+        self.bob = User.objects.create(username='bob', email='bob@example.com')
+        nobody = User.objects.create(username='nobody', email='')
+        overdue = now() - timedelta(days=2)
+        for user, title in [(self.ada, 'Dune'), (self.ada, 'Emma'), (self.bob, 'Ulysses'), (nobody, 'Beloved')]:
+            book = Book.objects.create(title=title, author='A', isbn=title, category='Fiction', quantity=2)
+            BorrowedBook.objects.create(user=user, book=book, due_date=overdue)
+        BorrowedBook.objects.create(user=self.bob, book=book, due_date=overdue, returned_at=now())
+
+    def test_one_digest_per_patron(self):
+        with self.assertNumQueries(1):
+            result = send_overdue_notifications()
+
+        self.assertEqual(result, {'processed': 3, 'sent': 2, 'failed': 0})
+        self.assertEqual([message.to for message in mail.outbox], [['ada@example.com'], ['bob@example.com']])
+        self.assertIn('"Dune"', mail.outbox[0].body)
+        self.assertIn('"Emma"', mail.outbox[0].body)
+        self.assertNotIn('Ulysses', mail.outbox[0].body)
+
+    @override_settings(NOTIFICATION_DIGEST=False)
+    def test_one_reminder_per_loan_without_digests(self):
+        result = send_overdue_notifications()
+
+        self.assertEqual(result, {'processed': 4, 'sent': 3, 'failed': 0})
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         ['ada@example.com', 'ada@example.com', 'bob@example.com'])
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.build = mock.Mock(side_effect=[b'v1', b'v2', b'v3'])
+
+    def test_snapshot_is_built_once_per_version(self):
+        self.assertEqual(get_snapshot('page', self.build), b'v1')
+        self.assertEqual(get_snapshot('page', self.build), b'v1')
+        self.assertEqual(self.build.call_count, 1)
+
+    def test_version_moves_only_after_commit(self):
+        get_snapshot('page', self.build)
+        version = catalog_version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(title='Dune', author='Herbert', isbn='dune', category='Fiction', quantity=1)
+            self.assertEqual(catalog_version(), version)
+        self.assertNotEqual(catalog_version(), version)
+
+        self.assertEqual(get_snapshot('page', self.build), b'v2')
+
+    def test_rolled_back_changes_keep_the_version(self):
+        version = catalog_version()
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(RuntimeError), transaction.atomic():
+            Book.objects.create(title='Dune', author='Herbert', isbn='dune', category='Fiction', quantity=1)
+            raise RuntimeError
+        self.assertEqual(catalog_version(), version)
+
+    def test_stale_snapshot_is_served_while_another_process_rebuilds(self):
+        get_snapshot('page', self.build)
+        cache.set(VERSION_KEY, catalog_version() + 1, None)
+        cache.add(f'catalog:{catalog_version()}:page:lock', 1)
+
+        self.assertEqual(get_snapshot('page', self.build), b'v1')
+        self.assertEqual(self.build.call_count, 1)
+
+    @mock.patch('library.catalog_cache.WAIT_SECONDS', 0.1)
+    def test_waits_for_the_rebuild_when_there_is_nothing_stale(self):
+        cache.add(f'catalog:{catalog_version()}:page:lock', 1)
+
+        def rebuilt_elsewhere(seconds):
+            cache.set(f'catalog:{catalog_version()}:page', b'theirs')
+
+        with mock.patch('library.catalog_cache.time.sleep', side_effect=rebuilt_elsewhere):
+            self.assertEqual(get_snapshot('page', self.build), b'theirs')
+        self.build.assert_not_called()
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for isbn, category, author in [('a', 'Fiction', 'Herbert'), ('b', 'Fiction', 'Herbert'),
+                                       ('c', 'Poetry', 'Herbert'), ('d', 'Fiction', 'Austen')]:
+            Book.objects.create(title=isbn, author=author, isbn=isbn, category=category, quantity=1)
+        Copy.objects.filter(book__isbn='b').update(status='borrowed')
+
+    def test_each_dimension_ignores_its_own_filter(self):
+        filters = parse_filters({'category': 'Fiction', 'author': 'Herbert'})
+        with self.assertNumQueries(4):
+            facets = _compute_facets(filters)
+
+        self.assertEqual(facets['category'], [{'value': 'Fiction', 'count': 2}, {'value': 'Poetry', 'count': 1}])
+        self.assertEqual(facets['author'], [{'value': 'Herbert', 'count': 2}, {'value': 'Austen', 'count': 1}])
+        self.assertEqual(facets['available'], [{'value': True, 'count': 1}, {'value': False, 'count': 1}])
+
+    def test_availability_filter_and_unknown_branch(self):
+        facets = _compute_facets(parse_filters({'available': 'true'}))
+        self.assertEqual(facets['category'], [{'value': 'Fiction', 'count': 2}, {'value': 'Poetry', 'count': 1}])
+        self.assertEqual(facets['available'], [{'value': True, 'count': 3}, {'value': False, 'count': 1}])
+
+        facets = _compute_facets(parse_filters({'branch': 'nowhere'}))
+        self.assertEqual(facets['available'], [{'value': True, 'count': 0}, {'value': False, 'count': 4}])
+
+    def test_counts_are_cached_per_filter_combination(self):
+        filters = parse_filters({'category': 'Fiction'})
+        facets = facet_counts(filters)
+        with self.assertNumQueries(0):
+            self.assertEqual(facet_counts(filters), facets)
+
+
+class LoadTestTests(TestCase):
+    def seed(self, **options):
+        call_command('seed_library', books=20, users=5, loans=60, reservations=10, branches=2, stdout=StringIO(),
+                     **options)
+
+    def test_seeded_data_is_consistent(self):
+        self.seed()
+
+        books = Book.objects.filter(isbn__startswith='SEED')
+        self.assertEqual(books.count(), 20)
+        for book in books.annotate(copy_count=Count('copies')):
+            self.assertEqual(book.copy_count, book.quantity)
+        open_loans = BorrowedBook.objects.filter(returned_at__isnull=True, user__username__startswith='seed-')
+        self.assertEqual(Copy.objects.filter(status='borrowed').count(), open_loans.count())
+        self.assertEqual(open_loans.exclude(copy__status='borrowed').count(), 0)
+        self.assertEqual(
+            BranchAvailability.objects.aggregate(available=Sum('available'))['available'],
+            Copy.objects.filter(status='available').count(),
+        )
+
+        self.seed(clear=True)
+        self.assertFalse(Book.objects.filter(isbn__startswith='SEED').exists())
+        self.assertFalse(User.objects.filter(username__startswith='seed-').exists())
+
+    def test_seeding_is_reproducible(self):
+        self.seed(seed=7)
+        first = list(Book.objects.order_by('isbn').values_list('title', 'author', 'quantity'))
+        self.seed(seed=7)
+        self.assertEqual(list(Book.objects.order_by('isbn').values_list('title', 'author', 'quantity')), first)
+
+    def test_scenarios_succeed_in_process(self):
+        self.seed()
+        workload = loadtest.Workload(random.Random(0))
+        transport = loadtest.InProcessTransport()
+        for name, _, method, role in loadtest.SCENARIOS:
+            path, data = workload.request_for(name)
+            status_code, query_count = transport.send(method, path, data, workload.token(role) if role else None)
+            self.assertLess(status_code, 500, name)
+            self.assertGreater(query_count, 0, name)
+
+    def test_compare_reports_regressions(self):
+        baseline = {'scenarios': {'catalog': {'p95_ms': 10, 'avg_queries': 2, 'errors': 0}}}
+        self.assertEqual(loadtest.compare({'scenarios': {'catalog': {'p95_ms': 12, 'avg_queries': 2.4, 'errors': 0}}},
+                                          baseline), [])
+        self.assertEqual(len(loadtest.compare(
+            {'scenarios': {'catalog': {'p95_ms': 20, 'avg_queries': 4, 'errors': 1}}}, baseline,
+        )), 3)
+        self.assertEqual(loadtest.percentile([5, 1, 3, 2, 4], 50), 3)
+        self.assertIsNone(loadtest.percentile([], 95))
+
+
+class CoverStorageTests(TestCase):
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        self.storage = ContentAddressedStorage(location=location, base_url='/media/covers/')
+        patcher = mock.patch.object(Book._meta.get_field('cover_image'), 'storage', self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def files(self):
+        return sorted(
+            os.path.relpath(os.path.join(directory, name), self.storage.location)
+            for directory, _dirs, names in os.walk(self.storage.location) for name in names
+        )
+
+    def test_identical_uploads_are_stored_once(self):
+        first = self.storage.save('dune.JPG', ContentFile(b'cover'))
+        second = self.storage.save('other.jpeg', ContentFile(b'cover'))
+
+        digest = hashlib.sha256(b'cover').hexdigest()
+        self.assertEqual(first, f'{digest[:2]}/{digest}.jpeg')
+        self.assertEqual(second, first)
+        self.assertEqual(self.files(), [first])
+        self.assertNotEqual(self.storage.save('x.png', ContentFile(b'another')), first)
+
+    def test_gc_removes_only_old_unreferenced_covers(self):
+        kept = self.storage.save('a.png', ContentFile(b'kept'))
+        Book.objects.create(title='Dune', author='Herbert', isbn='dune', quantity=1, cover_image=kept)
+        orphan = self.storage.save('b.png', ContentFile(b'orphan'))
+        fresh = self.storage.save('c.png', ContentFile(b'fresh'))
+        with open(self.storage.path('notes.txt'), 'w') as f:
+            f.write('not a cover')
+        old = time.time() - 7200
+        for name in (kept, orphan, 'notes.txt'):
+            os.utime(self.storage.path(name), (old, old))
+
+        call_command('gc_covers', dry_run=True, stdout=StringIO())
+        self.assertEqual(len(self.files()), 4)
+
+        call_command('gc_covers', stdout=StringIO())
+        self.assertEqual(self.files(), sorted([kept, fresh, 'notes.txt']))
+
+    def test_covers_are_served_immutable(self):
+        name = self.storage.save('a.png', ContentFile(b'cover'))
+        url = f'/media/covers/{name}'
+
+        response = self.client.get(url)
+        self.assertEqual(b''.join(response.streaming_content), b'cover')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+        revalidated = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(self.client.get('/media/covers/../secret.png').status_code, 404)
+        self.assertEqual(self.client.get(f'/media/covers/{name[:-3]}gif').status_code, 404)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.member = User.objects.create(username='member', email='member@example.com')
+        self.book = Book.objects.create(title='Dune', author='Herbert', isbn='dune', category='Fiction', quantity=5)
+        long_ago = now() - timedelta(days=400)
+        self.old_loans = [self.loan(long_ago, returned_at=long_ago + timedelta(days=10)) for _ in range(2)]
+        self.recent_loan = self.loan(now() - timedelta(days=20), returned_at=now() - timedelta(days=5))
+        self.open_loan = self.loan(now() - timedelta(days=1))
+        self.old_reservation = Reservation.objects.create(user=self.member, book=self.book, status='cancelled')
+        Reservation.objects.filter(pk=self.old_reservation.pk).update(reserved_at=long_ago)
+        self.pending = Reservation.objects.create(user=self.member, book=self.book)
+
+    def loan(self, borrowed_at, returned_at=None):
+        loan = BorrowedBook.objects.create(user=self.member, book=self.book, due_date=borrowed_at + timedelta(days=14))
+        BorrowedBook.objects.filter(pk=loan.pk).update(borrowed_at=borrowed_at, returned_at=returned_at)
+        return loan
+
+    def test_closed_old_records_move_to_the_archive(self):
+        moved, remaining = archive_closed_records(batch_size=1)
+
+        self.assertEqual(moved, {'library.BorrowedBook': 2, 'library.Reservation': 1, 'library.BorrowRequest': 0})
+        self.assertFalse(remaining)
+        self.assertEqual(set(BorrowedBook.objects.values_list('id', flat=True)),
+                         {self.recent_loan.pk, self.open_loan.pk})
+        self.assertEqual(set(BorrowedBookArchive.objects.values_list('id', flat=True)),
+                         {loan.pk for loan in self.old_loans})
+        self.assertEqual(list(Reservation.objects.values_list('id', flat=True)), [self.pending.pk])
+        self.assertEqual(list(ReservationArchive.objects.values_list('id', flat=True)), [self.old_reservation.pk])
+
+    def test_runs_stop_after_max_batches(self):
+        moved, remaining = archive_closed_records(batch_size=1, max_batches=1)
+        self.assertEqual(moved['library.BorrowedBook'], 1)
+        self.assertTrue(remaining)
+        self.assertEqual(archive_closed_records(batch_size=1, max_batches=1)[0]['library.BorrowedBook'], 1)
+
+    def test_history_reads_live_and_archived_rows_in_one_query(self):
+        archive_closed_records()
+
+        with self.assertNumQueries(1):
+            loan_ids = [row[0] for row in loan_history_rows(user=self.member)]
+        self.assertEqual(loan_ids, [self.open_loan.pk, self.recent_loan.pk,
+                                    *sorted((loan.pk for loan in self.old_loans), reverse=True)])
+        with self.assertNumQueries(1):
+            reservation_ids = [row[0] for row in reservation_history_rows(user=self.member)]
+        self.assertEqual(reservation_ids, [self.old_reservation.pk, self.pending.pk])
+
+
+class BranchAvailabilityTests(TestCase):
+    def setUp(self):
+        forget_default_branch()
+        self.addCleanup(forget_default_branch)
+        self.main = default_branch()
+        self.east = Branch.objects.create(name='East', code='east')
+        self.member = User.objects.create(username='member', email='member@example.com', branch=self.east)
+        self.book = Book.objects.create(title='Dune', author='Herbert', isbn='dune', category='Fiction', quantity=2)
+
+    def counters(self):
+        rows = BranchAvailability.objects.filter(book=self.book).values_list('branch_id', 'available', 'total')
+        return {branch_id: (available, total) for branch_id, available, total in rows}
+
+    def test_loans_adjust_the_counter_in_place(self):
+        self.assertEqual(self.counters(), {self.main: (2, 2)})
+
+        loan = BorrowedBook.objects.create(user=self.member, book=self.book, due_date=now())
+        self.assertEqual(self.counters(), {self.main: (1, 2)})
+        loan.return_book()
+        self.assertEqual(self.counters(), {self.main: (2, 2)})
+
+    def test_moved_and_withdrawn_copies_recount_both_branches(self):
+        copy = self.book.copies.order_by('id').first()
+        copy.branch = self.east
+        copy.save()
+        self.assertEqual(self.counters(), {self.main: (1, 1), self.east.pk: (1, 1)})
+
+        copy.status = 'withdrawn'
+        copy.save()
+        self.assertEqual(self.counters(), {self.main: (1, 1), self.east.pk: (0, 0)})
+
+    def test_adjust_recounts_missing_rows_and_rebuild_matches(self):
+        BranchAvailability.objects.all().delete()
+        BranchAvailability.adjust({(self.main, self.book.pk): (-1, 0)})
+        self.assertEqual(self.counters(), {self.main: (2, 2)})
+
+        BranchAvailability.objects.update(available=99)
+        self.assertEqual(BranchAvailability.rebuild(), 1)
+        self.assertEqual(self.counters(), {self.main: (2, 2)})
+
+    def test_availability_is_read_from_the_counters(self):
+        Copy.objects.create(book=self.book, branch=self.east, barcode='east-1')
+
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/books/{self.book.pk}/availability/')
+        data = response.json()
+        self.assertEqual(data['available_copies'], 3)
+        self.assertEqual([(row['code'], row['available_copies']) for row in data['branches']],
+                         [('east', 1), (DEFAULT_BRANCH_CODE, 2)])
+        self.assertEqual(available_copies(self.book.pk, self.east.pk), 1)
+        self.assertEqual(branch_with_copy(self.book.pk, self.east.pk), self.east.pk)
+        self.assertEqual(branch_with_copy(self.book.pk), self.main)
+
+    def test_librarian_lists_are_scoped_to_their_branch(self):
+        Copy.objects.create(book=self.book, branch=self.east, barcode='east-1')
+        main_loan = BorrowedBook.objects.create(user=self.member, book=self.book, due_date=now(), branch_id=self.main)
+        east_loan = BorrowedBook.objects.create(user=self.member, book=self.book, due_date=now(), branch=self.east)
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username='librarian', role='librarian', branch=self.east))
+
+        def loan_ids(params):
+            return [row['id'] for row in client.get('/api/books/borrowed/', params).json()['borrowed_books']]
+
+        self.assertEqual(loan_ids({}), [east_loan.pk])
+        self.assertEqual(loan_ids({'branch': DEFAULT_BRANCH_CODE}), [main_loan.pk])
+        self.assertEqual(sorted(loan_ids({'branch': 'all'})), [main_loan.pk, east_loan.pk])
+        self.assertEqual(client.get('/api/books/borrowed/', {'branch': 'nowhere'}).status_code, 404)
+
+
+@override_settings(PROFILING_ENABLED=True)
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username='admin', role='admin')
+        self.member = User.objects.create(username='member')
+
+    def token(self, user):
+        return f'Bearer {RefreshToken.for_user(user).access_token}'
+
+    def test_capture_records_queries_and_statistics(self):
+        with Capture() as capture:
+            list(Book.objects.all())
+        record = capture.save('request', 'GET book_list', 'header', now(), 0.01, 200)
+
+        self.assertEqual(record.query_count, 1)
+        self.assertIn('library_book', record.queries[0]['sql'])
+        self.assertTrue(any('tests.py' in frame for frame in record.queries[0]['stack']))
+        self.assertIn('function calls', record.stats)
+        self.assertIsInstance(marshal.loads(bytes(record.raw_stats)), dict)
+
+    @override_settings(PROFILING_BUFFER_SIZE=2)
+    def test_only_the_newest_profiles_are_kept(self):
+        for i in range(3):
+            with Capture() as capture:
+                pass
+            capture.save('task', f'task-{i}', 'sample', now(), 0.01)
+        names = ProfileRecord.objects.order_by('id').values_list('name', flat=True)
+        self.assertEqual(list(names), ['task-1', 'task-2'])
+
+    def test_admin_header_profiles_the_request(self):
+        response = self.client.get('/api/books/', HTTP_X_PROFILE='1', HTTP_AUTHORIZATION=self.token(self.admin))
+
+        record = ProfileRecord.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual((record.kind, record.name, record.trigger, record.status_code),
+                         ('request', 'GET book_list', 'header', 200))
+        self.assertGreater(record.query_count, 0)
+
+    def test_header_from_members_is_ignored(self):
+        response = self.client.get('/api/books/', HTTP_X_PROFILE='1', HTTP_AUTHORIZATION=self.token(self.member))
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(ProfileRecord.objects.exists())
+
+        with override_settings(PROFILING_SAMPLE_RATE=1):
+            self.assertIn('X-Profile-Id', self.client.get('/api/books/'))
+
+    def test_disabled_middleware_removes_itself(self):
+        with override_settings(PROFILING_ENABLED=False), self.assertRaises(MiddlewareNotUsed):
+            ProfilingMiddleware(lambda request: None)
+
+    def test_profiles_are_for_admins(self):
+        with Capture() as capture:
+            pass
+        record = capture.save('task', 'digest', 'header', now(), 0.01)
+
+        client = APIClient()
+        client.force_authenticate(self.member)
+        self.assertEqual(client.get('/api/profiles/').status_code, 403)
+        client.force_authenticate(self.admin)
+        self.assertEqual([row['id'] for row in client.get('/api/profiles/').json()['profiles']], [record.pk])
+        download = client.get(f'/api/profiles/{record.pk}/download/')
+        self.assertEqual(marshal.loads(download.content), marshal.loads(bytes(record.raw_stats)))
@@ -5,8 +5,16 @@ from .views import (
     ReserveBookView,
     ReturnBookView,
     BorrowedBooksView,
+    LoanHistoryView,
+    AccountSummaryView,
     BookListView,
+    BookChangesView,
     BookDetailView,
+    BookRecommendationsView,
+    CatalogView,
+    CopyLookupView,
+    BranchListView,
+    BookAvailabilityView,
     UserReservationsView,
     BookSearchView,
     DashboardView,
@@ -14,36 +22,58 @@ from .views import (
     MyTokenObtainPairView,
     UserListView,
     BorrowRequestView,
+    BulkApproveBorrowRequestsView,
     BookReservationsView,  # Enhanced Reservation Queue view
     # New Reservation Management Endpoints:
     CancelReservationView,
+    BulkCancelReservationsView,
     FulfillReservationView,
     ExportReservationsCSVView,
+    TaskStatsView,
+    ProfileListView,
+    ProfileDetailView,
+    ProfileDownloadView,
+    availability_events,
 )
 
 urlpatterns = [
     # Book-related endpoints
     path('books/', BookListView.as_view(), name='book_list'),
+    path('books/changes/', BookChangesView.as_view(), name='book_changes'),
     path('books/<int:book_id>/', BookDetailView.as_view(), name='book_detail'),
     path('books/<int:book_id>/borrow/', BorrowBookView.as_view(), name='borrow_book'),
+    path('books/<int:book_id>/availability/', BookAvailabilityView.as_view(), name='book_availability'),
+    path('books/<int:book_id>/recommendations/', BookRecommendationsView.as_view(), name='book_recommendations'),
     path('books/<int:book_id>/reserve/', ReserveBookView.as_view(), name='reserve_book'),
     path('books/<int:borrowed_book_id>/return/', ReturnBookView.as_view(), name='return_book'),
     path('books/borrowed/', BorrowedBooksView.as_view(), name='borrowed_books'),
+    path('books/borrowed/history/', LoanHistoryView.as_view(), name='loan_history'),
     path('search/', BookSearchView.as_view(), name='book_search'),
+    path('catalog/', CatalogView.as_view(), name='catalog'),
+    path('events/', availability_events, name='availability_events'),
+    path('branches/', BranchListView.as_view(), name='branch_list'),
+    path('copies/<str:barcode>/', CopyLookupView.as_view(), name='copy_lookup'),
     path('books/<int:book_id>/reservations/', BookReservationsView.as_view(), name='book-reservations'),
 
     # New Reservation Management Endpoints
     path('reservation/cancel/<int:reservation_id>/', CancelReservationView.as_view(), name='cancel_reservation'),
+    path('reservations/cancel/', BulkCancelReservationsView.as_view(), name='bulk_cancel_reservations'),
     path('reservation/fulfill/<int:reservation_id>/', FulfillReservationView.as_view(), name='fulfill_reservation'),
     path('books/<int:book_id>/reservations/export/', ExportReservationsCSVView.as_view(), name='export_reservations_csv'),
 
     # Reservations & Dashboard
     path('reservations/', UserReservationsView.as_view(), name='user_reservations'),
+    path('account/summary/', AccountSummaryView.as_view(), name='account_summary'),
     path('dashboard/', DashboardView.as_view(), name='dashboard'),
+    path('tasks/stats/', TaskStatsView.as_view(), name='task_stats'),
+    path('profiles/', ProfileListView.as_view(), name='profile_list'),
+    path('profiles/<int:profile_id>/', ProfileDetailView.as_view(), name='profile_detail'),
+    path('profiles/<int:profile_id>/download/', ProfileDownloadView.as_view(), name='profile_download'),
 
     # Borrow Request endpoints
     path('books/<int:book_id>/borrow-request/', BorrowRequestView.as_view(), name='borrow_request'),
     path('borrow-request/<int:request_id>/', BorrowRequestView.as_view(), name='process_borrow_request'),
+    path('borrow-requests/approve/', BulkApproveBorrowRequestsView.as_view(), name='bulk_approve_borrow_requests'),
 
     # User management & Authentication
     path('users/', UserListView.as_view(), name='user_list'),
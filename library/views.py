@@ -1,7 +1,12 @@
+import asyncio
 from datetime import timedelta, datetime
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
 from django.shortcuts import get_object_or_404
-from django.utils.timezone import now, timezone
-from django.db.models import Count, F, ExpressionWrapper, IntegerField, Q
+from django.utils.timezone import make_aware, now, timezone
+from django.db import transaction
+from django.db.models import Q
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
@@ -10,16 +15,43 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.pagination import PageNumberPagination
 from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
 from rest_framework_simplejwt.views import TokenObtainPairView
 import csv
-from django.http import HttpResponse
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseNotAllowed, HttpResponseNotModified,
+    JsonResponse, StreamingHttpResponse,
+)
+from django.views.decorators.http import require_safe
+
+from library_system.profiling import is_profiling_staff
 
-from .models import Book, Reservation, BorrowedBook, BorrowRequest
+from .models import Book, Branch, Copy, Reservation, BorrowedBook, BorrowRequest, ProfileRecord
 from .serializers import (
-    BookSerializer, ReservationSerializer, UserSerializer,
-    MyTokenObtainPairSerializer, BorrowedBookSerializer
+    BookSerializer, UserSerializer,
+    MyTokenObtainPairSerializer, BorrowedBookSerializer, CopySerializer
+)
+from . import catalog_changes, events, outbox
+from .account_summary import get_summary
+from .archive import loan_history_rows, reservation_history_rows
+from .borrow_requests import AllocationConflict, approve_requests
+from .branches import (
+    available_copies, branch_availability, branch_with_copy, requested_branch_id, scope_branch_id,
 )
-from library_system.tasks import send_borrow_email
+from .catalog_cache import get_snapshot
+from .facets import (
+    availability_branch, facet_counts, filter_books, filters_key, is_cacheable, parse_filters,
+)
+from .fast_serializers import (
+    annotate_availability, serialize_books, serialize_borrowed_books, serialize_borrowed_book_rows,
+    reservation_rows, serialize_reservation_rows,
+)
+from .idempotency import idempotent
+from .renderers import FastJSONRenderer
+from .storage import NAME_PATTERN as COVER_NAME_PATTERN
+from .recommendations import get_recommendations
+from .reservations import cancel_reservations
 
 User = get_user_model()
 
@@ -35,6 +67,7 @@ class MyTokenObtainPairView(TokenObtainPairView):
 class BorrowBookView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent
     def post(self, request, book_id):
         book = get_object_or_404(Book, id=book_id)
         user_role = request.user.role.lower()
@@ -49,28 +82,58 @@ class BorrowBookView(APIView):
         else:
             target_user = request.user
 
-        # Check read-only property 'available_copies' to see if any are free
-        if book.available_copies <= 0:
-            return Response({"message": f"No available copies of '{book.title}'."},
-                            status=status.HTTP_400_BAD_REQUEST)
+        # A scanned barcode lends that specific copy (at its branch); otherwise any
+        # free copy at the requested or librarian's branch, or at the borrower's
+        # home branch or another branch that has one.
+        copy = None
+        branch_id = None
+        barcode = request.data.get("barcode")
+        if barcode:
+            copy = get_object_or_404(Copy, barcode=barcode, book=book)
+            if copy.status != 'available':
+                return Response({"message": f"Copy {copy.barcode} is {copy.get_status_display().lower()}."},
+                                status=status.HTTP_400_BAD_REQUEST)
+        else:
+            branch_id = scope_branch_id(request)
+            if branch_id is None:
+                branch_id = branch_with_copy(book.id, target_user.branch_id)
+                if branch_id is None:
+                    return Response({"message": f"No available copies of '{book.title}'."},
+                                    status=status.HTTP_400_BAD_REQUEST)
+            elif available_copies(book.id, branch_id) <= 0:
+                return Response({"message": f"No available copies of '{book.title}' at this branch."},
+                                status=status.HTTP_400_BAD_REQUEST)
 
         due_date_str = request.data.get("due_date")
         try:
-            due_date = datetime.strptime(due_date_str, "%Y-%m-%d") if due_date_str else now() + timedelta(days=14)
+            if due_date_str:
+                due_date = make_aware(datetime.strptime(due_date_str, "%Y-%m-%d"))
+            else:
+                due_date = now() + timedelta(days=14)
         except ValueError:
             return Response({"error": "Invalid date format. Use YYYY-MM-DD."},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        borrowed_book = BorrowedBook.objects.create(
-            user=target_user,
-            book=book,
-            borrowed_at=now(),
-            due_date=due_date
-        )
-
-        send_borrow_email.apply_async(
-            args=[target_user.email, book.title, borrowed_book.due_date.strftime("%Y-%m-%d")]
-        )
+        # The confirmation email is queued in the outbox within the same
+        # transaction, so it is sent if and only if the loan is committed.
+        try:
+            with transaction.atomic():
+                borrowed_book = BorrowedBook.objects.create(
+                    user=target_user,
+                    book=book,
+                    copy=copy,
+                    branch_id=copy.branch_id if copy else branch_id,
+                    borrowed_at=now(),
+                    due_date=due_date
+                )
+                outbox.enqueue(
+                    'library_system.tasks.send_borrow_email',
+                    target_user.email, book.title, borrowed_book.due_date.strftime("%Y-%m-%d")
+                )
+        except ValueError:
+            # Another request claimed the last free copy since the check above.
+            return Response({"message": f"No available copies of '{book.title}'."},
+                            status=status.HTTP_400_BAD_REQUEST)
 
         return Response({
             "message": f"Book '{book.title}' issued to {target_user.username} successfully!",
@@ -83,19 +146,28 @@ class BorrowBookView(APIView):
 class ReserveBookView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent
     def post(self, request, book_id):
         book = get_object_or_404(Book, id=book_id)
-        if book.available_copies > 0:
+        if Reservation.objects.filter(book=book, user=request.user, status='pending').exists():
+            return Response({"message": "You already have a pending reservation for this book."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        # Picked up at the requested branch, else the member's home branch.
+        branch_id = requested_branch_id(request) or request.user.branch_id
+        if available_copies(book.id, branch_id) > 0:
             return Response({
                 "message": f"Book '{book.title}' is available for borrowing. Please borrow it instead."
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        reservation = Reservation.objects.create(
+        reservation = Reservation(
             book=book,
             user=request.user,
             status='pending',
             reserved_at=now()
         )
+        if branch_id:
+            reservation.branch_id = branch_id
+        reservation.save()
 
         return Response({
             "message": f"Book '{book.title}' reserved successfully! Your reservation ID: {reservation.id}"
@@ -132,11 +204,54 @@ class BorrowedBooksView(APIView):
 
     def get(self, request):
         if request.user.role.lower() == "librarian":
-            borrowed_books = BorrowedBook.objects.filter(returned_at__isnull=True)
+            borrowed_books = (BorrowedBook.objects.for_branch(scope_branch_id(request))
+                              .filter(returned_at__isnull=True))
         else:
             borrowed_books = BorrowedBook.objects.filter(user=request.user, returned_at__isnull=True)
-        serializer = BorrowedBookSerializer(borrowed_books, many=True)
-        return Response({"borrowed_books": serializer.data})
+        return Response({"borrowed_books": serialize_borrowed_books(borrowed_books)})
+
+# ------------------------------
+# Loan History (live and archived loans)
+# ------------------------------
+class LoanHistoryView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        filters = {"user": request.user}
+        # Librarians and admins see every patron's history, or one with ?user_id=.
+        if request.user.role.lower() in ["librarian", "admin"]:
+            user_id = request.query_params.get("user_id", "")
+            if user_id and not user_id.isdigit():
+                return Response({"error": "user_id must be an integer."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            filters = {"user_id": int(user_id)} if user_id else {}
+            branch_id = scope_branch_id(request)
+            if branch_id is not None:
+                filters["branch_id"] = branch_id
+
+        paginator = PageNumberPagination()
+        paginator.page_size = 20
+        page = paginator.paginate_queryset(loan_history_rows(**filters), request)
+        return paginator.get_paginated_response({"loans": serialize_borrowed_book_rows(page)})
+
+# ------------------------------
+# Account Summary
+# ------------------------------
+class AccountSummaryView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        user_id = request.user.id
+        # Librarians and admins can look at any patron's account.
+        if request.query_params.get("user_id") and request.user.role.lower() in ["librarian", "admin"]:
+            try:
+                user_id = int(request.query_params["user_id"])
+            except ValueError:
+                return Response({"error": "user_id must be an integer."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            if not User.objects.filter(id=user_id).exists():
+                return Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(get_summary(user_id))
 
 # ------------------------------
 # Book List & Create
@@ -146,10 +261,21 @@ class BookListView(APIView):
     parser_classes = [MultiPartParser, FormParser]
 
     def get(self, request):
-        # Only return books with quantity > 0
-        books = Book.objects.filter(quantity__gt=0)
-        serializer = BookSerializer(books, many=True)
-        return Response({"available_books": serializer.data})
+        if not request.user.is_authenticated:
+            # Anonymous visitors all get the same bytes: serve the cached snapshot.
+            return HttpResponse(get_snapshot('book_list', self.render_book_list),
+                                content_type='application/json')
+        return Response(self.book_list_data())
+
+    @staticmethod
+    def book_list_data():
+        # Only return books with at least one copy free to borrow
+        books = annotate_availability(Book.objects.all()).filter(annotated_available_copies__gt=0)
+        return {"available_books": serialize_books(books)}
+
+    @classmethod
+    def render_book_list(cls):
+        return FastJSONRenderer().render(cls.book_list_data())
 
     def post(self, request):
         if not request.user.is_authenticated or request.user.role.lower() not in ["librarian", "admin"]:
@@ -162,6 +288,25 @@ class BookListView(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+# ------------------------------
+# Catalog Change Feed (delta sync)
+# ------------------------------
+class BookChangesView(APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        try:
+            since = int(request.GET.get('since', 0))
+            limit = int(request.GET.get('limit', catalog_changes.DEFAULT_LIMIT))
+        except ValueError:
+            return Response({"error": "since and limit must be integers."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if since < 0 or not 1 <= limit <= catalog_changes.MAX_LIMIT:
+            return Response({"error": f"since must be >= 0 and limit between 1 and {catalog_changes.MAX_LIMIT}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        changes, next_since, has_more = catalog_changes.changes_since(since, limit)
+        return Response({"changes": changes, "next_since": next_since, "has_more": has_more})
+
 # ------------------------------
 # Book Detail, Update, & Delete
 # ------------------------------
@@ -171,8 +316,11 @@ class BookDetailView(APIView):
 
     def get(self, request, book_id):
         book = get_object_or_404(Book, id=book_id)
+        # The per-branch counters also give the total, instead of counting copies.
+        branches = branch_availability(book.id)
+        book.annotated_available_copies = sum(row["available_copies"] for row in branches)
         serializer = BookSerializer(book)
-        return Response({"book": serializer.data})
+        return Response({"book": serializer.data, "branches": branches})
 
     def put(self, request, book_id):
         if not request.user.is_authenticated or request.user.role.lower() not in ["librarian", "admin"]:
@@ -194,6 +342,187 @@ class BookDetailView(APIView):
         book.delete()
         return Response({"message": "Book deleted successfully."}, status=status.HTTP_204_NO_CONTENT)
 
+# ------------------------------
+# Copy (Barcode) Lookup
+# ------------------------------
+class CopyLookupView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, barcode):
+        if request.user.role.lower() not in ["librarian", "admin"]:
+            return Response({"detail": "Not authorized."},
+                            status=status.HTTP_403_FORBIDDEN)
+        # Unique index on barcode: one index probe plus the book row.
+        copy = get_object_or_404(Copy.objects.select_related('book'), barcode=barcode)
+        loan = None
+        if copy.status == 'borrowed':
+            loan = (BorrowedBook.objects.select_related('user', 'book')
+                    .filter(copy=copy, returned_at__isnull=True).first())
+        return Response({
+            "copy": CopySerializer(copy).data,
+            "loan": BorrowedBookSerializer(loan).data if loan else None,
+        })
+
+# ------------------------------
+# Branches & Cross-Branch Availability
+# ------------------------------
+class BranchListView(APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        branches = Branch.objects.order_by('name', 'id').values('id', 'code', 'name')
+        return Response({"branches": list(branches)})
+
+class BookAvailabilityView(APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request, book_id):
+        # Answered from the per-branch counters, one row per branch holding the book.
+        branches = branch_availability(book_id)
+        if not branches:
+            get_object_or_404(Book, id=book_id)
+        return Response({
+            "book_id": book_id,
+            "available_copies": sum(row["available_copies"] for row in branches),
+            "branches": branches,
+        })
+
+# ------------------------------
+# Cover Images
+# ------------------------------
+@require_safe
+def serve_cover(request, name):
+    # Names are content hashes, so a cover at a given URL can never change.
+    if not COVER_NAME_PATTERN.match(name):
+        raise Http404
+    etag = '"%s"' % name.split('/')[1].split('.')[0]
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    else:
+        try:
+            cover = Book._meta.get_field('cover_image').storage.open(name)
+        except FileNotFoundError:
+            raise Http404
+        response = FileResponse(cover)
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response['ETag'] = etag
+    return response
+
+# ------------------------------
+# Availability Events (Server-Sent Events)
+# ------------------------------
+EVENTS_RETRY_MS = 3000
+
+def _token_user(request):
+    """The user of the request's access token, or None without one."""
+    authentication = JWTAuthentication()
+    # EventSource cannot set headers, so the token may also come as ?token=.
+    raw_token = request.GET.get("token") or authentication.get_raw_token(authentication.get_header(request) or b"")
+    if not raw_token:
+        return None
+    return authentication.get_user(authentication.get_validated_token(raw_token))
+
+async def _event_stream(book_ids, channels):
+    heartbeat = getattr(settings, 'EVENTS_HEARTBEAT_SECONDS', 15)
+    loop = asyncio.get_running_loop()
+    # Streams end after a while and EventSource reconnects, so a connection the
+    # server never noticed closing cannot hold its subscription for ever.
+    deadline = loop.time() + getattr(settings, 'EVENTS_STREAM_MAX_SECONDS', 300)
+    yield f"retry: {EVENTS_RETRY_MS}\n\n"
+    async with events.subscribe(channels) as subscription:
+        # Subscribed first, so no change after this snapshot can be missed.
+        availability = await sync_to_async(events.current_availability)(book_ids) if book_ids else {}
+        for book_id, available in availability.items():
+            yield events.format_event('availability', {'book': book_id, 'available_copies': available})
+        while (remaining := deadline - loop.time()) > 0:
+            frame = await subscription.get(min(heartbeat, remaining))
+            yield frame or ": keep-alive\n\n"
+
+async def availability_events(request):
+    """
+    GET /api/events/?book=<id>&book=<id>[&token=<access token>]
+    Streams ``availability`` events for the given books and, when authenticated
+    (Authorization header or ``token``), ``loan`` events for the user's own loans.
+    """
+    # A stream holds its connection open; under WSGI it would tie up a worker thread.
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({"error": "Event streams are served by the ASGI application (library_system.asgi)."},
+                            status=501)
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+    if not events.streams_supported():
+        return JsonResponse({"error": "Event streams need REDIS_URL unless EVENTS_SINGLE_PROCESS is set."},
+                            status=503)
+
+    try:
+        book_ids = sorted({int(value) for value in request.GET.getlist("book")})
+    except ValueError:
+        return JsonResponse({"error": "book must be a book ID."}, status=400)
+    max_books = getattr(settings, 'EVENTS_MAX_BOOKS', 50)
+    if len(book_ids) > max_books:
+        return JsonResponse({"error": f"At most {max_books} books per stream."}, status=400)
+    channels = [events.book_channel(book_id) for book_id in book_ids]
+
+    try:
+        user = await sync_to_async(_token_user)(request)
+    except (InvalidToken, AuthenticationFailed):
+        return JsonResponse({"detail": "Given token not valid for any token type"}, status=401)
+    if user is not None:
+        channels.append(events.user_channel(user.id))
+    if not channels:
+        return JsonResponse({"error": "Pass at least one book ID or an access token."}, status=400)
+
+    response = StreamingHttpResponse(_event_stream(book_ids, channels), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # proxies must pass events through unbuffered
+    return response
+
+# ------------------------------
+# Book Recommendations ("patrons who borrowed this also borrowed")
+# ------------------------------
+class BookRecommendationsView(APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request, book_id):
+        recommendations = get_recommendations(book_id)
+        if recommendations is None:
+            # Nothing precomputed yet: distinguish an unknown book from a cold one.
+            get_object_or_404(Book, id=book_id)
+            recommendations = []
+        return Response({"book_id": book_id, "recommendations": recommendations})
+
+# ------------------------------
+# Faceted Catalog Browsing
+# ------------------------------
+class CatalogView(APIView):
+    permission_classes = [AllowAny]
+    page_size = 20
+    snapshot_pages = 5
+
+    def get(self, request):
+        filters = parse_filters(request.GET)
+        page = request.GET.get('page', '1')
+        page = int(page) if page.isdigit() and int(page) > 0 else 1
+        # Identical for every visitor, so the rendered page is cached per catalog version --
+        # the first pages of filters the facets offer only, which keeps the key space bounded.
+        if page <= self.snapshot_pages and is_cacheable(filters):
+            data = get_snapshot(f'catalog-page:{filters_key(filters)}:{page}',
+                                lambda: self.render_page(filters, page))
+        else:
+            data = self.render_page(filters, page)
+        return HttpResponse(data, content_type='application/json')
+
+    def render_page(self, filters, page):
+        books = annotate_availability(filter_books(filters), availability_branch(filters)).order_by('title', 'id')
+        start = (page - 1) * self.page_size
+        return FastJSONRenderer().render({
+            "count": books.count(),
+            "page": page,
+            "page_size": self.page_size,
+            "results": serialize_books(books[start:start + self.page_size]),
+            "facets": facet_counts(filters),
+        })
+
 # ------------------------------
 # User Reservations
 # ------------------------------
@@ -201,9 +530,9 @@ class UserReservationsView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        reservations = Reservation.objects.filter(user=request.user)
-        serializer = ReservationSerializer(reservations, many=True)
-        return Response({"reservations": serializer.data})
+        # Includes archived (closed, older) reservations.
+        rows = reservation_history_rows(user=request.user)
+        return Response({"reservations": serialize_reservation_rows(rows)})
 
 # ------------------------------
 # Book Search
@@ -220,8 +549,7 @@ class BookSearchView(APIView):
             author__icontains=author,
             isbn__icontains=isbn
         )
-        serializer = BookSerializer(books, many=True)
-        return Response({"books": serializer.data})
+        return Response({"books": serialize_books(books)})
 
 # ------------------------------
 # Dashboard
@@ -230,35 +558,32 @@ class DashboardView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
+        # Circulation figures are for the requested or librarian's branch, if any.
+        branch_id = scope_branch_id(request)
+        loans = BorrowedBook.objects.for_branch(branch_id)
         total_books = Book.objects.count()
-        borrowed_books = BorrowedBook.objects.filter(returned_at__isnull=True).count()
-        overdue_books = BorrowedBook.objects.filter(
+        borrowed_books = loans.filter(returned_at__isnull=True).count()
+        overdue_books = loans.filter(
             returned_at__isnull=True, due_date__lt=now()
         ).count()
 
         # Annotate available copies
-        books_with_availability = Book.objects.annotate(
-            borrowed_count=Count('borrowedbook', filter=Q(borrowedbook__returned_at__isnull=True))
-        ).annotate(
-            annotated_available_copies=ExpressionWrapper(
-                F('quantity') - F('borrowed_count'),
-                output_field=IntegerField()
-            )
-        )
+        books_with_availability = annotate_availability(Book.objects.all(), branch_id)
 
         # "Most Borrowed Books": order by lowest annotated available copies
         most_borrowed_books = books_with_availability.order_by('annotated_available_copies')[:5]
-        serialized_books = BookSerializer(most_borrowed_books, many=True).data
+        serialized_books = serialize_books(most_borrowed_books)
 
         # Low availability: books with <= 2 copies left
         low_availability_books = books_with_availability.filter(
             quantity__gt=0,
             annotated_available_copies__lte=2
         )
-        low_availability_data = BookSerializer(low_availability_books, many=True).data
+        low_availability_data = serialize_books(low_availability_books)
 
         # Pending Borrow Requests
-        pending_requests = BorrowRequest.objects.filter(status="pending")
+        pending_requests = (BorrowRequest.objects.for_branch(branch_id).filter(status="pending")
+                            .select_related("book", "user").order_by("requested_at", "id"))
         borrow_requests_data = [{
             "id": req.id,
             "book_title": req.book.title,
@@ -281,11 +606,17 @@ class DashboardView(APIView):
 class BorrowRequestView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent
     def post(self, request, book_id):
         if BorrowRequest.objects.filter(book_id=book_id, user=request.user, status='pending').exists():
             return Response({"message": "You already have a pending borrow request for this book."},
                             status=status.HTTP_400_BAD_REQUEST)
-        borrow_request = BorrowRequest.objects.create(book_id=book_id, user=request.user)
+        borrow_request = BorrowRequest(book_id=book_id, user=request.user)
+        # Collected at the requested branch, else the member's home branch.
+        branch_id = requested_branch_id(request) or request.user.branch_id
+        if branch_id:
+            borrow_request.branch_id = branch_id
+        borrow_request.save()
         return Response({"message": f"Borrow request for '{borrow_request.book.title}' submitted successfully."},
                         status=status.HTTP_201_CREATED)
 
@@ -296,14 +627,19 @@ class BorrowRequestView(APIView):
         borrow_request = get_object_or_404(BorrowRequest, id=request_id)
         action = request.data.get("action")
         if action == "approve":
-            borrowed_book = BorrowedBook.objects.create(
-                user=borrow_request.user,
-                book=borrow_request.book,
-                borrowed_at=now(),
-                due_date=now() + timedelta(days=14)
-            )
-            borrow_request.status = "approved"
-            borrow_request.save()
+            try:
+                result = approve_requests([borrow_request.id])
+            except AllocationConflict:
+                return Response({"error": "Copies changed while approving; please retry."},
+                                status=status.HTTP_409_CONFLICT)
+            if result["queued"]:
+                return Response({
+                    "message": f"No copies of '{borrow_request.book.title}' are available. "
+                               f"{borrow_request.user.username} has been added to the reservation queue."
+                })
+            if result["skipped"]:
+                return Response({"error": f"Borrow request is already {borrow_request.status}."},
+                                status=status.HTTP_400_BAD_REQUEST)
             return Response({
                 "message": f"Borrow request approved. Book '{borrow_request.book.title}' issued to {borrow_request.user.username}."
             })
@@ -317,6 +653,99 @@ class BorrowRequestView(APIView):
             return Response({"error": "Invalid action."},
                             status=status.HTTP_400_BAD_REQUEST)
 
+class BulkApproveBorrowRequestsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        if request.user.role.lower() not in ["librarian", "admin"]:
+            return Response({"detail": "Not authorized."},
+                            status=status.HTTP_403_FORBIDDEN)
+        request_ids = request.data.get("request_ids")
+        # bool is an int subclass; JSON true must not stand for ID 1.
+        if (not isinstance(request_ids, list) or not request_ids
+                or not all(isinstance(i, int) and not isinstance(i, bool) for i in request_ids)):
+            return Response({"error": "request_ids must be a non-empty list of IDs."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            result = approve_requests(request_ids)
+        except AllocationConflict:
+            return Response({"error": "Copies changed while approving; please retry."},
+                            status=status.HTTP_409_CONFLICT)
+        return Response({
+            "message": f"Approved {len(result['approved'])} request(s), "
+                       f"queued {len(result['queued'])} as reservations.",
+            "approved_ids": result["approved"],
+            "queued_ids": result["queued"],
+            "skipped_ids": result["skipped"],
+        }, status=status.HTTP_200_OK)
+
+# ------------------------------
+# Celery Task Metrics
+# ------------------------------
+class TaskStatsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        if request.user.role.lower() not in ["librarian", "admin"]:
+            return Response({"detail": "Not authorized."},
+                            status=status.HTTP_403_FORBIDDEN)
+        try:
+            hours = max(1, int(request.GET.get('hours', 24)))
+        except ValueError:
+            return Response({"error": "hours must be an integer."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        # task_metrics connects Celery signals; import it here so web processes
+        # only load Celery when this endpoint is used.
+        from library_system.task_metrics import summarize
+        return Response({"hours": hours, "tasks": summarize(hours)})
+
+# ------------------------------
+# Profiles (library_system.profiling)
+# ------------------------------
+PROFILE_SUMMARY_FIELDS = (
+    'id', 'kind', 'name', 'trigger', 'started_at', 'duration', 'status_code', 'query_count', 'query_time',
+)
+
+class ProfileListView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        if not is_profiling_staff(request.user):
+            return Response({"detail": "Not authorized."},
+                            status=status.HTTP_403_FORBIDDEN)
+        profiles = ProfileRecord.objects.order_by('-id')
+        if request.GET.get('kind'):
+            profiles = profiles.filter(kind=request.GET['kind'])
+        return Response({"profiles": list(profiles.values(*PROFILE_SUMMARY_FIELDS))})
+
+class ProfileDetailView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, profile_id):
+        if not is_profiling_staff(request.user):
+            return Response({"detail": "Not authorized."},
+                            status=status.HTTP_403_FORBIDDEN)
+        profile = get_object_or_404(
+            ProfileRecord.objects.values(*PROFILE_SUMMARY_FIELDS, 'stats', 'queries'), id=profile_id
+        )
+        return Response({"profile": profile})
+
+class ProfileDownloadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, profile_id):
+        if not is_profiling_staff(request.user):
+            return Response({"detail": "Not authorized."},
+                            status=status.HTTP_403_FORBIDDEN)
+        profile = get_object_or_404(ProfileRecord.objects.only('raw_stats'), id=profile_id)
+        if not profile.raw_stats:
+            return Response({"error": "This profile has no cProfile statistics."},
+                            status=status.HTTP_404_NOT_FOUND)
+        # Marshalled pstats data: pstats.Stats(path), snakeviz path.
+        response = HttpResponse(bytes(profile.raw_stats), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="profile-{profile.id}.prof"'
+        return response
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def register_user(request):
@@ -349,36 +778,70 @@ class CancelReservationView(APIView):
 
     def post(self, request, reservation_id):
         reservation = get_object_or_404(Reservation, id=reservation_id)
+        if reservation.user_id != request.user.id and request.user.role.lower() not in ["librarian", "admin"]:
+            return Response({"detail": "Not authorized."},
+                            status=status.HTTP_403_FORBIDDEN)
         if reservation.status != 'pending':
             return Response({"error": "Only pending reservations can be cancelled."},
                             status=status.HTTP_400_BAD_REQUEST)
-        reservation.status = 'cancelled'
-        reservation.save()
+        with transaction.atomic():
+            reservation.status = 'cancelled'
+            reservation.save()
+            outbox.enqueue('library_system.tasks.promote_reservation_queues', [reservation.book_id])
         return Response({"message": "Reservation cancelled successfully."}, status=status.HTTP_200_OK)
 
+class BulkCancelReservationsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        reservation_ids = request.data.get("reservation_ids")
+        # bool is an int subclass; JSON true must not stand for ID 1.
+        if (not isinstance(reservation_ids, list) or not reservation_ids
+                or not all(isinstance(i, int) and not isinstance(i, bool) for i in reservation_ids)):
+            return Response({"error": "reservation_ids must be a non-empty list of IDs."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        reservations = Reservation.objects.filter(id__in=reservation_ids, status='pending')
+        # Members may only cancel their own reservations.
+        if request.user.role.lower() not in ["librarian", "admin"]:
+            reservations = reservations.filter(user=request.user)
+
+        with transaction.atomic():
+            cancelled = cancel_reservations(reservations)
+            book_ids = sorted({book_id for _, book_id, _ in cancelled})
+            if book_ids:
+                outbox.enqueue('library_system.tasks.promote_reservation_queues', book_ids)
+        return Response({
+            "message": f"Cancelled {len(cancelled)} reservation(s).",
+            "cancelled_ids": [reservation_id for reservation_id, _, _ in cancelled],
+        }, status=status.HTTP_200_OK)
+
 class FulfillReservationView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request, reservation_id):
         reservation = get_object_or_404(Reservation, id=reservation_id)
         book = reservation.book
-        # Check read-only property
-        if book.available_copies <= 0:
+        # The copy comes from the reservation's pickup branch.
+        if available_copies(book.id, reservation.branch_id) <= 0:
+            return Response({"error": "No available copies to fulfill the reservation."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        # Create BorrowedBook (claims an available copy) and close the reservation together.
+        try:
+            with transaction.atomic():
+                borrowed_book = BorrowedBook.objects.create(
+                    user=reservation.user,
+                    book=book,
+                    branch_id=reservation.branch_id,
+                    borrowed_at=now(),
+                    due_date=now() + timedelta(days=14)
+                )
+                reservation.status = 'fulfilled'
+                reservation.save()
+        except ValueError:
+            # Another request claimed the last free copy since the check above.
             return Response({"error": "No available copies to fulfill the reservation."},
                             status=status.HTTP_400_BAD_REQUEST)
-        # Create BorrowedBook
-        borrowed_book = BorrowedBook.objects.create(
-            user=reservation.user,
-            book=book,
-            borrowed_at=now(),
-            due_date=now() + timedelta(days=14)
-        )
-        # Decrement the real field: 'quantity'
-        book.quantity -= 1
-        book.save()
-
-        reservation.status = 'fulfilled'
-        reservation.save()
         return Response({
             "message": "Reservation fulfilled and book issued.",
             "borrowed_book": BorrowedBookSerializer(borrowed_book).data
@@ -388,13 +851,16 @@ class ExportReservationsCSVView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, book_id):
-        reservations = Reservation.objects.filter(book__id=book_id)
         response = HttpResponse(content_type='text/csv')
         response['Content-Disposition'] = f'attachment; filename="reservations_book_{book_id}.csv"'
         writer = csv.writer(response)
         writer.writerow(['User', 'Reserved At', 'Status'])
-        for res in reservations:
-            writer.writerow([res.user.username, res.reserved_at, res.status])
+        filters = {"book_id": book_id}
+        branch_id = scope_branch_id(request)
+        if branch_id is not None:
+            filters["branch_id"] = branch_id
+        for _, _, username, _, _, reserved_at, reservation_status in reservation_history_rows(**filters):
+            writer.writerow([username, reserved_at, reservation_status])
         return response
 
 # ------------------------------
@@ -405,7 +871,7 @@ class BookReservationsView(APIView):
 
     def get(self, request, book_id):
         book = get_object_or_404(Book, id=book_id)
-        reservations = Reservation.objects.filter(book=book)
+        reservations = Reservation.objects.for_branch(scope_branch_id(request)).filter(book=book)
         
         # If user is not librarian/admin, show only their reservation(s)
         if request.user.role.lower() not in ["librarian", "admin"]:
@@ -426,10 +892,9 @@ class BookReservationsView(APIView):
         # Pagination
         paginator = PageNumberPagination()
         paginator.page_size = 10
-        paginated_reservations = paginator.paginate_queryset(reservations, request)
-        serializer = ReservationSerializer(paginated_reservations, many=True)
+        paginated_reservations = paginator.paginate_queryset(reservation_rows(reservations), request)
         
         return paginator.get_paginated_response({
             "book_title": book.title,
-            "reservations": serializer.data
+            "reservations": serialize_reservation_rows(paginated_reservations)
         })
@@ -1,7 +1,17 @@
 from __future__ import absolute_import, unicode_literals
 
-# This will make sure the app is always imported when
-# Django starts so that shared_task will use this app.
-from .celery import app as celery_app
+# The Celery app is loaded on first access rather than at import time, so web
+# processes that never publish a task do not import Celery and kombu at all.
+# Workers (``celery -A library_system``) and ``outbox.relay`` import
+# ``library_system.celery`` directly, which also sets it as the current app
+# for shared_task.
+
+
+def __getattr__(name):
+    if name == 'celery_app':
+        from .celery import app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 __all__ = ('celery_app',)
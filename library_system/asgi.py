@@ -10,7 +10,12 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 import os
 
 from django.core.asgi import get_asgi_application
+from django.urls import get_resolver
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'library_system.settings')
 
 application = get_asgi_application()
+
+# Serves the availability event streams (/api/events/); see library.events.
+# As in wsgi.py, import the URLconf and views while the worker boots.
+get_resolver().url_patterns
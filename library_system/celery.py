@@ -2,6 +2,7 @@ from __future__ import absolute_import, unicode_literals
 import os
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import worker_process_init
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "library_system.settings")
 
@@ -9,15 +10,60 @@ app = Celery("library_system")
 app.config_from_object("django.conf:settings", namespace="CELERY")
 app.autodiscover_tasks(lambda: ['library_system'])
 
+# Connects the task_prerun/task_postrun/task_failure instrumentation.
+from library_system import task_metrics  # noqa: E402,F401
+
+# Opt-in cProfile and SQL capture of tasks; connects nothing unless PROFILING_ENABLED.
+from library_system.profiling import install_task_hooks  # noqa: E402
+install_task_hooks()
+
 @app.task(bind=True)
 def debug_task(self):
     print(f"Request: {self.request!r}")
 
+@worker_process_init.connect
+def warm_notification_templates(**kwargs):
+    # Compile email templates once per worker process instead of on first send.
+    from library.notifications import warm_up
+    warm_up()
+
 @app.on_after_finalize.connect
 def setup_periodic_tasks(sender, **kwargs):
-    from library_system.tasks import send_overdue_notifications
+    from library_system.tasks import (
+        send_overdue_notifications,
+        rebuild_book_recommendations,
+        archive_closed_records,
+        auto_cancel_expired_reservations,
+        prune_task_runs,
+        relay_outbox,
+    )
+    sender.add_periodic_task(
+        10.0,
+        relay_outbox.s(),
+        name="Relay outbox messages every 10 seconds",
+    )
     sender.add_periodic_task(
         crontab(hour=8, minute=0),
         send_overdue_notifications.s(),
         name="Send overdue book reminders every day at 8 AM",
+    )
+    sender.add_periodic_task(
+        crontab(hour=3, minute=0),
+        rebuild_book_recommendations.s(),
+        name="Rebuild co-borrow recommendations every day at 3 AM",
+    )
+    sender.add_periodic_task(
+        crontab(hour=2, minute=0),
+        archive_closed_records.s(),
+        name="Archive closed loans, reservations and requests every day at 2 AM",
+    )
+    sender.add_periodic_task(
+        crontab(minute=15),
+        auto_cancel_expired_reservations.s(),
+        name="Cancel expired reservations every hour",
+    )
+    sender.add_periodic_task(
+        crontab(hour=4, minute=0),
+        prune_task_runs.s(),
+        name="Prune old task metrics every day at 4 AM",
     )
\ No newline at end of file
@@ -0,0 +1,192 @@
+"""
+Request latency and query instrumentation exposed in Prometheus text format.
+
+Each worker thread records into its own shard, so the hot path takes no locks;
+the /metrics view merges the shards of the current process when scraped.
+With several gunicorn workers every process keeps its own counters, the same
+way Prometheus' own client does without multiprocess mode.
+"""
+import hmac
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implicit.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_shards = []
+_local = threading.local()
+# The current request's QueryCounter. A context variable rather than a thread
+# local: under ASGI, concurrent requests run their sync code on one shared thread.
+_current_queries = ContextVar('metrics_queries', default=None)
+
+
+def _shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = {}
+        _shards.append(shard)  # list.append is atomic under the GIL
+    return shard
+
+
+class _Series:
+    __slots__ = ('buckets', 'count', 'duration', 'queries', 'db_time', 'response_bytes')
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.duration = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+        self.response_bytes = 0
+
+
+def record(view, method, status_code, duration, queries, db_time, response_bytes):
+    """Add one request to the calling thread's shard."""
+    shard = _shard()
+    key = (view, method, status_code)
+    series = shard.get(key)
+    if series is None:
+        series = shard[key] = _Series()
+    series.buckets[bisect_left(LATENCY_BUCKETS, duration)] += 1
+    series.count += 1
+    series.duration += duration
+    series.queries += queries
+    series.db_time += db_time
+    series.response_bytes += response_bytes
+
+
+def snapshot():
+    """Merge all thread shards into {(view, method, status): _Series}."""
+    merged = {}
+    for shard in list(_shards):
+        for key, series in list(shard.items()):
+            total = merged.get(key)
+            if total is None:
+                total = merged[key] = _Series()
+            total.buckets = [a + b for a, b in zip(total.buckets, series.buckets)]
+            total.count += series.count
+            total.duration += series.duration
+            total.queries += series.queries
+            total.db_time += series.db_time
+            total.response_bytes += series.response_bytes
+    return merged
+
+
+class QueryCounter:
+    """Queries executed, and their wall time, during the current request."""
+    __slots__ = ('count', 'duration')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+
+def _query_hook(execute, sql, params, many, context):
+    counter = _current_queries.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        counter.duration += perf_counter() - start
+        counter.count += 1
+
+
+@receiver(connection_created)
+def install_query_hook(sender, connection, **kwargs):
+    # A permanent execute wrapper per connection is far cheaper than entering
+    # ``connection.execute_wrapper()`` on every request: looking up the
+    # connection alone costs several microseconds.
+    if _query_hook not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_query_hook)
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        token = _current_queries.set(counter)
+        start = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_queries.reset(token)
+        duration = perf_counter() - start
+
+        match = request.resolver_match
+        view = (match.view_name or match.route) if match else '<unresolved>'
+        if response.streaming:
+            size = int(response.get('Content-Length') or 0)
+        else:
+            size = len(response.content)
+        record(view, request.method, response.status_code, duration,
+               counter.count, counter.duration, size)
+        return response
+
+
+def _labels(view, method, status_code, **extra):
+    view = view.replace('\\', '\\\\').replace('"', '\\"')
+    pairs = [f'view="{view}"', f'method="{method}"', f'status="{status_code}"']
+    pairs += [f'{name}="{value}"' for name, value in extra.items()]
+    return '{' + ','.join(pairs) + '}'
+
+
+def render_prometheus(series_by_key):
+    lines = [
+        '# HELP django_http_request_duration_seconds Request latency by view.',
+        '# TYPE django_http_request_duration_seconds histogram',
+    ]
+    bounds = [str(b) for b in LATENCY_BUCKETS] + ['+Inf']
+    for (view, method, status_code), series in sorted(series_by_key.items()):
+        cumulative = 0
+        for bound, hits in zip(bounds, series.buckets):
+            cumulative += hits
+            lines.append(
+                f'django_http_request_duration_seconds_bucket'
+                f'{_labels(view, method, status_code, le=bound)} {cumulative}'
+            )
+        labels = _labels(view, method, status_code)
+        lines.append(f'django_http_request_duration_seconds_sum{labels} {series.duration:.6f}')
+        lines.append(f'django_http_request_duration_seconds_count{labels} {series.count}')
+
+    counters = (
+        ('django_http_db_queries_total', 'Database queries executed by view.', 'queries', '{}'),
+        ('django_http_db_duration_seconds_total', 'Time spent in database queries by view.', 'db_time', '{:.6f}'),
+        ('django_http_response_size_bytes_total', 'Response body bytes sent by view.', 'response_bytes', '{}'),
+    )
+    for name, help_text, attr, fmt in counters:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for (view, method, status_code), series in sorted(series_by_key.items()):
+            value = fmt.format(getattr(series, attr))
+            lines.append(f'{name}{_labels(view, method, status_code)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def _may_scrape(request):
+    # The series name every endpoint, so the view never fails open: without a
+    # token only staff signed in to the admin can read it.
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    user = getattr(request, 'user', None)
+    return bool(user and user.is_authenticated and user.is_staff)
+
+
+def metrics_view(request):
+    if not _may_scrape(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        render_prometheus(snapshot()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
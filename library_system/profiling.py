@@ -0,0 +1,205 @@
+"""
+On-demand profiling of individual requests and Celery tasks.
+
+With PROFILING_ENABLED, a request is profiled when an admin sends the
+``X-Profile`` header, or when it is picked by PROFILING_SAMPLE_RATE. Tasks are
+profiled when published with a ``profile`` header
+(``task.apply_async(headers={'profile': True})``) or picked by
+PROFILING_TASK_SAMPLE_RATE. A profile holds the cProfile statistics and every
+SQL query with its time and the application frames that issued it. It is
+saved as a ``ProfileRecord``, and only the newest PROFILING_BUFFER_SIZE are
+kept, so the table is a ring buffer shared by web and worker processes.
+Admins browse them at /api/profiles/ and download the raw statistics for
+pstats or snakeviz. A profiled response carries ``X-Profile-Id``.
+
+With PROFILING_ENABLED off, the middleware removes itself at startup
+(MiddlewareNotUsed) and no task signal handlers are connected, so there is no
+per-request or per-task cost at all.
+"""
+import cProfile
+import io
+import logging
+import marshal
+import pstats
+import random
+import traceback
+from contextlib import ExitStack
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.timezone import now
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'X-Profile'
+ID_HEADER = 'X-Profile-Id'
+# Kept per profile: queries (with their stacks), report lines and stack frames per query.
+MAX_QUERIES = 500
+STATS_LINES = 60
+STACK_DEPTH = 8
+
+
+def is_profiling_staff(user):
+    return bool(user and user.is_authenticated and (user.is_staff or user.role.lower() == 'admin'))
+
+
+def _application_stack():
+    # Frames from this project only; Django, DRF and the capture itself are noise.
+    base_dir = str(settings.BASE_DIR)
+    frames = [
+        f"{frame.filename[len(base_dir) + 1:]}:{frame.lineno} in {frame.name}"
+        for frame in traceback.extract_stack()
+        if frame.filename.startswith(base_dir) and 'site-packages' not in frame.filename
+        and not frame.filename.endswith('profiling.py')
+    ]
+    return frames[-STACK_DEPTH:]
+
+
+class Capture:
+    """cProfile and the SQL log of everything run inside ``with capture:``."""
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.queries = []
+        self.query_count = 0
+        self.query_time = 0.0
+        self._stack = ExitStack()
+
+    def __enter__(self):
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self._record_query))
+        try:
+            self.profiler.enable()
+        except ValueError:
+            # Another profiler is active in this thread (nested capture).
+            self.profiler = None
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profiler is not None:
+            self.profiler.disable()
+        self._stack.close()
+
+    def _record_query(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = perf_counter() - start
+            self.query_count += 1
+            self.query_time += elapsed
+            if len(self.queries) < MAX_QUERIES:
+                self.queries.append({'sql': sql, 'time': round(elapsed, 6), 'stack': _application_stack()})
+
+    def _stats(self):
+        if self.profiler is None:
+            return '', None
+        self.profiler.create_stats()
+        # Marshalled first: pstats.Stats takes the statistics out of the profiler.
+        raw_stats = marshal.dumps(self.profiler.stats)
+        report = io.StringIO()
+        pstats.Stats(self.profiler, stream=report).sort_stats('cumulative').print_stats(STATS_LINES)
+        return report.getvalue(), raw_stats
+
+    def save(self, kind, name, trigger, started_at, duration, status_code=None):
+        from library.models import ProfileRecord
+
+        stats, raw_stats = self._stats()
+        record = ProfileRecord.objects.create(
+            kind=kind, name=name[:255], trigger=trigger, started_at=started_at,
+            duration=duration, status_code=status_code,
+            query_count=self.query_count, query_time=self.query_time,
+            queries=self.queries, stats=stats, raw_stats=raw_stats,
+        )
+        keep = getattr(settings, 'PROFILING_BUFFER_SIZE', 50)
+        ProfileRecord.objects.filter(id__lte=record.id - keep).delete()
+        return record
+
+
+def _sampled(setting):
+    rate = getattr(settings, setting, 0)
+    return rate > 0 and random.random() < rate
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def _trigger(self, request):
+        if HEADER in request.headers:
+            # API clients authenticate with a JWT, which DRF only reads in the view.
+            from rest_framework_simplejwt.authentication import JWTAuthentication
+            user = getattr(request, 'user', None)
+            if not is_profiling_staff(user):
+                try:
+                    authenticated = JWTAuthentication().authenticate(request)
+                except Exception:
+                    authenticated = None
+                user = authenticated[0] if authenticated else None
+            if is_profiling_staff(user):
+                return 'header'
+        if _sampled('PROFILING_SAMPLE_RATE'):
+            return 'sample'
+        return None
+
+    def __call__(self, request):
+        trigger = self._trigger(request)
+        if trigger is None:
+            return self.get_response(request)
+
+        started_at = now()
+        start = perf_counter()
+        with Capture() as capture:
+            response = self.get_response(request)
+        duration = perf_counter() - start
+
+        match = request.resolver_match
+        view = (match.view_name or match.route) if match else request.path
+        try:
+            record = capture.save('request', f'{request.method} {view}', trigger,
+                                  started_at, duration, response.status_code)
+        except Exception:
+            logger.exception("Could not save the profile of %s %s", request.method, request.path)
+        else:
+            response[ID_HEADER] = str(record.pk)
+        return response
+
+
+# Celery tasks. Connected by install_task_hooks() only when profiling is enabled.
+
+_task_captures = {}
+
+
+def _start_task_capture(task_id=None, task=None, **kwargs):
+    request = task.request
+    requested = request.get('profile') or (request.get('headers') or {}).get('profile')
+    trigger = 'header' if requested else ('sample' if _sampled('PROFILING_TASK_SAMPLE_RATE') else None)
+    if trigger is None:
+        return
+    capture = Capture()
+    _task_captures[task_id] = (capture, trigger, now(), perf_counter())
+    capture.__enter__()
+
+
+def _finish_task_capture(task_id=None, task=None, **kwargs):
+    entry = _task_captures.pop(task_id, None)
+    if entry is None:
+        return
+    capture, trigger, started_at, start = entry
+    capture.__exit__(None, None, None)
+    try:
+        capture.save('task', task.name, trigger, started_at, perf_counter() - start)
+    except Exception:
+        logger.exception("Could not save the profile of task %s", task.name)
+
+
+def install_task_hooks():
+    if not getattr(settings, 'PROFILING_ENABLED', False):
+        return
+    from celery.signals import task_postrun, task_prerun
+    task_prerun.connect(_start_task_capture, weak=False)
+    task_postrun.connect(_finish_task_capture, weak=False)
@@ -1,7 +1,8 @@
 import os
 from datetime import timedelta
 from pathlib import Path
-from django.utils.timezone import now
+
+from corsheaders.defaults import default_headers
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -25,17 +26,24 @@ INSTALLED_APPS = [
     'rest_framework_simplejwt',
     'corsheaders',
     'library',
-    'celery',
-    'django_celery_beat',
 ]
 
+# django_celery_beat is only needed to edit schedules in the admin and run
+# `celery beat -S django`; its models import Celery into every web process.
+# The default schedule is registered in library_system/celery.py.
+if os.getenv('CELERY_BEAT_DATABASE_SCHEDULER') == '1':
+    INSTALLED_APPS.append('django_celery_beat')
+
 MIDDLEWARE = [
+    'library_system.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'library_system.profiling.ProfilingMiddleware',  # removes itself unless PROFILING_ENABLED
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -67,6 +75,25 @@ DATABASES = {
     }
 }
 
+# Shared cache: Redis when REDIS_URL is set, per-process memory otherwise
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Seconds a rendered anonymous catalog snapshot is kept
+CATALOG_CACHE_TTL = 300
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',
@@ -83,6 +110,15 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [BASE_DIR / "static"]
 STATIC_ROOT = BASE_DIR / "staticfiles"
 
+# collectstatic writes hashed copies, pre-compressed with gzip (and brotli
+# when the Brotli package is installed), plus a manifest; WhiteNoise serves the
+# hashed names with an immutable ten-year Cache-Control (max-age=315360000).
+# Run collectstatic before serving (render.yaml does).
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage"},
+}
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / "media"
 
@@ -91,6 +127,9 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'library.User'
 
 CORS_ALLOW_ALL_ORIGINS = True  # Change to specific origins in production
+# Idempotency-Key lets clients retry circulation POSTs safely (library.idempotency)
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['idempotent-replayed']
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
@@ -99,6 +138,10 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.AllowAny',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'library.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
 }
 
 SIMPLE_JWT = {
@@ -117,6 +160,54 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
 
+# Outbox messages published per relay transaction
+OUTBOX_BATCH_SIZE = 100
+
+# Bearer token required by /metrics; without one only admin-site staff can read it
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Days of Celery task run records kept for the task metrics
+TASK_METRICS_RETENTION_DAYS = 14
+
+# Co-borrow recommendations: neighbours kept per book, and source books per build pass
+RECOMMENDATION_TOP_K = 10
+RECOMMENDATION_SHARD_SIZE = 5000
+
+# Availability event streams (/api/events/): keep-alive interval, how long a
+# stream lasts before the client reconnects, and books per stream
+EVENTS_HEARTBEAT_SECONDS = 15
+EVENTS_STREAM_MAX_SECONDS = 300
+EVENTS_MAX_BOOKS = 50
+# Without REDIS_URL, events reach only streams in the publishing process. Set
+# EVENTS_SINGLE_PROCESS=1 when one ASGI process serves both the API and the
+# streams (development); otherwise streams are refused with 503.
+EVENTS_SINGLE_PROCESS = os.getenv('EVENTS_SINGLE_PROCESS') == '1'
+
+# Closed loans, reservations and borrow requests older than this many days are
+# moved to the archive tables, in batches of ARCHIVE_BATCH_SIZE rows
+ARCHIVE_AFTER_DAYS = 365
+ARCHIVE_BATCH_SIZE = 1000
+ARCHIVE_MAX_BATCHES = 50  # per table and task run
+
+# Days a pending reservation is held before it expires, per book category
+RESERVATION_EXPIRY_DAYS = {
+    'default': 3,
+}
+
+# On-demand profiling (library_system.profiling): requests sent by admins with
+# an X-Profile header, tasks published with a `profile` header, plus a sampled
+# fraction of each. The newest PROFILING_BUFFER_SIZE profiles are kept.
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED') == '1'
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_TASK_SAMPLE_RATE = float(os.getenv('PROFILING_TASK_SAMPLE_RATE', '0'))
+PROFILING_BUFFER_SIZE = 50
+
+# Seconds a response is kept for replay to retries with the same Idempotency-Key
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24
+
+# Send one reminder per patron listing all their loans instead of one per loan
+NOTIFICATION_DIGEST = True
+
 # Email Configuration (SMTP with Gmail)
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
@@ -0,0 +1,128 @@
+"""
+Celery task instrumentation.
+
+Publishers stamp every message with an ``enqueued_at`` header; workers record
+one ``TaskRun`` row per execution with its queue wait, run time, retry count
+and the ``processed`` item count reported in the task's result dict.
+``summarize`` turns those rows into per-task figures for sizing worker pools.
+"""
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from celery.signals import before_task_publish, task_failure, task_postrun, task_prerun
+
+logger = logging.getLogger(__name__)
+
+_running = {}
+_errors = {}
+
+
+@before_task_publish.connect
+def stamp_enqueued_at(headers=None, **kwargs):
+    if headers is not None:
+        headers.setdefault('enqueued_at', time.time())
+
+
+def _queue_wait(request, started):
+    enqueued_at = request.get('enqueued_at') or (request.get('headers') or {}).get('enqueued_at')
+    if not enqueued_at:
+        return None
+    ready_at = enqueued_at
+    if request.eta:
+        # Delayed tasks are not waiting in the queue before their ETA.
+        eta = request.eta if isinstance(request.eta, datetime) else datetime.fromisoformat(request.eta)
+        ready_at = max(ready_at, eta.timestamp())
+    return max(0.0, started - ready_at)
+
+
+@task_prerun.connect
+def record_start(task_id=None, task=None, **kwargs):
+    started = time.time()
+    _running[task_id] = (started, time.perf_counter(), _queue_wait(task.request, started))
+
+
+@task_failure.connect
+def record_failure(task_id=None, exception=None, **kwargs):
+    _errors[task_id] = repr(exception)
+
+
+@task_postrun.connect
+def record_finish(task_id=None, task=None, retval=None, state=None, **kwargs):
+    start = _running.pop(task_id, None)
+    error = _errors.pop(task_id, '')
+    if start is None:
+        return
+    started, perf_start, queue_wait = start
+    processed = retval.get('processed') if isinstance(retval, dict) else None
+
+    from library.models import TaskRun
+    try:
+        TaskRun.objects.create(
+            task_name=task.name,
+            task_id=task_id,
+            state=state or '',
+            started_at=datetime.fromtimestamp(started, tz=timezone.utc),
+            duration=time.perf_counter() - perf_start,
+            queue_wait=queue_wait,
+            retries=task.request.retries or 0,
+            processed=processed,
+            error=error,
+        )
+    except Exception as e:
+        # Instrumentation must never fail the task it measures.
+        logger.warning("Could not record run of %s: %s", task.name, str(e))
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def summarize(hours=24):
+    """Per-task run statistics for the last ``hours`` hours, busiest task first."""
+    from django.utils.timezone import now
+    from library.models import TaskRun
+
+    since = now() - timedelta(hours=hours)
+    runs = {}
+    rows = TaskRun.objects.filter(started_at__gte=since).values_list(
+        'task_name', 'state', 'duration', 'queue_wait', 'processed'
+    )
+    for name, state, duration, queue_wait, processed in rows.iterator():
+        stats = runs.setdefault(name, {
+            'durations': [], 'waits': [], 'failures': 0, 'retries': 0, 'processed': 0,
+        })
+        stats['durations'].append(duration)
+        if queue_wait is not None:
+            stats['waits'].append(queue_wait)
+        if state == 'FAILURE':
+            stats['failures'] += 1
+        elif state == 'RETRY':
+            stats['retries'] += 1
+        stats['processed'] += processed or 0
+
+    summary = []
+    for name, stats in runs.items():
+        busy = sum(stats['durations'])
+        summary.append({
+            'task': name,
+            'runs': len(stats['durations']),
+            'failures': stats['failures'],
+            'retries': stats['retries'],
+            'runs_per_hour': round(len(stats['durations']) / hours, 2),
+            'duration_p50': _percentile(stats['durations'], 50),
+            'duration_p95': _percentile(stats['durations'], 95),
+            'duration_max': max(stats['durations']),
+            'queue_wait_p50': _percentile(stats['waits'], 50),
+            'queue_wait_p95': _percentile(stats['waits'], 95),
+            'processed': stats['processed'],
+            # Items handled per second of worker time; divide demand by this to size a pool.
+            'processed_per_second': round(stats['processed'] / busy, 2) if busy else None,
+            # Average number of workers this task kept busy over the window.
+            'busy_workers': round(busy / (hours * 3600), 4),
+        })
+    summary.sort(key=lambda row: row['busy_workers'], reverse=True)
+    return summary
@@ -1,98 +1,102 @@
 from celery import shared_task  
-from django.core.mail import send_mail, BadHeaderError, EmailMultiAlternatives
+from smtplib import SMTPException
+from django.core.mail import BadHeaderError
 from django.conf import settings
 from django.utils.timezone import now, timezone
-from django.template.loader import render_to_string
-from library.models import BorrowedBook, Reservation
+from library.models import Book, BorrowedBook, Reservation, TaskRun, User
+from library.reservations import books_ready_for_queue, expire_reservations
+from library.recommendations import rebuild_recommendations
+from library import archive, notifications, outbox
 import logging
 from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
 
 logger = logging.getLogger(__name__)
 
-@shared_task
-def send_borrow_email(user_email, book_title, due_date):
-    subject = '📚 Book Borrowed Confirmation'
-    from_email = settings.DEFAULT_FROM_EMAIL
-    to = [user_email]
+NOTIFICATION_BATCH_SIZE = 500
+
+@shared_task(bind=True, autoretry_for=(SMTPException, OSError), retry_backoff=True, max_retries=5)
+def send_borrow_email(self, user_email, book_title, due_date):
+    # Optional: extract name from email
+    username = user_email.split('@')[0].capitalize()
 
+    [msg] = notifications.render_batch('borrow_confirmation', [(user_email, {
+        'username': username,
+        'book_title': book_title,
+        'due_date': due_date,
+        'return_url': 'http://127.0.0.1:3000/return-book'  # Update if needed
+    })])
     try:
-        # Optional: extract name from email
-        username = user_email.split('@')[0].capitalize()
-
-        # Render HTML template
-        html_content = render_to_string('emails/borrow_confirmation.html', {
-            'username': username,
-            'book_title': book_title,
-            'due_date': due_date,
-            'return_url': 'http://127.0.0.1:3000/return-book'  # Update if needed
-        })
-
-        # Create email message with both plain text and HTML versions
-        msg = EmailMultiAlternatives(
-            subject, 
-            f'You have borrowed "{book_title}". The due date for return is {due_date}.', 
-            from_email, 
-            to
-        )
-        msg.attach_alternative(html_content, "text/html")
         msg.send()
-
-        logger.info("Borrow confirmation email sent to %s", user_email)
-        return f'Borrow confirmation email sent to {user_email}'
-
     except BadHeaderError:
+        # Not retryable: fail the task so it shows up in the task metrics.
         logger.error("Invalid header detected for %s", user_email)
-        return 'Invalid email header detected'
+        raise
+
+    logger.info("Borrow confirmation email sent to %s", user_email)
+    return {'processed': 1, 'sent': 1}
 
-    except Exception as e:
-        logger.error("Error sending email to %s: %s", user_email, str(e))
-        return f'Error sending email: {str(e)}'
+def _send_loan_reminders(kind, loans):
+    """Send one ``kind`` reminder per open loan, rendered and delivered in batches."""
+    processed = sent = failed = 0
+    batch = []
+    for record in loans.iterator(chunk_size=NOTIFICATION_BATCH_SIZE):
+        processed += 1
+        if record.user and record.user.email:
+            batch.append((record.user.email, {
+                'username': record.user.username,
+                'book_title': record.book.title,
+                'due_date': record.due_date.strftime("%Y-%m-%d"),
+            }))
+        if len(batch) >= NOTIFICATION_BATCH_SIZE:
+            batch_sent, batch_failed = notifications.send_batch(kind, batch)
+            sent, failed, batch = sent + batch_sent, failed + batch_failed, []
+    batch_sent, batch_failed = notifications.send_batch(kind, batch)
+    return {'processed': processed, 'sent': sent + batch_sent, 'failed': failed + batch_failed}
+
+def _send_loan_digests(kind, loans):
+    """
+    Send one ``kind`` digest per patron listing all of their matching loans.
+    Loans are streamed in user order and grouped as they arrive, so memory
+    holds at most one batch of digests.
+    """
+    rows = (
+        loans.exclude(user__email='')
+        .order_by('user_id', 'due_date', 'id')
+        .values_list('user_id', 'user__username', 'user__email', 'book__title', 'due_date')
+    )
+    processed = sent = failed = 0
+    batch = []
+    for _, group in groupby(rows.iterator(chunk_size=NOTIFICATION_BATCH_SIZE), key=itemgetter(0)):
+        items = []
+        for _, username, email, book_title, due_date in group:
+            items.append({'book_title': book_title, 'due_date': due_date.strftime("%Y-%m-%d")})
+        processed += len(items)
+        batch.append((email, {'username': username, 'items': items}))
+        if len(batch) >= NOTIFICATION_BATCH_SIZE:
+            batch_sent, batch_failed = notifications.send_batch(kind, batch)
+            sent, failed, batch = sent + batch_sent, failed + batch_failed, []
+    batch_sent, batch_failed = notifications.send_batch(kind, batch)
+    return {'processed': processed, 'sent': sent + batch_sent, 'failed': failed + batch_failed}
 
 @shared_task
 def send_overdue_notifications():
     overdue_books = BorrowedBook.objects.filter(
         due_date__lt=now(), returned_at__isnull=True
     ).select_related("user", "book")
-
-    count = 0
-    for record in overdue_books:
-        if record.user and record.user.email:
-            subject = 'Overdue Book Reminder'
-            message = f'The book "{record.book.title}" is overdue. Please return it as soon as possible.'
-            from_email = settings.DEFAULT_FROM_EMAIL
-            try:
-                send_mail(subject, message, from_email, [record.user.email], fail_silently=False)
-                count += 1
-            except BadHeaderError:
-                logger.warning("Invalid header for email %s", record.user.email)
-                continue
-            except Exception as e:
-                logger.error("Error sending overdue email to %s: %s", record.user.email, str(e))
-                continue
-    return f'Sent {count} overdue reminders'
+    if getattr(settings, 'NOTIFICATION_DIGEST', True):
+        return _send_loan_digests('overdue_digest', overdue_books)
+    return _send_loan_reminders('overdue_reminder', overdue_books)
 
 @shared_task
 def send_due_date_reminders():
     upcoming_due_books = BorrowedBook.objects.filter(
         due_date__date=now().date(), returned_at__isnull=True
     ).select_related("user", "book")
-
-    count = 0
-    for record in upcoming_due_books:
-        if record.user and record.user.email:
-            subject = 'Upcoming Due Date Reminder'
-            message = f'The book "{record.book.title}" is due today. Please return it on time to avoid a fine.'
-            from_email = settings.DEFAULT_FROM_EMAIL
-            try:
-                send_mail(subject, message, from_email, [record.user.email], fail_silently=False)
-                count += 1
-            except BadHeaderError:
-                logger.warning("Invalid header for email %s", record.user.email)
-                continue
-            except Exception as e:
-                logger.error("Error sending due date email to %s: %s", record.user.email, str(e))
-                continue
-    return f'Sent {count} due date reminders'
+    if getattr(settings, 'NOTIFICATION_DIGEST', True):
+        return _send_loan_digests('due_date_digest', upcoming_due_books)
+    return _send_loan_reminders('due_date_reminder', upcoming_due_books)
 
 # ------------------------------
 # New Feature: Auto-Cancel Expired Reservations
@@ -100,13 +104,97 @@ def send_due_date_reminders():
 @shared_task
 def auto_cancel_expired_reservations():
     """
-    Automatically cancel reservations that have been pending for more than a specified period.
-    Change 'expiration_period' as needed.
+    Cancel every reservation whose category hold window (RESERVATION_EXPIRY_DAYS)
+    has elapsed in one set-based pass, then fan out notifications to the affected
+    patrons and promote the next reservation in each affected book's queue.
+    """
+    expired = expire_reservations()
+    for start in range(0, len(expired), NOTIFICATION_BATCH_SIZE):
+        notify_expired_reservations.delay(expired[start:start + NOTIFICATION_BATCH_SIZE])
+
+    book_ids = sorted({book_id for _, book_id, _ in expired})
+    for start in range(0, len(book_ids), NOTIFICATION_BATCH_SIZE):
+        promote_reservation_queues.delay(book_ids[start:start + NOTIFICATION_BATCH_SIZE])
+
+    logger.info("Auto-cancelled %d expired reservations", len(expired))
+    return {'processed': len(expired), 'cancelled': len(expired)}
+
+@shared_task(autoretry_for=(SMTPException, OSError), retry_backoff=True, max_retries=5)
+def notify_expired_reservations(rows):
+    """Email the owners of a batch of expired reservations over one mail connection."""
+    user_ids = {user_id for _, _, user_id in rows}
+    book_ids = {book_id for _, book_id, _ in rows}
+    users = {
+        user_id: (username, email)
+        for user_id, username, email in User.objects.filter(id__in=user_ids).exclude(email='')
+        .values_list('id', 'username', 'email')
+    }
+    titles = dict(Book.objects.filter(id__in=book_ids).values_list('id', 'title'))
+
+    items = [
+        (users[user_id][1], {'username': users[user_id][0], 'book_title': titles.get(book_id, "a book")})
+        for _, book_id, user_id in rows
+        if user_id in users
+    ]
+    sent, failed = notifications.send_batch('reservation_expired', items)
+    return {'processed': len(rows), 'sent': sent, 'failed': failed}
+
+@shared_task(autoretry_for=(SMTPException, OSError), retry_backoff=True, max_retries=5)
+def promote_reservation_queues(book_ids):
+    """Tell the patron at the head of each affected book's queue at a branch when a copy is free there."""
+    heads = books_ready_for_queue(book_ids)
+    items = [
+        (reservation.user.email, {'username': reservation.user.username, 'book_title': reservation.book.title})
+        for reservation in heads.values()
+        if reservation.user.email
+    ]
+    sent, failed = notifications.send_batch('reservation_available', items)
+    return {'processed': len(book_ids), 'sent': sent, 'failed': failed}
+
+# ------------------------------
+# Co-borrow Recommendations
+# ------------------------------
+@shared_task
+def rebuild_book_recommendations():
+    """
+    Rebuild the "patrons who borrowed this also borrowed" neighbours of every book
+    from the full loan history.
+    """
+    count = rebuild_recommendations()
+    logger.info("Rebuilt recommendations for %d books", count)
+    return {'processed': count}
+
+# ------------------------------
+# Archival of Closed Records
+# ------------------------------
+@shared_task
+def archive_closed_records():
     """
-    expiration_period = timedelta(days=3)  # Cancel if pending > 3 days
-    expiration_time = now() - expiration_period
-    expired_reservations = Reservation.objects.filter(status='pending', reserved_at__lt=expiration_time)
-    count = expired_reservations.count()
-    expired_reservations.update(status='cancelled')
-    logger.info("Auto-cancelled %d expired reservations", count)
-    return f'Auto-cancelled {count} expired reservations'
+    Move returned loans and closed reservations and borrow requests older than
+    ARCHIVE_AFTER_DAYS to the archive tables, in batches. A run stops after
+    ARCHIVE_MAX_BATCHES batches per table and queues another if rows remain.
+    """
+    moved, remaining = archive.archive_closed_records()
+    if remaining:
+        archive_closed_records.delay()
+    logger.info("Archived %s", moved)
+    return {'processed': sum(moved.values()), 'moved': moved}
+
+# ------------------------------
+# Task Metrics Retention
+# ------------------------------
+@shared_task
+def prune_task_runs():
+    """Delete task run records older than TASK_METRICS_RETENTION_DAYS."""
+    cutoff = now() - timedelta(days=getattr(settings, 'TASK_METRICS_RETENTION_DAYS', 14))
+    deleted, _ = TaskRun.objects.filter(started_at__lt=cutoff).delete()
+    return {'processed': deleted}
+
+# ------------------------------
+# Transactional Outbox Relay
+# ------------------------------
+@shared_task
+def relay_outbox():
+    """Publish committed outbox messages (see library.outbox) to the broker."""
+    published = outbox.relay()
+    return {'processed': published}
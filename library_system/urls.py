@@ -3,6 +3,9 @@ from django.urls import path, include
 from django.http import HttpResponse
 from django.conf import settings
 from django.conf.urls.static import static
+from library.storage import COVERS_DIR
+from library.views import serve_cover
+from library_system.metrics import metrics_view
 
 def home(request):
     return HttpResponse("Welcome to the Library Management System!")
@@ -10,6 +13,8 @@ def home(request):
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('library.urls')),  # All API URLs start with /api/
+    path('metrics', metrics_view, name='metrics'),
+    path(f"{settings.MEDIA_URL.strip('/')}/{COVERS_DIR}/<path:name>", serve_cover, name='cover_image'),
     path('', home),  # Optional: A simple home page
 ]
 
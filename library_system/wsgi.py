@@ -10,7 +10,12 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/wsgi/
 import os
 
 from django.core.wsgi import get_wsgi_application
+from django.urls import get_resolver
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'library_system.settings')
 
 application = get_wsgi_application()
+
+# Import the URLconf, and with it every view module, while the worker boots
+# instead of during the first request it serves.
+get_resolver().url_patterns